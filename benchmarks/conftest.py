@@ -0,0 +1,71 @@
+"""
+Pytest configuration and fixtures for the NetHang microbenchmarks.
+
+The fixtures synthesize the outputs of 'iptables -nvxL FORWARD -t mangle' and
+'tc -s qdisc show' for a given number of marks, so the monitor parser can be
+benchmarked without root privileges nor real traffic.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import random
+import pytest
+import yaml
+
+LAN_IFACE = 'eth1'
+WAN_IFACE = 'eth0'
+FIRST_MARK = 9528
+HANDLE = 9527
+
+MODELS_FILES = [
+    os.path.join(os.path.dirname(__file__), '..', 'config_files', 'models.yaml'),
+    os.path.join(os.path.dirname(__file__), '..', 'config_files', 'models_v0.2.0.yaml'),
+]
+
+
+def iptables_output(marks: int, seed: int = 0) -> str:
+    """Synthesize the mangle FORWARD chain with one MARK rule per mark and direction"""
+    rng = random.Random(seed)
+    lines = [
+        'Chain FORWARD (policy ACCEPT 0 packets, 0 bytes)',
+        '    pkts      bytes target     prot opt in     out     source               destination',
+    ]
+    for mark in range(FIRST_MARK, FIRST_MARK + marks):
+        for in_iface, out_iface in [(LAN_IFACE, WAN_IFACE), (WAN_IFACE, LAN_IFACE)]:
+            packets = rng.randint(0, 10 ** 7)
+            lines.append('{:>8} {:>10} MARK       all  --  {:<6} {:<6}  0.0.0.0/0            0.0.0.0/0            MARK set {}'.format(
+                packets, packets * rng.randint(64, 1500), in_iface, out_iface, hex(mark)))
+    return '\n'.join(lines) + '\n'
+
+
+def tc_output(marks: int, seed: int = 0) -> str:
+    """Synthesize the qdiscs of an interface with one netem leaf per mark"""
+    rng = random.Random(seed)
+    lines = [
+        f'qdisc htb {HANDLE}: root refcnt 2 r2q 10 default 0xffff direct_packets_stat 0 direct_qlen 1000',
+        ' Sent 0 bytes 0 pkt (dropped 0, overlimits 0 requeues 0)',
+        ' backlog 0b 0p requeues 0',
+    ]
+    for mark in range(FIRST_MARK, FIRST_MARK + marks):
+        packets = rng.randint(0, 10 ** 7)
+        lines.append(f'qdisc netem {mark}: parent {HANDLE}:{mark} limit 1000 delay 50ms  10ms loss 1%')
+        lines.append(f' Sent {packets * 1000} bytes {packets} pkt (dropped {rng.randint(0, 1000)}, overlimits 0 requeues 0)')
+        lines.append(f' backlog {rng.randint(0, 100) * 1500}b {rng.randint(0, 100)}p requeues 0')
+    return '\n'.join(lines) + '\n'
+
+
+def load_models(models_file: str) -> dict:
+    with open(models_file, 'r') as f:
+        return yaml.safe_load(f)['models']
+
+
+@pytest.fixture(params=[32, 512, pytest.param(4096, marks=pytest.mark.slow)], ids=lambda marks: f'{marks}marks')
+def marks(request):
+    return request.param
+
+
+@pytest.fixture(params=MODELS_FILES, ids=os.path.basename)
+def models(request):
+    return load_models(request.param)
@@ -0,0 +1,10 @@
+"""
+Network namespace benchmarks
+
+This package builds a LAN <-> router <-> WAN topology of network namespaces
+and drives a real NetHang server running in the router namespace through its
+REST API. It needs root privileges and a Linux kernel with network namespaces.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
@@ -0,0 +1,114 @@
+"""
+REST Driver
+
+This module drives a NetHang server through its REST API, the same way the
+dashboard does.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import re
+import time
+import requests
+from typing import Dict, List, Optional
+
+class RestDriver:
+    """Client of the NetHang REST API"""
+
+    def __init__(self, base_url: str, username: str = 'admin', password: str = 'admin', timeout: float = 10):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _api(self, method: str, path: str, **kwargs) -> Dict:
+        """Call an API endpoint, raise if it reports an error"""
+        result = self._request(method, path, **kwargs).json()
+        if isinstance(result, dict) and result.get('status') == 'error':
+            raise RuntimeError(f"{method} {path} failed: {result.get('message')}")
+        return result
+
+    def wait_ready(self, timeout: float = 30):
+        """Wait for the server to accept connections"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.session.get(self.base_url + '/login', timeout=1)
+                return
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'NetHang not reachable at {self.base_url}')
+                time.sleep(0.2)
+
+    def login(self):
+        self._request('POST', '/login', data={'username': self.username, 'password': self.password})
+        # The API redirects to the login page without a session
+        response = self.session.get(self.base_url + '/api/paths', timeout=self.timeout, allow_redirects=False)
+        if response.status_code != 200:
+            raise RuntimeError('Login failed')
+
+    def get_paths(self) -> List[Dict]:
+        return self._api('GET', '/api/paths')
+
+    def add_path(self, filter_settings: Dict, simu_settings: Dict, name: str = '') -> int:
+        """Add a path, get its ID"""
+        path = {
+            'name': name,
+            'status': 'inactive',
+            'filter_settings': filter_settings,
+            'simu_settings': simu_settings,
+        }
+        return self._api('POST', '/api/paths', json=path)['id']
+
+    def update_path(self, path: Dict):
+        self._api('PUT', '/api/paths', json=path)
+
+    def delete_path(self, id: int):
+        self._api('DELETE', '/api/paths', params={'id': id})
+
+    def wait_job(self, job: Dict, timeout: Optional[float] = None, interval: float = 0.02) -> Dict:
+        """Wait for a job of the server to complete, raise if it failed"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        while job['status'] in ('queued', 'running'):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job['operation']} {job['id']} not completed")
+            time.sleep(interval)
+            job = self._api('GET', f"/api/jobs/{job['id']}")['job']
+        if job['status'] != 'succeeded':
+            raise RuntimeError(f"Job {job['operation']} {job['id']} {job['status']}: {job.get('error')}")
+        return job
+
+    def activate(self, id: int, speed: float = 1.0, cycles: Optional[int] = None) -> Dict:
+        """Activate a path, once the job applying it completed"""
+        return self.wait_job(self._api('POST', f'/api/paths/{id}/activate', json={'speed': speed, 'cycles': cycles})['job'])
+
+    def deactivate(self, id: int) -> Dict:
+        """Deactivate a path, once the job applying it completed"""
+        return self.wait_job(self._api('POST', f'/api/paths/{id}/deactivate')['job'])
+
+    def get_perf(self) -> Dict:
+        return self._api('GET', '/api/debug/perf')
+
+    def reset_perf(self):
+        self._api('DELETE', '/api/debug/perf')
+
+    def get_metrics(self, id: int, start: Optional[float] = None, end: Optional[float] = None,
+                    step: float = 0) -> Dict:
+        params = {'step': step}
+        if start is not None:
+            params['from'] = start
+        if end is not None:
+            params['to'] = end
+        return self._api('GET', f'/api/paths/{id}/metrics', params=params)['metrics']
+
+    def get_timeline_slots(self) -> Dict[int, int]:
+        """Timeline slot index of each path, -1 if not running a timeline, from the Prometheus exposition"""
+        text = self._request('GET', '/metrics').text
+        return {int(id): int(slot) for id, slot in re.findall(r'^nethang_timeline_slot\{path="(\d+)"\} (-?\d+)$', text, re.M)}
@@ -0,0 +1,373 @@
+"""
+Emulation fidelity benchmark
+
+This module measures how closely a path reproduces its model. A NetHang
+server runs in the router namespace of a Topology with one UDP path running
+a model. Timestamped probes are sent through the path at a constant rate,
+and the achieved statistics of each timeslot are compared to the requested
+ones:
+
+- delay: mean and percentiles of the one-way delay, against 'delay'
+- jitter: mean absolute deviation of the delay from its mean, against
+  'jitter', which is what __get_delay_jitter_param and
+  __get_slot_jitter_param of SimuPath aim at. The mean variation between
+  consecutive probes (RFC 3550 style) and the standard deviation are
+  reported as well
+- loss: loss rate against 'loss', and the distribution of the burst
+  lengths, whose mean is compared to the one of the Gilbert-Elliott profile
+  of __get_loss_state_param
+- reordering: share of the probes overtaken by a later one, which should be
+  0 unless the latency type is 'jitter-reorder-on'
+
+The timeslot boundaries are taken from the nethang_timeline_slot gauge of
+/metrics, polled during the run. The probes sent within --guard seconds after
+a transition are ignored, their timeslot is ambiguous.
+
+Without --model, a built-in model covering each latency and loss type is used.
+
+Usage (as root, from the repository root):
+
+    python -m benchmarks.netns.fidelity --slot-duration 10 --rate 1000 --output fidelity.json
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import argparse
+import bisect
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import yaml
+from typing import Dict, List, Optional, Tuple
+from benchmarks.netns.topology import Topology
+from benchmarks.netns.driver import RestDriver
+from benchmarks.netns.traffic import read_records, SENT_RECORD, RECV_RECORD
+from benchmarks.netns.harness import (REPO_ROOT, MODELS_FILE, SERVER_PORT, prepare_home, start_server,
+                                      stop_server, model_settings)
+
+PROBE_PORT = 6201
+FIDELITY_MODEL = '(Benchmark) Fidelity'
+
+# Mean burst lengths of the loss profiles, see SimuPath.__get_loss_state_param
+LOSS_BURSTS = {
+    'burst-low': 3.0,
+    'burst-medium': 10.0,
+    'burst-high': 50.0,
+}
+
+def fidelity_model(slot_duration: float) -> Dict:
+    """A model with one timeslot per latency type and per loss type"""
+    slots = [
+        {'delay': 50, 'latency_type': 'constant'},
+        {'delay': 50, 'jitter': 20, 'latency_type': 'jitter-reorder-on'},
+        {'delay': 50, 'jitter': 20, 'latency_type': 'jitter-reorder-off'},
+        {'loss': 5, 'loss_type': 'random'},
+        {'loss': 5, 'loss_type': 'burst-low'},
+        {'loss': 5, 'loss_type': 'burst-medium'},
+        {'loss': 10, 'loss_type': 'burst-high'},
+    ]
+    return {
+        'description': 'One timeslot per latency and loss type, to measure the emulation fidelity',
+        'global': {
+            'uplink': {'delay': 0, 'jitter': 0, 'loss': 0, 'latency_type': 'off', 'loss_type': 'off'},
+            'downlink': {'delay': 0, 'jitter': 0, 'loss': 0, 'latency_type': 'off', 'loss_type': 'off'},
+        },
+        'timeline': [{'duration': slot_duration, 'uplink': dict(slot), 'downlink': dict(slot)} for slot in slots],
+    }
+
+def merge_dicts(base: dict, update: dict) -> dict:
+    """Merge a timeslot into the global settings, as SimuPathManager.merge_dicts does"""
+    merged = base.copy()
+    for key, value in update.items():
+        if key in merged and isinstance(merged[key], dict) and isinstance(value, dict):
+            merged[key] = merge_dicts(merged[key], value)
+        elif value is not None:
+            merged[key] = value
+    return merged
+
+def compile_expectations(model: Dict, direction: str) -> List[Dict]:
+    """The statistics requested by each timeslot of a model for a direction"""
+    model_global = model.get('global') or {}
+    expectations = []
+    for timeslot in model.get('timeline') or [{}]:
+        settings = merge_dicts(model_global, timeslot).get(direction) or {}
+        latency_type = settings.get('latency_type', 'off')
+        loss_type = settings.get('loss_type', 'off')
+        loss = float(settings.get('loss') or 0) if loss_type != 'off' else 0.0
+        if loss_type in LOSS_BURSTS:
+            mean_burst = LOSS_BURSTS[loss_type]
+        else:
+            # Independent losses
+            mean_burst = 1 / (1 - loss / 100)
+        expectations.append({
+            'duration': timeslot.get('duration'),
+            'latencyType': latency_type,
+            'lossType': loss_type,
+            'delay': float(settings.get('delay') or 0) if latency_type != 'off' else 0.0,
+            'jitter': float(settings.get('jitter') or 0) if latency_type != 'off' else 0.0,
+            'lossRate': loss / 100,
+            'meanBurst': mean_burst if loss > 0 else None,
+            'reordering': latency_type == 'jitter-reorder-on',
+        })
+    return expectations
+
+class SlotPoller(threading.Thread):
+    """Record the timeslot transitions of a path by polling /metrics"""
+
+    def __init__(self, base_url: str, path_id: int, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.driver = RestDriver(base_url)
+        self.path_id = path_id
+        self.interval = interval
+        self.transitions: List[Tuple[int, int]] = []
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            slot = self.driver.get_timeline_slots().get(self.path_id, -1)
+            if slot >= 0 and (not self.transitions or self.transitions[-1][1] != slot):
+                self.transitions.append((time.monotonic_ns(), slot))
+            self.stop_event.wait(self.interval)
+
+    def wait_first(self, timeout: float = 10):
+        deadline = time.monotonic() + timeout
+        while not self.transitions:
+            if time.monotonic() > deadline:
+                raise TimeoutError('The path did not start its timeline')
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+def percentile(ordered: List[float], quantile: float) -> float:
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+def occurrence_stats(probes: List[Tuple[int, int, Optional[int]]]) -> Dict:
+    """
+    Raw statistics of the probes of a timeslot occurrence.
+
+    Args:
+        probes: (seq, sent, received or None) in nanoseconds, ordered by seq
+
+    Returns:
+        dict: delays in ms, consecutive delay variations in ms, burst lengths, reordered count
+    """
+    delays, variations, bursts = [], [], []
+    previous_delay, burst = None, 0
+    for seq, sent, received in probes:
+        if received is None:
+            burst += 1
+            continue
+        if burst:
+            bursts.append(burst)
+            burst = 0
+        delay = (received - sent) / 1000000
+        delays.append(delay)
+        if previous_delay is not None:
+            variations.append(abs(delay - previous_delay))
+        previous_delay = delay
+    if burst:
+        bursts.append(burst)
+
+    # A probe is reordered if a probe with a higher seq arrived before it
+    reordered, highest = 0, -1
+    for received, seq in sorted((received, seq) for seq, _, received in probes if received is not None):
+        if seq < highest:
+            reordered += 1
+        highest = max(highest, seq)
+
+    return {'sent': len(probes), 'delays': delays, 'variations': variations, 'bursts': bursts, 'reordered': reordered}
+
+def slot_stats(occurrences: List[Dict], expected: Dict) -> Dict:
+    """Achieved statistics of a timeslot over its occurrences, and their error against the expected ones"""
+    sent = sum(occurrence['sent'] for occurrence in occurrences)
+    delays = sorted(delay for occurrence in occurrences for delay in occurrence['delays'])
+    variations = [variation for occurrence in occurrences for variation in occurrence['variations']]
+    bursts = [burst for occurrence in occurrences for burst in occurrence['bursts']]
+    reordered = sum(occurrence['reordered'] for occurrence in occurrences)
+    result = {'occurrences': len(occurrences), 'sent': sent, 'received': len(delays), 'expected': expected}
+    if not sent:
+        return result
+
+    lost = sent - len(delays)
+    histogram: Dict[int, int] = {}
+    for burst in bursts:
+        histogram[burst] = histogram.get(burst, 0) + 1
+    result.update({
+        'lossRate': lost / sent,
+        'bursts': dict(sorted(histogram.items())),
+        'meanBurst': lost / len(bursts) if bursts else None,
+        'reordered': reordered / len(delays) if delays else 0.0,
+    })
+
+    if delays:
+        mean = sum(delays) / len(delays)
+        result['delay'] = {
+            'mean': mean,
+            'min': delays[0],
+            'p50': percentile(delays, 0.5),
+            'p90': percentile(delays, 0.9),
+            'p99': percentile(delays, 0.99),
+            'max': delays[-1],
+        }
+        result['jitter'] = sum(abs(delay - mean) for delay in delays) / len(delays)
+        result['stdev'] = math.sqrt(sum((delay - mean) ** 2 for delay in delays) / len(delays))
+        result['ipdv'] = sum(variations) / len(variations) if variations else 0.0
+
+    result['error'] = {
+        'delay': result['delay']['mean'] - expected['delay'] if delays else None,
+        'jitter': result['jitter'] - expected['jitter'] if delays else None,
+        'lossRate': result['lossRate'] - expected['lossRate'],
+        'meanBurst': result['meanBurst'] - expected['meanBurst']
+            if result['meanBurst'] is not None and expected['meanBurst'] is not None else None,
+    }
+    return result
+
+def analyze(sent: List[Tuple[int, int]], received: List[Tuple[int, int, int]],
+            transitions: List[Tuple[int, int]], expectations: List[Dict], guard: float) -> List[Dict]:
+    """Split the probes per timeslot occurrence and get the statistics of each timeslot"""
+    received_at = {seq: received_ns for seq, _, received_ns in received}
+    starts = [start for start, _ in transitions]
+    guard_ns = int(guard * 1000000000)
+
+    occurrences: Dict[int, List[List]] = {}
+    current = None
+    for seq, sent_ns in sent:
+        index = bisect.bisect_right(starts, sent_ns) - 1
+        if index < 0 or sent_ns < starts[index] + guard_ns:
+            current = None
+            continue
+        if current is None or current[0] != index:
+            current = (index, [])
+            occurrences.setdefault(transitions[index][1], []).append(current[1])
+        current[1].append((seq, sent_ns, received_at.get(seq)))
+
+    return [slot_stats([occurrence_stats(probes) for probes in occurrences.get(slot, [])], expected)
+            for slot, expected in enumerate(expectations)]
+
+def run(topology: Topology, base_url: str, home: str, model_name: str, model: Dict, args) -> Dict:
+    """Run the probes through a path running a model"""
+    driver = RestDriver(base_url)
+    driver.wait_ready()
+    driver.login()
+
+    uplink = args.direction == 'uplink'
+    path_filter = {
+        'protocol': 'udp',
+        'lan_ip': topology.lan_host,
+        'lan_port': 'Any' if uplink else str(PROBE_PORT),
+        'wan_ip': topology.wan_host,
+        'wan_port': str(PROBE_PORT) if uplink else 'Any',
+    }
+    sender, receiver, target = ('lan', 'wan', topology.wan_host) if uplink else ('wan', 'lan', topology.lan_host)
+    id = driver.add_path(path_filter, model_settings(model_name), name='fidelity')
+
+    cycle = sum(slot.get('duration') or 0 for slot in model.get('timeline') or []) or args.slot_duration
+    duration = cycle * args.cycles
+    sent_log, received_log = os.path.join(home, 'sent.bin'), os.path.join(home, 'received.bin')
+    traffic = [sys.executable, '-m', 'benchmarks.netns.traffic']
+    poller = SlotPoller(base_url, id)
+    receiving = topology.popen(receiver, traffic + ['probe-recv', '--port', str(PROBE_PORT),
+                               '--duration', str(duration + 5), '--output', received_log],
+                               cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+    try:
+        poller.start()
+        driver.activate(id)
+        if model.get('timeline'):
+            poller.wait_first()
+        else:
+            # A static model has a single timeslot, applied at the activation
+            poller.transitions.append((time.monotonic_ns(), 0))
+        subprocess.run(topology.exec_args(sender, traffic + ['probe-send', '--host', target, '--port', str(PROBE_PORT),
+                       '--rate', str(args.rate), '--duration', str(duration), '--output', sent_log]),
+                       cwd=REPO_ROOT, check=True, capture_output=True)
+        poller.stop()
+        receiving.wait(timeout=30)
+    finally:
+        if receiving.poll() is None:
+            receiving.kill()
+        driver.deactivate(id)
+        driver.delete_path(id)
+
+    slots = analyze(read_records(sent_log, SENT_RECORD), read_records(received_log, RECV_RECORD),
+                    poller.transitions, compile_expectations(model, args.direction), args.guard)
+    return {'model': model_name, 'direction': args.direction, 'settings': vars(args), 'slots': slots}
+
+def print_summary(results: Dict):
+    print('{:>4} {:>18} {:>12} {:>15} {:>15} {:>15} {:>13} {:>8}'.format(
+        'slot', 'latency type', 'loss type', 'delay ms', 'jitter ms', 'loss %', 'burst', 'reord %'))
+    for index, slot in enumerate(results['slots']):
+        expected = slot['expected']
+        if not slot.get('received'):
+            print(f'{index:>4} no probes')
+            continue
+
+        def pair(achieved, requested, scale=1.0):
+            return '{:.2f}/{:.2f}'.format(achieved * scale, requested * scale) if achieved is not None else '-'
+
+        print('{:>4} {:>18} {:>12} {:>15} {:>15} {:>15} {:>13} {:>8.2f}'.format(
+            index, expected['latencyType'], expected['lossType'],
+            pair(slot['delay']['mean'], expected['delay']),
+            pair(slot['jitter'], expected['jitter']),
+            pair(slot['lossRate'], expected['lossRate'], 100),
+            pair(slot['meanBurst'], expected['meanBurst']) if expected['meanBurst'] else '-',
+            slot['reordered'] * 100))
+    print('(achieved/requested)')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='NetHang emulation fidelity benchmark')
+    parser.add_argument('--model', help='Model to measure, default a built-in model covering each latency and loss type')
+    parser.add_argument('--models-file', default=MODELS_FILE, help='Models file of the server')
+    parser.add_argument('--slot-duration', type=float, default=10, help='Seconds per timeslot of the built-in model')
+    parser.add_argument('--cycles', type=int, default=1, help='Number of runs of the timeline')
+    parser.add_argument('--rate', type=float, default=1000, help='Probes per second')
+    parser.add_argument('--guard', type=float, default=0.5, help='Seconds ignored after each transition')
+    parser.add_argument('--direction', choices=['uplink', 'downlink'], default='uplink')
+    parser.add_argument('--prefix', default='nh', help='Prefix of the namespaces')
+    parser.add_argument('--output', help='JSON file of the results, default stdout')
+    args = parser.parse_args(argv)
+
+    if os.geteuid() != 0:
+        sys.exit('The benchmark needs root privileges to create network namespaces')
+
+    if args.model:
+        with open(args.models_file, 'r') as f:
+            models = yaml.safe_load(f)['models']
+        if args.model not in models:
+            sys.exit(f'Model {args.model} not found in {args.models_file}')
+        model_name, model = args.model, models[args.model]
+    else:
+        model_name, model = FIDELITY_MODEL, fidelity_model(args.slot_duration)
+
+    home = tempfile.mkdtemp(prefix='nethang-fidelity-')
+    topology = Topology(prefix=args.prefix)
+    server = None
+    try:
+        topology.setup()
+        prepare_home(home, topology, args.slot_duration, 1, {model_name: model}, args.models_file)
+        server = start_server(topology, home)
+        results = run(topology, f'http://{topology.mgmt_router}:{SERVER_PORT}', home, model_name, model, args)
+    finally:
+        if server:
+            stop_server(server)
+        topology.teardown()
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print_summary(results)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""
+Integration benchmark harness
+
+This module runs a real NetHang server in the router namespace of a
+Topology and measures, for each number N of active paths:
+
+- the activation and deactivation latency of a path, as seen by the REST
+  client and until the netem qdiscs of the path appear in (or disappear
+  from) the kernel
+- the timeslot transition latency, from the 'timeline.transition' histogram
+  of the server while N paths run a two slots model: recorded by its kernel
+  writer, from the commands of a timeslot sent by the timeline process to
+  their application, next to the 'kernel.queue_wait' histogram
+- the CPU used by the server while N paths are active, which is the cost of
+  the monitor sampling, with the 'monitor.sample' histogram
+- the throughput of a TCP stream through the last of the N paths, the
+  shaping of a path being capped to SimuPathManager.MAX_RATE
+
+Usage (as root, from the repository root):
+
+    python -m benchmarks.netns.harness --paths 1,8,32 --duration 10 --output results.json
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from typing import Dict, List, Optional
+from benchmarks.netns.topology import Topology
+from benchmarks.netns.driver import RestDriver
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+MODELS_FILE = os.path.join(REPO_ROOT, 'config_files', 'models_v0.2.0.yaml')
+SERVER_PORT = 9527
+BASE_PORT = 5201
+BENCH_MODEL = '(Benchmark) Transitions'
+
+def summarize(values: List[float]) -> Dict:
+    """Count, mean, percentiles and max of latencies in seconds"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def percentile(quantile):
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(0.5),
+        'p90': percentile(0.9),
+        'p99': percentile(0.99),
+        'max': ordered[-1],
+    }
+
+def bench_model(slot_duration: float) -> Dict:
+    """A model switching between two delays every slot_duration seconds"""
+    return {
+        'description': 'Two timeslots, to measure the transition latency',
+        'global': {
+            'uplink': {'delay': 5, 'latency_type': 'constant'},
+            'downlink': {'delay': 5, 'latency_type': 'constant'},
+        },
+        'timeline': [
+            {'duration': slot_duration, 'uplink': {'delay': 5}, 'downlink': {'delay': 5}},
+            {'duration': slot_duration, 'uplink': {'delay': 10}, 'downlink': {'delay': 10}},
+        ],
+    }
+
+def prepare_home(home: str, topology: Topology, slot_duration: float, max_paths: int,
+                 extra_models: Optional[Dict] = None, models_file: str = MODELS_FILE):
+    """Write the config and the models of the server under test"""
+    config_path = os.path.join(home, '.nethang')
+    os.makedirs(config_path, exist_ok=True)
+
+    config = {
+        'lan_interface': topology.lan_ifname,
+        'wan_interface': topology.wan_ifname,
+        'perf_instrumentation': True,
+    }
+    if max_paths > 32:
+        config['max_paths'] = max_paths
+    with open(os.path.join(config_path, 'config.yaml'), 'w') as f:
+        yaml.dump(config, f)
+
+    with open(models_file, 'r') as f:
+        models = yaml.safe_load(f)
+    models['models'][BENCH_MODEL] = bench_model(slot_duration)
+    models['models'].update(extra_models or {})
+    with open(os.path.join(config_path, 'models.yaml'), 'w') as f:
+        yaml.dump(models, f)
+
+def start_server(topology: Topology, home: str) -> subprocess.Popen:
+    """Start NetHang in the router namespace"""
+    env = dict(os.environ, HOME=home, PYTHONPATH=REPO_ROOT)
+    log = open(os.path.join(home, 'server.log'), 'w')
+    return topology.popen('router', [sys.executable, os.path.join(REPO_ROOT, 'run.py')],
+                          env=env, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT)
+
+def stop_server(server: subprocess.Popen):
+    """Stop the server, it deactivates its paths on SIGTERM"""
+    server.terminate()
+    try:
+        server.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def process_cpu_time(pid: int) -> float:
+    """CPU time of a process and of its reaped children (the tc/iptables commands) in seconds"""
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        # The command name may contain spaces, the fields start after its closing parenthesis
+        fields = f.read().rsplit(')', 1)[1].split()
+    utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+    return (utime + stime + cutime + cstime) / os.sysconf('SC_CLK_TCK')
+
+def netem_count(topology: Topology, mark: int) -> int:
+    """Number of netem qdiscs of a path in the router, one per shaped direction"""
+    output = topology.run('router', 'tc qdisc show dev {}; tc qdisc show dev {}'.format(
+        topology.lan_ifname, topology.wan_ifname), check=False)
+    return output.count(f'netem {mark}:')
+
+def wait_netem(topology: Topology, mark: int, count: int, start: float, timeout: float = 10) -> Optional[float]:
+    """Wait for a path to have a number of netem qdiscs, get the seconds since start, None on timeout"""
+    while time.perf_counter() - start < timeout:
+        if netem_count(topology, mark) == count:
+            return time.perf_counter() - start
+        time.sleep(0.005)
+    return None
+
+def path_filter(topology: Topology, index: int) -> Dict:
+    """Filter of the index-th path: TCP from the LAN host to a dedicated port of the WAN host"""
+    return {
+        'protocol': 'tcp',
+        'lan_ip': topology.lan_host,
+        'lan_port': 'Any',
+        'wan_ip': topology.wan_host,
+        'wan_port': str(BASE_PORT + index),
+    }
+
+def custom_settings() -> Dict:
+    """Shaping of the paths when measuring the throughput: the htb/netem tree, without impairments"""
+    restrict = {
+        'rate_limit': 1000000,
+        'qdepth': 1000,
+        'delay': 0,
+        'loss': 0.0,
+        'jitter': 0,
+        'throttle_type': 'off',
+        'latency_type': 'off',
+        'loss_type': 'off',
+    }
+    return {
+        'mode': 'custom',
+        'model': '',
+        'uplink': {'mode': 'restrict', 'restrict_settings': dict(restrict)},
+        'downlink': {'mode': 'restrict', 'restrict_settings': dict(restrict)},
+    }
+
+def model_settings(model: str) -> Dict:
+    return {
+        'mode': 'model',
+        'model': model,
+        'uplink': {'mode': 'bypass', 'restrict_settings': None},
+        'downlink': {'mode': 'bypass', 'restrict_settings': None},
+    }
+
+def measure_throughput(topology: Topology, port: int, duration: float) -> Dict:
+    """Throughput of a TCP stream from the LAN host to a port of the WAN host"""
+    traffic = [sys.executable, '-m', 'benchmarks.netns.traffic']
+    sink = topology.popen('wan', traffic + ['sink', '--port', str(port), '--duration', str(duration)],
+                          cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+    try:
+        subprocess.run(topology.exec_args('lan', traffic + ['source', '--host', topology.wan_host,
+                       '--port', str(port), '--duration', str(duration)]),
+                       cwd=REPO_ROOT, check=True, capture_output=True)
+        output, _ = sink.communicate(timeout=duration + 30)
+    finally:
+        if sink.poll() is None:
+            sink.kill()
+    return json.loads(output)
+
+class Harness:
+    """Run the measurements against a server in the router namespace"""
+
+    def __init__(self, topology: Topology, driver: RestDriver, pid: int, duration: float, transition_time: float):
+        self.topology = topology
+        self.driver = driver
+        self.pid = pid
+        self.duration = duration
+        self.transition_time = transition_time
+
+    def activate_all(self, ids: List[int], count: int) -> Dict:
+        """Activate paths, get the REST and kernel latencies"""
+        rest, kernel = [], []
+        for id in ids:
+            start = time.perf_counter()
+            self.driver.activate(id)
+            rest.append(time.perf_counter() - start)
+            ready = wait_netem(self.topology, id, count, start)
+            if ready is not None:
+                kernel.append(ready)
+        return {'rest': summarize(rest), 'kernel': summarize(kernel), 'timeouts': len(ids) - len(kernel)}
+
+    def deactivate_all(self, ids: List[int]) -> Dict:
+        """Deactivate paths, get the REST and kernel latencies"""
+        rest, kernel = [], []
+        for id in ids:
+            start = time.perf_counter()
+            self.driver.deactivate(id)
+            rest.append(time.perf_counter() - start)
+            gone = wait_netem(self.topology, id, 0, start)
+            if gone is not None:
+                kernel.append(gone)
+        return {'rest': summarize(rest), 'kernel': summarize(kernel), 'timeouts': len(ids) - len(kernel)}
+
+    def run(self, count: int) -> Dict:
+        """Measure with count active paths"""
+        ids = [self.driver.add_path(path_filter(self.topology, i), custom_settings(), name=f'bench-{i}')
+               for i in range(count)]
+        result = {'paths': count}
+        try:
+            self.driver.reset_perf()
+            result['activation'] = self.activate_all(ids, 2)
+
+            # The server only samples and forwards during the throughput window
+            cpu_start, wall_start = process_cpu_time(self.pid), time.monotonic()
+            result['throughput'] = measure_throughput(self.topology, BASE_PORT + count - 1, self.duration)
+            cpu = (process_cpu_time(self.pid) - cpu_start) / (time.monotonic() - wall_start)
+            perf_ = self.driver.get_perf()
+            result['monitor'] = {
+                'cpu': cpu,
+                'sample': perf_['histograms'].get('monitor.sample', {}),
+                'interval': perf_['monitor']['interval'],
+                'sampleCost': perf_['monitor']['sampleCost'],
+            }
+            result['deactivation'] = self.deactivate_all(ids)
+
+            # Run the two slots model on every path
+            for path in self.driver.get_paths():
+                if path['id'] in ids:
+                    path['simu_settings'] = model_settings(BENCH_MODEL)
+                    self.driver.update_path(path)
+            self.driver.reset_perf()
+            for id in ids:
+                self.driver.activate(id)
+            time.sleep(self.transition_time)
+            perf_ = self.driver.get_perf()
+            result['transition'] = perf_['histograms'].get('timeline.transition', {})
+            result['queueWait'] = perf_['histograms'].get('kernel.queue_wait', {})
+            result['applyTc'] = perf_['histograms'].get('path.apply_tc', {})
+            for id in ids:
+                self.driver.deactivate(id)
+        finally:
+            for id in ids:
+                self.driver.delete_path(id)
+        return result
+
+def print_summary(results: Dict):
+    print(f"baseline throughput: {results['baseline']['bitRate'] / 1e6:.1f} Mbit/s")
+    print('{:>6} {:>12} {:>12} {:>12} {:>12} {:>12} {:>8} {:>12}'.format(
+        'paths', 'act p50 ms', 'ready p50 ms', 'deact p50 ms', 'trans p50 ms', 'trans p99 ms', 'cpu %', 'Mbit/s'))
+    for run in results['runs']:
+        print('{:>6} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f} {:>8.1f} {:>12.1f}'.format(
+            run['paths'],
+            run['activation']['rest'].get('p50', 0) * 1000,
+            run['activation']['kernel'].get('p50', 0) * 1000,
+            run['deactivation']['kernel'].get('p50', 0) * 1000,
+            run['transition'].get('p50', 0) * 1000,
+            run['transition'].get('p99', 0) * 1000,
+            run['monitor']['cpu'] * 100,
+            run['throughput']['bitRate'] / 1e6))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='NetHang network namespace benchmark')
+    parser.add_argument('--paths', default='1,8,32', help='Comma separated numbers of active paths')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of traffic per measurement')
+    parser.add_argument('--transition-time', type=float, default=5, help='Seconds of timeline per measurement')
+    parser.add_argument('--slot-duration', type=float, default=0.5, help='Seconds per timeslot of the benchmark model')
+    parser.add_argument('--prefix', default='nh', help='Prefix of the namespaces')
+    parser.add_argument('--output', help='JSON file of the results, default stdout')
+    parser.add_argument('--keep-home', action='store_true', help='Keep the server home directory and its log')
+    args = parser.parse_args(argv)
+
+    if os.geteuid() != 0:
+        sys.exit('The benchmark needs root privileges to create network namespaces')
+
+    counts = [int(count) for count in args.paths.split(',')]
+    home = tempfile.mkdtemp(prefix='nethang-bench-')
+    topology = Topology(prefix=args.prefix)
+    server = None
+    try:
+        topology.setup()
+        prepare_home(home, topology, args.slot_duration, max(counts))
+        server = start_server(topology, home)
+        driver = RestDriver(f'http://{topology.mgmt_router}:{SERVER_PORT}')
+        driver.wait_ready()
+        driver.login()
+
+        # 'ip netns exec' execs the command, the PID of the Popen is the one of the server
+        harness = Harness(topology, driver, server.pid, args.duration, args.transition_time)
+        results = {
+            'environment': {
+                'kernel': platform.release(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+            },
+            'settings': vars(args),
+            'baseline': measure_throughput(topology, BASE_PORT, args.duration),
+            'runs': [harness.run(count) for count in counts],
+        }
+    finally:
+        if server:
+            stop_server(server)
+        topology.teardown()
+        if args.keep_home:
+            print(f'Server home kept in {home}', file=sys.stderr)
+        else:
+            shutil.rmtree(home, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print_summary(results)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
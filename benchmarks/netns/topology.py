@@ -0,0 +1,125 @@
+"""
+Topology
+
+This module builds the network namespace topology of the benchmarks:
+
+    [lan] eth0 <-veth-> lan0 [router] wan0 <-veth-> eth0 [wan]
+                             [router] mgmt0 <-veth-> <prefix>-mgmt [host]
+
+The router namespace forwards between lan0 and wan0, NetHang runs there with
+lan0 and wan0 as its LAN and WAN interfaces. The management link lets the
+benchmarks reach the REST API from the host namespace without the requests
+being forwarded through the emulated paths.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import subprocess
+from typing import Dict, List, Optional
+
+class Topology:
+    """LAN <-> router <-> WAN topology of network namespaces"""
+
+    ROLES = ('lan', 'router', 'wan')
+
+    def __init__(self, prefix: str = 'nh', subnet: str = '10.95'):
+        """
+        Args:
+            prefix: prefix of the namespaces and of the host interface, to run several topologies
+            subnet: first two bytes of the IPv4 addresses
+        """
+        self.prefix = prefix
+        self.lan_ifname = 'lan0'
+        self.wan_ifname = 'wan0'
+        self.mgmt_ifname = f'{prefix}-mgmt'
+        self.lan_host = f'{subnet}.1.2'
+        self.lan_gateway = f'{subnet}.1.1'
+        self.wan_host = f'{subnet}.2.2'
+        self.wan_gateway = f'{subnet}.2.1'
+        self.mgmt_host = f'{subnet}.0.1'
+        self.mgmt_router = f'{subnet}.0.2'
+        self.active = False
+
+    def ns(self, role: str) -> str:
+        """Name of the namespace of a role"""
+        if role not in Topology.ROLES:
+            raise ValueError(f'Invalid role: {role}')
+        return f'{self.prefix}-{role}'
+
+    @staticmethod
+    def _ip(args: str, check: bool = True) -> str:
+        result = subprocess.run(['ip'] + args.split(), capture_output=True, text=True)
+        if check and result.returncode != 0:
+            raise RuntimeError(f'ip {args} failed: {result.stderr.strip()}')
+        return result.stdout
+
+    def exec_args(self, role: str, args: List[str]) -> List[str]:
+        """Arguments running a command in the namespace of a role"""
+        return ['ip', 'netns', 'exec', self.ns(role)] + list(args)
+
+    def run(self, role: str, cmd: str, check: bool = True) -> str:
+        """Run a shell command in the namespace of a role and get its output"""
+        result = subprocess.run(self.exec_args(role, ['sh', '-c', cmd]), capture_output=True, text=True)
+        if check and result.returncode != 0:
+            raise RuntimeError(f'{cmd} failed in {self.ns(role)}: {result.stderr.strip()}')
+        return result.stdout
+
+    def popen(self, role: str, args: List[str], env: Optional[Dict] = None, **kwargs) -> subprocess.Popen:
+        """Start a process in the namespace of a role"""
+        return subprocess.Popen(self.exec_args(role, args), env=env, **kwargs)
+
+    def _add_link(self, name: str, ns: str, peer: str, peer_ns: Optional[str]):
+        """Add a veth pair, move its ends into their namespaces"""
+        tmp, tmp_peer = f'{self.prefix}-t0', f'{self.prefix}-t1'
+        Topology._ip(f'link add {tmp} type veth peer name {tmp_peer}')
+        Topology._ip(f'link set {tmp} netns {ns}')
+        Topology._ip(f'-n {ns} link set {tmp} name {name}')
+        if peer_ns:
+            Topology._ip(f'link set {tmp_peer} netns {peer_ns}')
+            Topology._ip(f'-n {peer_ns} link set {tmp_peer} name {peer}')
+        else:
+            Topology._ip(f'link set {tmp_peer} name {peer}')
+
+    def setup(self):
+        """Create the namespaces and the links, removing a stale topology with the same prefix"""
+        self.teardown()
+        for role in Topology.ROLES:
+            Topology._ip(f'netns add {self.ns(role)}')
+            Topology._ip(f'-n {self.ns(role)} link set lo up')
+        self.active = True
+
+        lan, router, wan = self.ns('lan'), self.ns('router'), self.ns('wan')
+        self._add_link('eth0', lan, self.lan_ifname, router)
+        self._add_link('eth0', wan, self.wan_ifname, router)
+        self._add_link('mgmt0', router, self.mgmt_ifname, None)
+
+        for ns, ifname, address in [
+            (lan, 'eth0', self.lan_host), (router, self.lan_ifname, self.lan_gateway),
+            (wan, 'eth0', self.wan_host), (router, self.wan_ifname, self.wan_gateway),
+        ]:
+            Topology._ip(f'-n {ns} addr add {address}/24 dev {ifname}')
+            Topology._ip(f'-n {ns} link set {ifname} up')
+        Topology._ip(f'-n {lan} route add default via {self.lan_gateway}')
+        Topology._ip(f'-n {wan} route add default via {self.wan_gateway}')
+
+        Topology._ip(f'-n {router} addr add {self.mgmt_router}/30 dev mgmt0')
+        Topology._ip(f'-n {router} link set mgmt0 up')
+        Topology._ip(f'addr add {self.mgmt_host}/30 dev {self.mgmt_ifname}')
+        Topology._ip(f'link set {self.mgmt_ifname} up')
+
+        self.run('router', 'sysctl -qw net.ipv4.ip_forward=1')
+
+    def teardown(self):
+        """Delete the namespaces, their interfaces go with them"""
+        for role in Topology.ROLES:
+            Topology._ip(f'netns del {self.ns(role)}', check=False)
+        Topology._ip(f'link del {self.mgmt_ifname}', check=False)
+        self.active = False
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.teardown()
@@ -0,0 +1,169 @@
+"""
+Traffic
+
+This module generates the benchmark traffic. It is run as a command in the
+namespaces of the topology:
+
+    python -m benchmarks.netns.traffic sink --port 5201 --duration 10
+    python -m benchmarks.netns.traffic source --host 10.95.2.2 --port 5201 --duration 10
+    python -m benchmarks.netns.traffic probe-recv --port 6201 --duration 70 --output recv.bin
+    python -m benchmarks.netns.traffic probe-send --host 10.95.2.2 --port 6201 --rate 1000 --duration 60 --output sent.bin
+
+The sink prints its result as JSON on stdout. A single TCP stream is used for
+the throughput, which is what an emulated path sees from one application.
+
+The probes are UDP datagrams carrying a sequence number and their sending
+time on the monotonic clock, which the namespaces share. The sender logs
+(seq, sent) and the receiver (seq, sent, received) records, in nanoseconds,
+so lost probes can be attributed to the time they were sent.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import argparse
+import json
+import socket
+import struct
+import sys
+import time
+from typing import List, Tuple
+
+BUFFER_SIZE = 256 * 1024
+
+# Probe payload and log records
+PROBE = struct.Struct('<IQ')
+SENT_RECORD = struct.Struct('<IQ')
+RECV_RECORD = struct.Struct('<IQQ')
+PROBE_SIZE = 64
+
+def sink(port: int, duration: float) -> dict:
+    """Receive one TCP stream, get the bytes received and the receiving time"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('0.0.0.0', port))
+    server.listen(1)
+    server.settimeout(duration + 10)
+    conn, _ = server.accept()
+    conn.settimeout(10)
+
+    received = 0
+    first = last = time.monotonic()
+    with conn:
+        while True:
+            try:
+                data = conn.recv(BUFFER_SIZE)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            if received == 0:
+                first = time.monotonic()
+            received += len(data)
+            last = time.monotonic()
+    server.close()
+
+    seconds = max(last - first, 1e-9)
+    return {'bytes': received, 'seconds': seconds, 'bitRate': received * 8 / seconds}
+
+def source(host: str, port: int, duration: float, connect_timeout: float = 5) -> dict:
+    """Send one TCP stream as fast as possible during a duration"""
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            conn = socket.create_connection((host, port), timeout=connect_timeout)
+            break
+        except ConnectionRefusedError:
+            # The sink may not be listening yet
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+    payload = b'\0' * BUFFER_SIZE
+    sent = 0
+    end = time.monotonic() + duration
+    with conn:
+        while time.monotonic() < end:
+            conn.sendall(payload)
+            sent += len(payload)
+    return {'bytes': sent}
+
+def probe_send(host: str, port: int, rate: float, duration: float, output: str) -> dict:
+    """Send probes at a constant rate, log their sequence numbers and sending times"""
+    conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    padding = b'\0' * (PROBE_SIZE - PROBE.size)
+    interval = 1000000000 / rate
+    count = int(rate * duration)
+    start = time.monotonic_ns()
+    with open(output, 'wb') as log:
+        for seq in range(count):
+            # Absolute schedule, a late probe does not delay the next ones
+            delay = (start + seq * interval - time.monotonic_ns()) / 1000000000
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.monotonic_ns()
+            conn.sendto(PROBE.pack(seq, sent) + padding, (host, port))
+            log.write(SENT_RECORD.pack(seq, sent))
+    conn.close()
+    return {'sent': count}
+
+def probe_recv(port: int, duration: float, output: str) -> dict:
+    """Receive probes during a duration, log their sequence numbers, sending and receiving times"""
+    conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    conn.bind(('0.0.0.0', port))
+    conn.settimeout(0.5)
+    received = 0
+    end = time.monotonic() + duration
+    with open(output, 'wb') as log:
+        while time.monotonic() < end:
+            try:
+                data = conn.recv(PROBE_SIZE)
+            except socket.timeout:
+                continue
+            received_at = time.monotonic_ns()
+            seq, sent = PROBE.unpack_from(data)
+            log.write(RECV_RECORD.pack(seq, sent, received_at))
+            received += 1
+    conn.close()
+    return {'received': received}
+
+def read_records(path: str, record: struct.Struct) -> List[Tuple]:
+    """Read a probe log"""
+    with open(path, 'rb') as f:
+        return list(record.iter_unpack(f.read()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='NetHang benchmark traffic')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sink_parser = subparsers.add_parser('sink', help='Receive a TCP stream')
+    sink_parser.add_argument('--port', type=int, default=5201)
+    sink_parser.add_argument('--duration', type=float, default=10)
+    source_parser = subparsers.add_parser('source', help='Send a TCP stream')
+    source_parser.add_argument('--host', required=True)
+    source_parser.add_argument('--port', type=int, default=5201)
+    source_parser.add_argument('--duration', type=float, default=10)
+    send_parser = subparsers.add_parser('probe-send', help='Send UDP probes')
+    send_parser.add_argument('--host', required=True)
+    send_parser.add_argument('--port', type=int, default=6201)
+    send_parser.add_argument('--rate', type=float, default=1000, help='Probes per second')
+    send_parser.add_argument('--duration', type=float, default=10)
+    send_parser.add_argument('--output', required=True, help='Log of the sent probes')
+    recv_parser = subparsers.add_parser('probe-recv', help='Receive UDP probes')
+    recv_parser.add_argument('--port', type=int, default=6201)
+    recv_parser.add_argument('--duration', type=float, default=10)
+    recv_parser.add_argument('--output', required=True, help='Log of the received probes')
+    args = parser.parse_args(argv)
+
+    if args.command == 'sink':
+        result = sink(args.port, args.duration)
+    elif args.command == 'source':
+        result = source(args.host, args.port, args.duration)
+    elif args.command == 'probe-send':
+        result = probe_send(args.host, args.port, args.rate, args.duration, args.output)
+    else:
+        result = probe_recv(args.port, args.duration, args.output)
+    json.dump(result, sys.stdout)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
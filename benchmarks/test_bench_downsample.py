@@ -0,0 +1,35 @@
+"""
+Benchmarks for nethang/downsample.py
+
+A query of 500 points over the two hours of raw samples of a path direction,
+the full raw ring, with each downsampling method.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import math
+import pytest
+from nethang.metrics_store import MetricsStore, FIELDS, LEVELS
+
+RAW_CAPACITY = LEVELS[0][2]
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    store = MetricsStore(str(tmp_path_factory.mktemp('metrics')))
+    for t in range(RAW_CAPACITY):
+        store.append(9528, 'uplink', float(t), [1000 + 500 * math.sin(t / 60)] * len(FIELDS))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('method', ['minmax', 'lttb'])
+def test_query_points(benchmark, store, method):
+    result = benchmark(store.query, 9528, 0, RAW_CAPACITY, points=500, method=method, directions=('uplink',))
+    assert result['uplink']['downsampled'] == method
+
+
+def test_query_raw(benchmark, store):
+    result = benchmark(store.query, 9528, 0, RAW_CAPACITY, directions=('uplink',))
+    assert len(result['uplink']['series']['timestamps']) == RAW_CAPACITY
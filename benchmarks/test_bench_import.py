@@ -0,0 +1,43 @@
+"""
+Benchmarks of the import time of the nethang modules
+
+Each module is imported in a fresh interpreter with '-X importtime', the
+cumulative import time of the module, as reported by the interpreter, is
+saved in the extra info of the benchmark.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import sys
+import subprocess
+import pytest
+
+# Modules of the web stack, the engine modules must not load them
+WEB_MODULES = ['flask', 'flask_socketio', 'requests', 'netifaces', 'tomli']
+
+
+def import_times(module: str) -> dict:
+    """Cumulative import time in microseconds of every module loaded by importing a module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', ['nethang.version', 'nethang', 'nethang.simu_path', 'nethang.cli'])
+def test_import_engine(benchmark, module):
+    times = benchmark.pedantic(import_times, args=(module,), rounds=5, iterations=1)
+    benchmark.extra_info['cumulative_us'] = times[module]
+    assert not set(times) & set(WEB_MODULES)
+
+
+def test_import_app(benchmark):
+    times = benchmark.pedantic(import_times, args=('nethang.routes',), rounds=5, iterations=1)
+    benchmark.extra_info['cumulative_us'] = times['nethang.routes']
@@ -0,0 +1,74 @@
+"""
+Benchmarks for nethang/logs.py
+
+The cost of a log record to the thread logging it: written synchronously to a
+rotating log file, put on the queue of the pipeline, or dropped by the rate
+limit of its call site.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import json
+import logging
+import pytest
+from logging.handlers import RotatingFileHandler
+from nethang.logs import kv, LogFormatter, LogPipeline, LOG_FORMAT
+
+CONFIG = {'throttle_type': 'on', 'rate_limit': 4000, 'latency_type': 'constant', 'delay': 100,
+          'loss_type': 'random', 'loss': 1, 'queue_limit': 1000}
+
+
+@pytest.fixture
+def logger(tmp_path):
+    logger = logging.getLogger('nethang.bench_logging')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def file_handler(tmp_path):
+    handler = RotatingFileHandler(tmp_path / 'bench.log', maxBytes=10000000, backupCount=1)
+    handler.setFormatter(LogFormatter(LOG_FORMAT))
+    return handler
+
+
+def test_sync_fstring(benchmark, logger, tmp_path):
+    """The former logging: formatted by the caller, written synchronously"""
+    logger.addHandler(file_handler(tmp_path))
+
+    def log():
+        logger.info(f"set_rule: uplink change {json.dumps(CONFIG)}")
+
+    benchmark(log)
+
+
+def test_queue_kv(benchmark, logger, tmp_path):
+    pipeline = LogPipeline(logger, [file_handler(tmp_path)])
+    pipeline.rate_limit.configure(0, 1)
+
+    def log():
+        logger.info(kv('set_rule', path=9528, direction='uplink', opt='change', config=CONFIG))
+
+    benchmark(log)
+    pipeline.stop()
+
+
+def test_queue_rate_limited(benchmark, logger, tmp_path):
+    pipeline = LogPipeline(logger, [file_handler(tmp_path)])
+
+    def log():
+        logger.info(kv('set_rule', path=9528, direction='uplink', opt='change', config=CONFIG))
+
+    benchmark(log)
+    pipeline.stop()
+
+
+def test_debug_disabled(benchmark, logger):
+    def log():
+        logger.debug(kv('merged_model', path=9528, slot=0, model=CONFIG))
+
+    benchmark(log)
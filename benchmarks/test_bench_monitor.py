@@ -0,0 +1,36 @@
+"""
+Benchmarks for nethang/traffic_monitor.py
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+from nethang.traffic_monitor import TrafficMonitor
+from conftest import iptables_output, tc_output, LAN_IFACE, WAN_IFACE, FIRST_MARK
+
+# Rounds of the large cases, the parser cost grows with marks x lines
+ROUNDS = {32: None, 512: 5, 4096: 1}
+
+
+def test_process_stats(benchmark, marks):
+    monitor = TrafficMonitor(id_range=(FIRST_MARK, FIRST_MARK + marks), lan_iface=LAN_IFACE, wan_iface=WAN_IFACE)
+    iptables_before, tc_before = iptables_output(marks, seed=0), tc_output(marks, seed=0)
+    iptables_after, tc_after = iptables_output(marks, seed=1), tc_output(marks, seed=1)
+
+    # A previous sample, so the rates are computed
+    monitor.stats = monitor._process_stats(iptables_before, tc_before, tc_before, 1000.0, 10.0)
+
+    args = (iptables_after, tc_after, tc_after, 1001.0, 11.0)
+    if ROUNDS[marks] is None:
+        stats = benchmark(monitor._process_stats, *args)
+    else:
+        stats = benchmark.pedantic(monitor._process_stats, args=args, rounds=ROUNDS[marks], iterations=1)
+
+    assert len(stats) == marks
+    assert stats[str(FIRST_MARK)]['trafficStats']['uplink']['egress']['bitRate'] != 0
+
+
+def test_append_chart_data(benchmark):
+    monitor = TrafficMonitor(id_range=(FIRST_MARK, FIRST_MARK + 32), lan_iface=LAN_IFACE, wan_iface=WAN_IFACE)
+    stats = monitor._process_stats(iptables_output(32), tc_output(32), tc_output(32), 1000.0, 10.0)
+    benchmark(monitor._append_chart_data, stats, 1000.0)
@@ -0,0 +1,60 @@
+"""
+Benchmarks for nethang/simu_path.py
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import pytest
+from unittest.mock import patch
+from nethang.simu_path import SimuPath, SimuPathManager, SimuSettings, FilterSettings
+
+
+def merge_all(models: dict) -> list:
+    """Merge every timeslot of every model with its global settings"""
+    merged = []
+    for model in models.values():
+        model_global = model.get('global', {}) or {}
+        for timeslot in model.get('timeline') or [{}]:
+            merged.append(SimuPathManager.merge_dicts(model_global, timeslot))
+    return merged
+
+
+@pytest.fixture
+def path():
+    """A path whose kernel commands are not run"""
+    with patch.object(SimuPathManager, 'run_cmd'):
+        path = SimuPath(
+            filter_settings=FilterSettings(protocol='udp', lan_ip='10.0.0.2', lan_port='Any',
+                                           wan_ip='', wan_port='443', mark=9528),
+            mode='model',
+            model='',
+            status='inactive',
+            uplink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+            downlink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+        )
+        yield path
+        del path
+
+
+def test_merge_dicts(benchmark, models):
+    merged = benchmark(merge_all, models)
+    assert len(merged) >= len(models)
+
+
+def test_apply_tc(benchmark, models, path):
+    settings = []
+    for merged in merge_all(models):
+        for direction in ['uplink', 'downlink']:
+            config = dict(merged.get(direction) or {})
+            config.setdefault('throttle_type', 'on' if 'rate_limit' in config else 'off')
+            config.setdefault('latency_type', 'constant' if 'delay' in config else 'off')
+            config.setdefault('loss_type', 'random' if config.get('loss') else 'off')
+            settings.append((direction, config))
+
+    def apply_all():
+        for direction, config in settings:
+            path._set_rule(direction, 'change', config)
+
+    with patch.object(SimuPathManager, 'run_cmd'):
+        benchmark(apply_all)
@@ -9,8 +9,7 @@ Date: 2025-05-19
 
 import os
 import logging
-from flask import Flask
-from logging.handlers import RotatingFileHandler
+from nethang.logs import setup_logging
 
 # Admin username
 ADMIN_USERNAME = 'admin'
@@ -24,31 +23,101 @@ CONFIG_PATH = os.path.join(os.path.expanduser('~'), '.nethang')
 CONFIG_FILE = os.path.join(CONFIG_PATH, 'config.yaml')
 MODELS_FILE = os.path.join(CONFIG_PATH, 'models.yaml')
 PATHS_FILE = os.path.join(CONFIG_PATH, 'paths.yaml')
+# Key signing the sessions, only readable by its owner
+SECRET_KEY_FILE = os.path.join(CONFIG_PATH, 'secret_key')
+
+# Metrics history directory
+METRICS_PATH = os.path.join(CONFIG_PATH, 'metrics')
+
+# Socket of the control daemon
+CONTROL_SOCKET = os.path.join(CONFIG_PATH, 'control.sock')
 
 # Log file
 LOG_FILE = os.path.join(CONFIG_PATH, 'nethang.log')
 
-# Create config directory if it doesn't exist
-os.makedirs(CONFIG_PATH, exist_ok=True)
-
-# Create Flask app
-app = Flask(__name__)
-
-# Configure logging
-try:
-    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10000000, backupCount=5)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-except (IOError, PermissionError) as e:
-    # If we can't create the log file, just log to stderr
-    app.logger.warning(f"Could not create log file: {e}")
-    app.logger.warning("Logging to stderr instead")
-
-app.logger.setLevel(logging.INFO)
-app.logger.info('NetHang startup')
-
-# Import routes after app creation to avoid circular imports
-from . import routes
\ No newline at end of file
+# Logger of the package, the same as the one of the Flask app
+logger = logging.getLogger('nethang')
+logger.setLevel(logging.INFO)
+
+# Pipeline writing the records of the logger to the log file, see init_logging()
+log_pipeline = None
+
+def init_logging():
+    """
+    Log to LOG_FILE, from a listener thread, see nethang/logs.py.
+
+    Called once by the entry points, the web app, the command line and the
+    daemon: importing the package creates no file and starts no thread.
+    """
+    global log_pipeline
+    if log_pipeline is None:
+        os.makedirs(CONFIG_PATH, exist_ok=True)
+        log_pipeline = setup_logging(logger, LOG_FILE)
+    return log_pipeline
+
+def load_secret_key() -> str:
+    """
+    Get the secret key signing the sessions, from SECRET_KEY_FILE.
+
+    It is generated once and kept there, so that all the workers, and the
+    web servers restarted, accept the sessions of each other.
+    """
+    import secrets
+    import tempfile
+
+    os.makedirs(CONFIG_PATH, exist_ok=True)
+    if not os.path.exists(SECRET_KEY_FILE):
+        # Written to a file of mode 0600 then linked, the workers starting at once
+        # agree on the first key linked and never read a partial one
+        fd, temp_file = tempfile.mkstemp(dir=CONFIG_PATH, prefix='.secret_key')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.link(temp_file, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_file)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
+
+def create_app(async_mode: str = 'threading'):
+    """
+    Create the Flask app and register its routes, once.
+
+    Only the web stack is set up: the models, the kernel state of the paths
+    and the signal handlers are initialized by routes.init_server() when the
+    server starts.
+
+    Args:
+        async_mode: async mode of Socket.IO, see server.select_async_mode()
+    """
+    global app
+    if 'app' in globals():
+        return app
+
+    from flask import Flask
+    from flask.logging import default_handler
+    from nethang.extensions import socketio
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = load_secret_key()
+    socketio.init_app(app, async_mode=async_mode)
+    # Flask only logs to stderr when the logger has no handler yet, written by the listener too
+    init_logging().add_handler(default_handler)
+    app.logger.info('NetHang startup')
+
+    # Import routes after app creation to avoid circular imports
+    from . import routes
+    return app
+
+def __getattr__(name):
+    """
+    Create the Flask app on its first use.
+
+    The simulation engine (simu_path, the CLI) does not need the web stack,
+    importing the package does not load Flask and the routes.
+    """
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return create_app()
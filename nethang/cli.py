@@ -0,0 +1,313 @@
+"""
+CLI
+
+This module provides the headless command line of NetHang: it applies a
+model to a filter with the simulation engine directly, without the web
+server, for scripted runs.
+
+    nethang apply LTE_with_handover --wan 10.0.0.5:443 --duration 60
+    nethang status
+    nethang stop [MARK]
+    nethang daemon
+
+'apply' runs in the foreground until its duration or cycles are over, or it
+is stopped (Ctrl+C, SIGTERM or 'nethang stop'), then tears its path down. The
+path is registered in paths.yaml while it runs, so its mark is not given to
+another path, and shows up in the web UI.
+
+With a control daemon configured (see nethang/control.py), 'apply' is a
+client of the daemon, which owns the path.
+
+The modules are imported lazily, 'status' and 'stop' only read paths.yaml.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+from typing import Dict, List, Optional, Tuple
+from . import logger, init_logging, ID_LOCK_FILE, PATHS_FILE, CONTROL_SOCKET
+from nethang.proc_lock import ProcLock, is_running
+
+# Seconds between two checks of the running path
+POLL_INTERVAL = 0.2
+# Seconds 'stop' waits for the path to be torn down
+STOP_TIMEOUT = 10
+
+def parse_endpoint(value: Optional[str]) -> Tuple[str, str]:
+    """Parse 'ip[:port]' to an (ip, port) pair, 'Any' port if none"""
+    if not value:
+        return '', 'Any'
+    if value.count(':') == 1:
+        ip, port = value.split(':')
+        if not port.isdigit():
+            raise ValueError(f'Invalid port: {value}')
+        return ip, port
+    return value, 'Any'
+
+def build_filter(lan: Optional[str], wan: Optional[str], protocol: Optional[str]) -> Dict:
+    """Filter settings of the path, TCP by default when a port is given"""
+    lan_ip, lan_port = parse_endpoint(lan)
+    wan_ip, wan_port = parse_endpoint(wan)
+    if protocol is None:
+        protocol = 'tcp' if (lan_port, wan_port) != ('Any', 'Any') else 'ip'
+    if protocol == 'ip' and (lan_port != 'Any' or wan_port != 'Any'):
+        raise ValueError('A port needs the tcp or udp protocol')
+    return {'protocol': protocol, 'lan_ip': lan_ip, 'lan_port': lan_port, 'wan_ip': wan_ip, 'wan_port': wan_port}
+
+def load_paths() -> List[Dict]:
+    from nethang.simu_path import load_yaml
+    if not os.path.exists(PATHS_FILE):
+        return []
+    return load_yaml(PATHS_FILE) or []
+
+def save_paths(paths: List[Dict]):
+    # Replaced at once, the server may be reading it
+    from nethang.simu_path import dump_yaml
+    dump_yaml(paths, PATHS_FILE)
+
+def cli_paths() -> List[Dict]:
+    """The paths applied by the command line"""
+    return [path for path in load_paths() if path.get('cli')]
+
+def register_path(entry: Dict) -> Optional[int]:
+    """Add the path to paths.yaml with a free mark, get the mark"""
+    from nethang.id_manager import IDManager
+    from nethang.simu_path import SimuPathManager
+
+    with ProcLock(ID_LOCK_FILE):
+        mark = IDManager(paths_file=PATHS_FILE, id_range=SimuPathManager.mark_range).acquire_id()
+        if mark is None:
+            return None
+        entry['id'] = mark
+        entry['filter_settings']['mark'] = mark
+        save_paths(load_paths() + [entry])
+    return mark
+
+def unregister_path(mark: int):
+    with ProcLock(ID_LOCK_FILE):
+        save_paths([path for path in load_paths() if int(path['id']) != mark])
+
+def teardown(entry: Dict):
+    """Remove the kernel state of a path left by a command line run which died"""
+    from nethang.simu_path import SimuPath, SimuPathManager
+    from nethang.control import ControlClient, socket_path
+
+    if socket_path():
+        client = ControlClient(socket_path())
+        if entry.get('status') == 'active':
+            client.deactivate_path(id=int(entry['id']))
+        client.delete_path(id=int(entry['id']))
+        return
+
+    SimuPathManager.configure(SimuPathManager.load_config())
+    path = SimuPath.from_dict(entry)
+    path.deactivate()
+    unregister_path(int(entry['id']))
+
+def apply(args) -> int:
+    from nethang.simu_path import SimuPath, SimuPathManager, SimuSettings, FilterSettings
+    from nethang.control import ControlClient, socket_path
+
+    config = SimuPathManager.load_config()
+    if not SimuPathManager.lan_ifname or not SimuPathManager.wan_ifname:
+        print('The LAN and WAN interfaces are not configured in config.yaml', file=sys.stderr)
+        return 2
+    SimuPathManager.configure(config)
+    models = SimuPathManager.load_models()['models']
+    if args.model not in models:
+        print(f'Model {args.model} not found', file=sys.stderr)
+        return 2
+    try:
+        filter_settings = build_filter(args.lan, args.wan, args.protocol)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    bypass = {'mode': 'bypass', 'restrict_settings': None}
+    entry = {
+        'name': f'cli {os.getpid()}',
+        'status': 'active',
+        'filter_settings': filter_settings,
+        'simu_settings': {'mode': 'model', 'model': args.model, 'uplink': dict(bypass), 'downlink': dict(bypass),
+                          'seed': args.seed},
+        'cli': {'pid': os.getpid(), 'started': time.time(), 'duration': args.duration},
+    }
+    if socket_path():
+        return apply_remote(args, entry, ControlClient(socket_path()))
+
+    mark = register_path(entry)
+    if mark is None:
+        print('No free mark', file=sys.stderr)
+        return 1
+
+    path = SimuPath(
+        filter_settings=FilterSettings(**entry['filter_settings']),
+        mode='model',
+        model=args.model,
+        status='inactive',
+        uplink_settings=SimuSettings(**bypass),
+        downlink_settings=SimuSettings(**bypass),
+        seed=args.seed,
+        model_settings=models[args.model],
+    )
+    stopped = []
+    handlers = {}
+    try:
+        path.activate(speed=args.speed, cycles=args.cycles)
+        # After the fork, the simulation process keeps the default handlers
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            handlers[sig] = signal.signal(sig, lambda sig, frame: stopped.append(sig))
+        seed = f', seed {path.markov_seed}' if path.markov_seed is not None else ''
+        print(f'Applied {args.model} on mark {mark}{seed}')
+
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while not stopped:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            # A static model process exits once applied, a timeline one after its cycles or on failure
+            if not path.simu_proc.is_alive() and (path.cycles or path.simu_proc.exitcode != 0):
+                break
+            time.sleep(POLL_INTERVAL)
+        failed = path.simu_proc.exitcode not in [None, 0]
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        failed = True
+    finally:
+        path.deactivate()
+        unregister_path(mark)
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+        print(f'Stopped mark {mark}')
+    return 1 if failed else 0
+
+def apply_remote(args, entry: Dict, client) -> int:
+    """Apply the path through the control daemon, which owns it"""
+    from nethang.control import ControlError
+
+    try:
+        mark = client.add_path(path=entry)
+    except ControlError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if mark is None:
+        print('No free mark', file=sys.stderr)
+        return 1
+
+    stopped = []
+    handlers = {}
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        handlers[sig] = signal.signal(sig, lambda sig, frame: stopped.append(sig))
+    failed = False
+    try:
+        run = client.activate_path(id=mark, speed=args.speed, cycles=args.cycles)
+        seed = f", seed {run['seed']}" if run['seed'] is not None else ''
+        print(f'Applied {args.model} on mark {mark}{seed}')
+
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while not stopped:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            # The daemon deactivates the path after its cycles
+            if args.cycles and client.get_path(id=mark)['status'] != 'active':
+                break
+            time.sleep(POLL_INTERVAL)
+    except (ValueError, ControlError) as e:
+        print(e, file=sys.stderr)
+        failed = True
+    finally:
+        try:
+            if (client.get_path(id=mark) or {}).get('status') == 'active':
+                client.deactivate_path(id=mark)
+            client.delete_path(id=mark)
+        except (ValueError, ControlError) as e:
+            print(e, file=sys.stderr)
+            failed = True
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+        print(f'Stopped mark {mark}')
+    return 1 if failed else 0
+
+def stop(args) -> int:
+    paths = [path for path in cli_paths() if args.mark is None or int(path['id']) == args.mark]
+    if not paths:
+        print('No path applied by the command line' if args.mark is None else f'Mark {args.mark} not applied by the command line',
+              file=sys.stderr)
+        return 1
+    for path in paths:
+        pid = path['cli']['pid']
+        if is_running(pid):
+            os.kill(pid, signal.SIGTERM)
+        else:
+            logger.info(f"Tearing down mark {path['id']} of dead process {pid}")
+            teardown(path)
+
+    deadline = time.monotonic() + STOP_TIMEOUT
+    marks = set(int(path['id']) for path in paths)
+    while marks & set(int(path['id']) for path in cli_paths()):
+        if time.monotonic() > deadline:
+            print('Timeout waiting for the paths to stop', file=sys.stderr)
+            return 1
+        time.sleep(POLL_INTERVAL)
+    return 0
+
+def status(args) -> int:
+    paths = cli_paths()
+    if not paths:
+        print('No path applied by the command line')
+        return 0
+    print(f"{'mark':<6} {'pid':<8} {'model':<40} {'filter':<40} {'elapsed':>8} {'state':<8}")
+    for path in paths:
+        filter_ = ' '.join(f'{key}={value}' for key, value in path['filter_settings'].items()
+                           if key != 'mark' and value not in ['', 'Any', 'ip'])
+        elapsed = f"{time.time() - path['cli']['started']:.0f}s"
+        state = 'running' if is_running(path['cli']['pid']) else 'dead'
+        print(f"{path['id']:<6} {path['cli']['pid']:<8} {path['simu_settings']['model']:<40} {filter_:<40} {elapsed:>8} {state:<8}")
+    return 0
+
+def daemon(args) -> int:
+    from nethang.control import run_daemon, socket_path
+
+    try:
+        run_daemon(args.socket or socket_path() or CONTROL_SOCKET)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='nethang', description='Apply NetHang models without the web server, or run the control daemon')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    apply_parser = commands.add_parser('apply', help='apply a model to a filter until stopped')
+    apply_parser.add_argument('model', help='model of models.yaml')
+    apply_parser.add_argument('--lan', help='LAN side of the filter, ip[:port]')
+    apply_parser.add_argument('--wan', help='WAN side of the filter, ip[:port]')
+    apply_parser.add_argument('--protocol', choices=['ip', 'tcp', 'udp'], help='tcp by default with a port, ip otherwise')
+    apply_parser.add_argument('--duration', type=float, help='seconds before stopping')
+    apply_parser.add_argument('--speed', type=float, default=1.0, help='time compression of the timeline')
+    apply_parser.add_argument('--cycles', type=int, help='cycles of the timeline before stopping')
+    apply_parser.add_argument('--seed', type=int, help='seed of a Markov model')
+    apply_parser.set_defaults(handler=apply)
+
+    stop_parser = commands.add_parser('stop', help='stop the paths applied by the command line')
+    stop_parser.add_argument('mark', type=int, nargs='?', help='mark of the path, all of them by default')
+    stop_parser.set_defaults(handler=stop)
+
+    status_parser = commands.add_parser('status', help='list the paths applied by the command line')
+    status_parser.set_defaults(handler=status)
+
+    daemon_parser = commands.add_parser('daemon', help='run the control daemon owning the paths')
+    daemon_parser.add_argument('--socket', help=f'path of the socket, {CONTROL_SOCKET} by default')
+    daemon_parser.set_defaults(handler=daemon)
+
+    args = parser.parse_args(argv)
+    init_logging()
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,10 +9,9 @@ Date: 2025-06-11
 
 import os
 import yaml
-import requests
 from pathlib import Path
 import time
-from . import app, CONFIG_PATH, CONFIG_FILE, MODELS_FILE, PATHS_FILE
+from . import logger, CONFIG_PATH, CONFIG_FILE, MODELS_FILE, PATHS_FILE
 
 class ConfigManager:
     def __init__(self):
@@ -481,10 +480,12 @@ models:
 
     def create_config_from_github(self):
         """Download config file from GitHub"""
+        import requests
+
         try:
             os.makedirs(CONFIG_PATH, exist_ok=True)
 
-            app.logger.info("Downloading config file from GitHub...")
+            logger.info("Downloading config file from GitHub...")
 
             # Download config file
             response = requests.get(self.github_config_url, timeout=10)
@@ -500,11 +501,11 @@ models:
             with open(MODELS_FILE, 'w', encoding='utf-8') as f:
                 f.write(response.text)
 
-            app.logger.info(f"Config file downloaded and saved to: {MODELS_FILE}")
+            logger.info(f"Config file downloaded and saved to: {MODELS_FILE}")
 
         except Exception as e:
-            app.logger.warning(f"Failed to download config file from GitHub: {e}")
-            app.logger.info("Using fallback config...")
+            logger.warning(f"Failed to download config file from GitHub: {e}")
+            logger.info("Using fallback config...")
             self.create_fallback_config()
 
     def create_fallback_config(self):
@@ -515,10 +516,10 @@ models:
             with open(MODELS_FILE, 'w', encoding='utf-8') as f:
                 f.write(self.fallback_models)
 
-            app.logger.info(f"Fallback config file created: {MODELS_FILE}")
+            logger.info(f"Fallback config file created: {MODELS_FILE}")
 
         except Exception as e:
-            app.logger.warning(f"Failed to create fallback config file: {e}")
+            logger.warning(f"Failed to create fallback config file: {e}")
 
     def check_config_update(self, force_update=False):
         """Check if config file needs update"""
@@ -526,13 +527,15 @@ models:
             # Check file modification time (e.g. update every 7 days)
             file_age = time.time() - os.path.getmtime(MODELS_FILE)
             if file_age > 7 * 24 * 3600 or force_update:  # 7 days
-                app.logger.info("Checking config file update...")
+                logger.info("Checking config file update...")
                 self.update_config_from_github()
         except Exception as e:
-            app.logger.warning(f"Failed to check config update: {e}")
+            logger.warning(f"Failed to check config update: {e}")
 
     def update_config_from_github(self):
         """Update config file from GitHub"""
+        import requests
+
         try:
             response = requests.get(self.github_config_url, timeout=10)
             response.raise_for_status()
@@ -550,10 +553,10 @@ models:
             with open(MODELS_FILE, 'w', encoding='utf-8') as f:
                 f.write(response.text)
 
-            app.logger.info("Config file updated")
+            logger.info("Config file updated")
 
         except Exception as e:
-            app.logger.warning(f"Failed to update config file: {e}")
+            logger.warning(f"Failed to update config file: {e}")
             # If there is a backup, restore it
             backup_file = os.path.join(CONFIG_PATH, 'models.yaml.backup')
             if os.path.exists(backup_file):
@@ -566,5 +569,5 @@ models:
             with open(MODELS_FILE, 'r', encoding='utf-8') as f:
                 return yaml.safe_load(f)
         except Exception as e:
-            app.logger.warning(f"Failed to load config file: {e}")
+            logger.warning(f"Failed to load config file: {e}")
             return self.fallback_models
\ No newline at end of file
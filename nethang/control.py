@@ -0,0 +1,603 @@
+"""
+Control
+
+This module provides the control plane of NetHang. The control daemon owns
+the paths: the kernel state, the timeline processes and the monitor. The web
+server and the command line are clients of it over a Unix domain socket, so
+they can be restarted, or run as several workers, without disturbing the
+running paths.
+
+    nethang daemon                                   # the control daemon
+    NETHANG_CONTROL_SOCKET=~/.nethang/control.sock nethang
+
+Without a daemon configured (NETHANG_CONTROL_SOCKET or control_socket in
+config.yaml), the server runs the paths in its own process, through the same
+operations.
+
+The protocol is one JSON object per line. A request gets the response of the
+same id, with a 'result' or an 'error':
+
+    -> {"id": 1, "method": "activate_path", "params": {"id": 9528, "speed": 10}}
+    <- {"id": 1, "result": {"seed": null}}
+    -> {"id": 2, "method": "activate_path", "params": {"id": 9600}}
+    <- {"id": 2, "error": "Path with id 9600 not found", "type": "ValueError"}
+
+After a 'subscribe' request, the connection also receives the events of the
+paths, the ones sent to the Socket.IO clients:
+
+    -> {"id": 3, "method": "subscribe"}
+    <- {"id": 3, "result": true}
+    <- {"event": "update_chart", "data": {"seq": 42, "labels": [...], "data": [...]}}
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import json
+import time
+import queue
+import signal
+import socket
+import subprocess
+import threading
+import socketserver
+from functools import partial
+from typing import Callable, Dict, List, Optional
+from . import logger, PATHS_FILE, CONTROL_SOCKET
+from nethang.id_manager import IDManager
+from nethang.simu_path import SimuPath, SimuPathManager
+from nethang.jobs import Job, JobExecutor, JOB_OPERATIONS
+from nethang.perf import perf
+
+# Seconds a client waits for a response
+CALL_TIMEOUT = 30
+# Seconds between two connection attempts of a subscriber
+RECONNECT_INTERVAL = 1
+# Events queued for a subscriber before it is dropped as too slow
+MAX_PENDING_EVENTS = 256
+
+def socket_path() -> Optional[str]:
+    """Socket of the control daemon to be a client of, None to run the paths in process"""
+    path = os.environ.get('NETHANG_CONTROL_SOCKET') or SimuPathManager.load_config().get('control_socket')
+    return os.path.expanduser(path) if path else None
+
+def check_iptables():
+    try:
+        # First check if iptables command exists
+        which_result = subprocess.run(
+            ['which', 'iptables'],
+            capture_output=True, text=True, check=True)
+
+        if not which_result.stdout.strip():
+            return {
+                'iptables_access': False,
+                'error': 'iptables command not found in system'
+            }
+
+        # Run a harmless iptables command (e.g., list rules)
+        result = subprocess.run(['iptables', '-L', '-n'], capture_output=True, text=True, check=True)
+        return {
+            'iptables_access': True,
+            'output': result.stdout,
+            'message': 'iptables command executed successfully'
+        }
+    except subprocess.CalledProcessError as e:
+        return {
+            'iptables_access': False,
+            'error': f'iptables command failed: {str(e)}'
+        }
+    except PermissionError:
+        return {
+            'iptables_access': False,
+            'error': 'Permission denied: Insufficient privileges for iptables'
+        }
+    except FileNotFoundError:
+        return {
+            'iptables_access': False,
+            'error': 'iptables command not found in system'
+        }
+
+def check_tc():
+    try:
+        # First check if tc command exists
+        which_result = subprocess.run(
+            ['which', 'tc'],
+            capture_output=True, text=True, check=True)
+
+        if not which_result.stdout.strip():
+            return {
+                'tc_access': False,
+                'error': 'tc command not found in system'
+            }
+
+        # Run a harmless tc command
+        result = subprocess.run(
+            ['tc', 'qdisc', 'add', 'dev', 'lo', 'handle', '0', 'netem', 'delay', '0ms'],
+            capture_output=True, text=True, check=True)
+        return {
+            'tc_access': True,
+            'output': result.stdout,
+            'message': 'tc command executed successfully'
+        }
+    except subprocess.CalledProcessError as e:
+        return {
+            'tc_access': True,
+            'error': f'tc command failed: {str(e)}'
+        }
+    except PermissionError:
+        return {
+            'tc_access': False,
+            'error': 'Permission denied: Insufficient privileges for tc'
+        }
+    except FileNotFoundError:
+        return {
+            'tc_access': False,
+            'error': 'tc command not found in system'
+        }
+
+class ControlError(RuntimeError):
+    """An operation failed in the control daemon, or the daemon is not reachable"""
+
+class Control:
+    """The operations of the control plane, on the paths of this process"""
+
+    # Operations callable over the socket
+    METHODS = (
+        'ping', 'privileges', 'load_paths', 'get_path', 'add_path', 'update_path', 'delete_path',
+        'activate_path', 'deactivate_path', 'update_path_members', 'query_metrics', 'path_report',
+        'list_matrices', 'run_matrix', 'matrix_report', 'save_config', 'exposition', 'perf_snapshot',
+        'reset_perf', 'kernel_backend', 'kernel_operations', 'submit_job', 'submit_jobs', 'get_job', 'list_jobs',
+    )
+
+    def __init__(self, manager: Optional[SimuPathManager] = None):
+        self._manager = manager
+        self._exporter = None
+        self._jobs = None
+        self._jobs_lock = threading.Lock()
+
+    @property
+    def manager(self) -> SimuPathManager:
+        # Created on the first use, it resets the kernel state of the paths
+        if self._manager is None:
+            self._manager = SimuPathManager()
+        return self._manager
+
+    @property
+    def jobs(self) -> JobExecutor:
+        with self._jobs_lock:
+            if self._jobs is None:
+                self._jobs = JobExecutor(self._run_job, self._job_completed)
+            return self._jobs
+
+    def close(self):
+        """Wait for the jobs being applied, before the paths are deactivated"""
+        if self._jobs is not None:
+            self._jobs.shutdown()
+
+    def ping(self) -> Dict:
+        from nethang.version import __version__
+        return {'pid': os.getpid(), 'version': __version__}
+
+    def privileges(self) -> Dict:
+        """Check if the paths have sufficient privileges for tc and iptables"""
+        if SimuPathManager.backend.name == 'fake':
+            # The fake kernel backend needs no privileges
+            return {'tc_access': True, 'iptables_access': True, 'tc_error': '', 'iptables_error': ''}
+
+        tc_status = check_tc()
+        iptables_status = check_iptables()
+
+        return {
+            'tc_access': tc_status.get('tc_access', False),
+            'iptables_access': iptables_status.get('iptables_access', False),
+            'tc_error': tc_status.get('error', ''),
+            'iptables_error': iptables_status.get('error', '')
+        }
+
+    def load_paths(self) -> List[Dict]:
+        return self.manager.load_paths()
+
+    def get_path(self, id: int) -> Optional[Dict]:
+        return self.manager.get_path_config(int(id))
+
+    def add_path(self, path: Dict) -> Optional[int]:
+        """Add a path on a free mark, get the mark, None if there is none"""
+        id_manager = IDManager(paths_file=PATHS_FILE, id_range=SimuPathManager.mark_range)
+        with self.manager.paths_lock():
+            path_id = id_manager.acquire_id()
+            if path_id is None:
+                return None
+
+            path['id'] = path_id
+            path['filter_settings']['mark'] = path_id
+            self.manager.add_path(path)
+        return path_id
+
+    def update_path(self, id: int, path: Dict):
+        self.manager.update_path_config(int(id), path)
+
+    def delete_path(self, id: int) -> bool:
+        """Delete a path, False if not found"""
+        if not self.manager.get_path_config(int(id)):
+            return False
+        with self.manager.paths_lock():
+            self.manager.delete_path(int(id))
+        return True
+
+    def activate_path(self, id: int, speed: float = 1.0, cycles: Optional[int] = None) -> Dict:
+        """Activate a path, get the seed of its run"""
+        # An explicit speed of 0 is invalid, not the default
+        self.manager.activate_path(int(id), speed=SimuPath.parse_speed(speed), cycles=cycles)
+        return {'seed': self.manager.paths[int(id)].markov_seed}
+
+    def deactivate_path(self, id: int):
+        self.manager.deactivate_path(int(id))
+
+    def update_path_members(self, id: int, lan_ip=None, wan_ip=None):
+        self.manager.update_path_members(int(id), lan_ip=lan_ip, wan_ip=wan_ip)
+
+    def query_metrics(self, id: int, start: float, end: float, step: float = 0,
+                      directions: List[str] = ('uplink', 'downlink'), points: int = 0,
+                      method: str = 'minmax') -> Dict:
+        return self.manager.metrics_store.query(int(id), start, end, step, tuple(directions), points, method)
+
+    def path_report(self, id: int, format: str = 'json'):
+        """Per-slot report of the last run of a path, as a dict or as CSV, None without run"""
+        report = self.manager.slot_reports.get(int(id))
+        if report is None:
+            return None
+        return report.to_csv() if format == 'csv' else report.to_dict()
+
+    def list_matrices(self) -> List[Dict]:
+        return [matrix.report() for matrix in self.manager.matrices.values()]
+
+    def run_matrix(self, spec: Dict) -> Dict:
+        matrix = self.manager.run_matrix(spec)
+        return {'id': matrix.id, 'runs': len(matrix.runs)}
+
+    def matrix_report(self, id: str, cancel: bool = False) -> Optional[Dict]:
+        """Report of a matrix, cancelled first if asked, None if not found"""
+        matrix = self.manager.matrices.get(id)
+        if matrix is None:
+            return None
+        if cancel:
+            matrix.cancel()
+        return matrix.report()
+
+    def save_config(self, config: Dict):
+        self.manager.save_config(config)
+
+    def exposition(self, openmetrics: bool = False) -> str:
+        """The latest traffic statistics in the Prometheus exposition format"""
+        from nethang.exporter import MetricsExporter
+        if self._exporter is None:
+            self._exporter = MetricsExporter()
+        manager = self.manager
+        slots = {id: path.slot_index.value for id, path in manager.paths.items()}
+        return self._exporter.render(manager.traffic_monitor.stats, slots, openmetrics, perf.render_prometheus(openmetrics))
+
+    def perf_snapshot(self) -> Dict:
+        monitor = self.manager.traffic_monitor
+        snapshot = perf.snapshot()
+        snapshot['monitor'] = {
+            'interval': monitor.effective_interval,
+            'sampleCost': monitor.avg_tick_cost,
+        }
+        return snapshot
+
+    def reset_perf(self):
+        perf.reset()
+
+    def kernel_backend(self) -> str:
+        return SimuPathManager.backend.name
+
+    def kernel_operations(self, since: int = 0, state: bool = False) -> Dict:
+        """Operations recorded, and state modeled, by the fake kernel backend"""
+        result = SimuPathManager.backend.get_operations(int(since))
+        if state:
+            result['state'] = SimuPathManager.backend.get_state()
+        return result
+
+    def submit_job(self, operation: str, params: Optional[Dict] = None) -> Dict:
+        """Queue an operation on a path, get its job at once, see nethang/jobs.py"""
+        params = dict(params or {})
+        if params.get('id') is not None:
+            # The jobs of a path are ordered by its id
+            params['id'] = int(params['id'])
+        return self.jobs.submit(operation, params).to_dict()
+
+    def submit_jobs(self, operations: List[Dict]) -> List[Dict]:
+        """Queue the operations, each a dict of 'operation' and 'params', get their jobs"""
+        for operation in operations:
+            if operation.get('operation') not in JOB_OPERATIONS:
+                raise ValueError(f'Invalid job operation: {operation.get("operation")}')
+        return [self.submit_job(operation['operation'], operation.get('params')) for operation in operations]
+
+    def get_job(self, id: str) -> Optional[Dict]:
+        job = self.jobs.get(id)
+        return job.to_dict() if job else None
+
+    def list_jobs(self) -> List[Dict]:
+        return [job.to_dict() for job in self.jobs.list()]
+
+    def _run_job(self, operation: str, params: Dict):
+        result = getattr(self, operation)(**params)
+        if operation == 'delete_path' and not result:
+            raise ValueError(f"Path with id {params.get('id')} not found")
+        return result
+
+    @staticmethod
+    def _job_completed(job: Job):
+        SimuPathManager.emit('job_completed', job.to_dict())
+
+class _Connection:
+    """A connection of the daemon, whose writes are shared with the event broadcast"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.events: Optional[queue.Queue] = None
+
+    def send(self, message: Dict):
+        data = (json.dumps(message, default=str) + '\n').encode()
+        with self.lock:
+            self.sock.sendall(data)
+
+    def forward_events(self):
+        """Send the queued events until the connection is closed"""
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+            try:
+                self.send(message)
+            except OSError:
+                return
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.control_daemon
+        connection = _Connection(self.request)
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    connection.send({'id': None, 'error': f'Invalid request: {e}', 'type': 'ValueError'})
+                    continue
+                connection.send(daemon.dispatch(request, connection))
+        except OSError:
+            pass
+        finally:
+            daemon.unsubscribe(connection)
+
+class ControlDaemon:
+    """Serve the operations of a Control on a Unix domain socket"""
+
+    def __init__(self, control: Control, path: str):
+        """
+        Args:
+            control: the operations served
+            path: path of the socket, a stale socket file is replaced
+
+        Raises:
+            RuntimeError: if another daemon listens on the socket
+        """
+        self.control = control
+        self.path = path
+        self.subscribers: List[_Connection] = []
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(path)
+                raise RuntimeError(f'A control daemon already listens on {path}')
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # The socket mutates the kernel state, only its owner may connect
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(path, _Handler)
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.control_daemon = self
+
+    def dispatch(self, request: Dict, connection: _Connection) -> Dict:
+        """Run a request, get its response"""
+        request_id = request.get('id')
+        method = request.get('method')
+        if method == 'subscribe':
+            self.subscribe(connection)
+            return {'id': request_id, 'result': True}
+        if method not in Control.METHODS:
+            return {'id': request_id, 'error': f'Unknown method: {method}', 'type': 'ValueError'}
+        try:
+            result = getattr(self.control, method)(**(request.get('params') or {}))
+            return {'id': request_id, 'result': result}
+        except Exception as e:
+            logger.error(f"Error in {method}: {e}")
+            return {'id': request_id, 'error': str(e), 'type': type(e).__name__}
+
+    def subscribe(self, connection: _Connection):
+        with self.lock:
+            if connection.events is not None:
+                return
+            connection.events = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+            self.subscribers.append(connection)
+        threading.Thread(target=connection.forward_events, daemon=True).start()
+
+    def unsubscribe(self, connection: _Connection):
+        with self.lock:
+            if connection not in self.subscribers:
+                return
+            self.subscribers.remove(connection)
+        try:
+            connection.events.put_nowait(None)
+        except queue.Full:
+            pass
+        connection.close()
+
+    def broadcast(self, event: str, data: Optional[Dict] = None):
+        """Send an event to the subscribers, without waiting for them"""
+        message = {'event': event, 'data': data}
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for connection in subscribers:
+            try:
+                connection.events.put_nowait(message)
+            except queue.Full:
+                logger.warning("Dropping a control client too slow to receive the events")
+                self.unsubscribe(connection)
+
+    def serve_forever(self):
+        logger.info(f"Control daemon listening on {self.path}")
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """Stop serve_forever(), from another thread"""
+        self.server.shutdown()
+
+    def close(self):
+        for connection in list(self.subscribers):
+            self.unsubscribe(connection)
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class ControlClient:
+    """
+    A client of the control daemon, with the operations of Control:
+
+        ControlClient(path).activate_path(id=9528, speed=10)
+
+    The operations take keyword arguments only. An error of the daemon is
+    raised as a ValueError, like in process, or as a ControlError.
+    """
+
+    def __init__(self, path: str, timeout: float = CALL_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
+        self.rfile = None
+        self.next_id = 0
+        self.closed = False
+
+    def __getattr__(self, name: str):
+        if name in Control.METHODS:
+            return partial(self.call, name)
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise ControlError(f'Control daemon not reachable at {self.path}: {e}')
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+
+    def _close(self):
+        if self.sock is not None:
+            self.rfile.close()
+            self.sock.close()
+        self.sock = None
+        self.rfile = None
+
+    def close(self):
+        """Close the connection and stop the subscription"""
+        self.closed = True
+        with self.lock:
+            self._close()
+
+    def call(self, method: str, **params):
+        """Run an operation in the daemon, get its result"""
+        with self.lock:
+            self.next_id += 1
+            data = (json.dumps({'id': self.next_id, 'method': method, 'params': params}) + '\n').encode()
+            try:
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(data)
+            except OSError:
+                # The daemon restarted since the last call, nothing was sent
+                self._close()
+                self._connect()
+                self.sock.sendall(data)
+            try:
+                line = self.rfile.readline()
+            except OSError as e:
+                self._close()
+                raise ControlError(f'No response of the control daemon to {method}: {e}')
+            if not line:
+                self._close()
+                raise ControlError(f'The control daemon closed the connection during {method}')
+
+        response = json.loads(line)
+        if 'error' in response:
+            if response.get('type') == 'ValueError':
+                raise ValueError(response['error'])
+            raise ControlError(response['error'])
+        return response.get('result')
+
+    def subscribe(self, callback: Callable[[str, Optional[Dict]], None]) -> threading.Thread:
+        """Call back with the events of the daemon, on a thread reconnecting when the daemon restarts"""
+        def listen():
+            while not self.closed:
+                try:
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                        sock.connect(self.path)
+                        sock.sendall(b'{"id": 0, "method": "subscribe"}\n')
+                        for line in sock.makefile('rb'):
+                            if self.closed:
+                                return
+                            message = json.loads(line)
+                            if 'event' in message:
+                                callback(message['event'], message.get('data'))
+                except (OSError, ValueError) as e:
+                    if not self.closed:
+                        logger.warning(f"Lost the events of the control daemon: {e}")
+                time.sleep(RECONNECT_INTERVAL)
+
+        thread = threading.Thread(target=listen, daemon=True)
+        thread.start()
+        return thread
+
+def run_daemon(path: str = CONTROL_SOCKET):
+    """Run the control daemon in the foreground until SIGINT or SIGTERM, then deactivate the paths"""
+    from nethang.config_manager import ConfigManager
+
+    ConfigManager().ensure_models()
+    daemon = ControlDaemon(Control(), path)
+    # Before the manager, whose initialization already sends events
+    SimuPathManager.event_sink = daemon.broadcast
+    manager = daemon.control.manager
+
+    def stop(sig, frame):
+        logger.info(f"Received signal {sig}, stopping the control daemon...")
+        threading.Thread(target=daemon.shutdown).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        daemon.serve_forever()
+    finally:
+        SimuPathManager.event_sink = None
+        daemon.control.close()
+        manager.deactivate_all_paths()
+        daemon.close()
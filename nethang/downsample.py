@@ -0,0 +1,148 @@
+"""
+Downsample
+
+This module reduces the series of the metrics history to a bounded number of
+points, whatever the length of the window shown:
+
+- minmax: the samples are merged into buckets of equal duration, keeping the
+  minimum, the maximum and the average of each, so the peaks and the drops
+  remain visible
+- lttb: Largest-Triangle-Three-Buckets, one sample of each bucket is kept,
+  the one forming the largest triangle with the samples kept around it, which
+  preserves the visual shape of the series
+
+The series are processed in vectorized passes when numpy is installed, in
+pure Python otherwise, with the same results.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import operator
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Downsampling methods, the first one by default
+DOWNSAMPLE_METHODS = ('minmax', 'lttb')
+# Points a downsampled series may have at most
+MAX_POINTS = 5000
+# Samples per bucket from which the triangles of a bucket are computed with numpy,
+# below the cost of the numpy calls exceeds the one of the Python loop
+LTTB_NUMPY_BUCKET = 32
+
+def aggregate(timestamps: Sequence[float], counts: Sequence[int], columns: Sequence[Sequence[float]],
+              step: float, origin: float = 0) -> Tuple[List[float], List[int], List[List[float]]]:
+    """
+    Merge samples into buckets of step seconds, starting at origin.
+
+    Args:
+        timestamps: the timestamps of the samples, in order
+        counts: the number of raw samples each sample aggregates
+        columns: the min, max and avg columns of every field, in that order
+
+    Returns:
+        tuple: the start of the buckets, their number of raw samples and their
+               min, max and avg columns
+    """
+    if numpy is not None and len(timestamps):
+        return _aggregate_numpy(timestamps, counts, columns, step, origin)
+    return _aggregate_python(timestamps, counts, columns, step, origin)
+
+def _aggregate_python(timestamps, counts, columns, step, origin):
+    buckets: List[float] = []
+    starts: List[int] = []
+    for index, timestamp in enumerate(timestamps):
+        bucket = timestamp - (timestamp - origin) % step
+        if not buckets or buckets[-1] != bucket:
+            buckets.append(bucket)
+            starts.append(index)
+    ranges = list(zip(starts, starts[1:] + [len(timestamps)]))
+    totals = [sum(counts[start:end]) for start, end in ranges]
+    merged: List[List[float]] = []
+    for i, column in enumerate(columns):
+        if i % 3 == 0:
+            merged.append([min(column[start:end]) for start, end in ranges])
+        elif i % 3 == 1:
+            merged.append([max(column[start:end]) for start, end in ranges])
+        else:
+            merged.append([sum(map(operator.mul, column[start:end], counts[start:end])) / total
+                           for (start, end), total in zip(ranges, totals)])
+    return buckets, totals, merged
+
+def _aggregate_numpy(timestamps, counts, columns, step, origin):
+    timestamps = numpy.asarray(timestamps, dtype=float)
+    counts = numpy.asarray(counts, dtype=float)
+    values = numpy.asarray(columns, dtype=float)
+    buckets = timestamps - numpy.remainder(timestamps - origin, step)
+    # Index of the first sample of each bucket
+    starts = numpy.flatnonzero(numpy.r_[True, buckets[1:] != buckets[:-1]])
+    totals = numpy.add.reduceat(counts, starts)
+    merged = numpy.empty((len(values), len(starts)))
+    merged[0::3] = numpy.minimum.reduceat(values[0::3], starts, axis=1)
+    merged[1::3] = numpy.maximum.reduceat(values[1::3], starts, axis=1)
+    merged[2::3] = numpy.add.reduceat(values[2::3] * counts, starts, axis=1) / totals
+    return buckets[starts].tolist(), totals.astype(int).tolist(), merged.tolist()
+
+def _lttb_edges(length: int, points: int) -> List[int]:
+    """Index of the first sample of each bucket, the first and last samples in buckets of their own"""
+    every = (length - 2) / (points - 2)
+    edges = [int(bucket * every) + 1 for bucket in range(points - 2)]
+    return [0] + edges + [length - 1, length]
+
+def lttb(timestamps: Sequence[float], values: Sequence[float], points: int) -> List[int]:
+    """
+    Select the samples of a series kept by Largest-Triangle-Three-Buckets.
+
+    Returns:
+        list: the indexes of the samples kept, in order, at most points of them
+    """
+    length = len(timestamps)
+    if length <= points:
+        return list(range(length))
+    if points < 3:
+        # The first and the last samples
+        return [0, length - 1][:points]
+    if numpy is not None and length / points >= LTTB_NUMPY_BUCKET:
+        return _lttb_numpy(timestamps, values, points)
+    return _lttb_python(timestamps, values, points)
+
+def _lttb_python(timestamps, values, points):
+    edges = _lttb_edges(len(timestamps), points)
+    selected = [0]
+    for bucket in range(1, points - 1):
+        start, end, next_end = edges[bucket], edges[bucket + 1], edges[bucket + 2]
+        # The average of the next bucket, the third vertex of the triangles
+        next_x = sum(timestamps[end:next_end]) / (next_end - end)
+        next_y = sum(values[end:next_end]) / (next_end - end)
+        x, y = timestamps[selected[-1]], values[selected[-1]]
+        best, best_area = start, -1.0
+        for index in range(start, end):
+            area = abs((x - next_x) * (values[index] - y) - (x - timestamps[index]) * (next_y - y))
+            if area > best_area:
+                best, best_area = index, area
+        selected.append(best)
+    selected.append(len(timestamps) - 1)
+    return selected
+
+def _lttb_numpy(timestamps, values, points):
+    timestamps = numpy.asarray(timestamps, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    edges = _lttb_edges(len(timestamps), points)
+    # The averages of all the buckets at once, only the choice of each sample depends on the previous one
+    sums_x = numpy.add.reduceat(timestamps, edges[:-1])
+    sums_y = numpy.add.reduceat(values, edges[:-1])
+    sizes = numpy.diff(edges)
+    averages_x, averages_y = sums_x / sizes, sums_y / sizes
+    selected = [0]
+    for bucket in range(1, points - 1):
+        start, end = edges[bucket], edges[bucket + 1]
+        x, y = timestamps[selected[-1]], values[selected[-1]]
+        areas = numpy.abs((x - averages_x[bucket + 1]) * (values[start:end] - y) -
+                          (x - timestamps[start:end]) * (averages_y[bucket + 1] - y))
+        selected.append(start + int(numpy.argmax(areas)))
+    selected.append(len(timestamps) - 1)
+    return selected
@@ -0,0 +1,111 @@
+"""
+Exporter
+
+This module provides the OpenMetrics/Prometheus exposition of the traffic
+statistics.
+
+The exposition is rendered from the latest sample cached by TrafficMonitor,
+it never runs tc or iptables itself. The rendered text is cached until the
+monitor produces a new sample, so a scrape only costs a dictionary lookup and
+the formatting of the timeline slot indexes.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+CONTENT_TYPE_TEXT = 'text/plain; version=0.0.4; charset=utf-8'
+CONTENT_TYPE_OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# (name, type, help, getter of the value from the direction stats)
+DIRECTION_METRICS = (
+    ('nethang_ingress_bytes', 'counter', 'Bytes entering the path',
+        lambda stats: stats['ingress']['bytes']),
+    ('nethang_ingress_packets', 'counter', 'Packets entering the path',
+        lambda stats: stats['ingress']['packets']),
+    ('nethang_egress_bytes', 'counter', 'Bytes leaving the path',
+        lambda stats: stats['egress']['bytes']),
+    ('nethang_egress_packets', 'counter', 'Packets leaving the path',
+        lambda stats: stats['egress']['packets']),
+    ('nethang_queue_drops', 'counter', 'Packets dropped by the path queue',
+        lambda stats: stats['queue']['dropPackets']),
+    ('nethang_queue_backlog_bytes', 'gauge', 'Bytes waiting in the path queue',
+        lambda stats: stats['queue']['bytes']),
+    ('nethang_queue_backlog_packets', 'gauge', 'Packets waiting in the path queue',
+        lambda stats: stats['queue']['packets']),
+)
+
+class MetricsExporter:
+    """Render the traffic statistics in the Prometheus text or OpenMetrics format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cached_stats: Optional[Dict] = None
+        self.cached_families: Dict[bool, List[str]] = {}
+
+    @staticmethod
+    def _sample_name(name: str, metric_type: str) -> str:
+        return name + '_total' if metric_type == 'counter' else name
+
+    @staticmethod
+    def _family_name(name: str, metric_type: str, openmetrics: bool) -> str:
+        # OpenMetrics declares counters without the '_total' suffix
+        return name if openmetrics or metric_type != 'counter' else name + '_total'
+
+    def _render_families(self, stats: Dict, openmetrics: bool) -> List[str]:
+        lines = []
+        for name, metric_type, help_, getter in DIRECTION_METRICS:
+            family = MetricsExporter._family_name(name, metric_type, openmetrics)
+            sample = MetricsExporter._sample_name(name, metric_type)
+            lines.append(f'# HELP {family} {help_}')
+            lines.append(f'# TYPE {family} {metric_type}')
+            for id, path_stats in stats.items():
+                for direction in ['uplink', 'downlink']:
+                    direction_stats = path_stats['trafficStats'].get(direction)
+                    if not direction_stats:
+                        continue
+                    lines.append(f'{sample}{{path="{id}",direction="{direction}"}} {getter(direction_stats)}')
+
+        timestamps = [path_stats['timeStamp'] for path_stats in stats.values()]
+        if timestamps:
+            lines.append('# HELP nethang_monitor_sample_timestamp_seconds Time of the latest monitor sample')
+            lines.append('# TYPE nethang_monitor_sample_timestamp_seconds gauge')
+            lines.append(f'nethang_monitor_sample_timestamp_seconds {max(timestamps)}')
+        return lines
+
+    def render(self, stats: Dict, slots: Dict[int, int], openmetrics: bool = False,
+               extra_lines: Optional[List[str]] = None) -> str:
+        """
+        Render the exposition.
+
+        Args:
+            stats: the latest stats of TrafficMonitor
+            slots: the timeline slot index of each path, -1 if not running a timeline
+            openmetrics: render the OpenMetrics format instead of the Prometheus text format
+            extra_lines: already rendered metric families to append
+
+        Returns:
+            str: the exposition text
+        """
+        with self.lock:
+            # The monitor replaces its stats dictionary at each sample
+            if stats is not self.cached_stats:
+                self.cached_stats = stats
+                self.cached_families = {}
+            if openmetrics not in self.cached_families:
+                self.cached_families[openmetrics] = self._render_families(stats, openmetrics)
+            lines = list(self.cached_families[openmetrics])
+
+        lines.append('# HELP nethang_timeline_slot Index of the running timeline slot of the path, -1 if none')
+        lines.append('# TYPE nethang_timeline_slot gauge')
+        for id, slot_index in sorted(slots.items()):
+            lines.append(f'nethang_timeline_slot{{path="{id}"}} {slot_index}')
+
+        if extra_lines:
+            lines.extend(extra_lines)
+
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
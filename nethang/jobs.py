@@ -0,0 +1,179 @@
+"""
+Jobs
+
+This module provides the executor of the path operations touching the kernel:
+activation, deactivation, members update and deletion. An operation is
+submitted as a job, whose id is returned at once, and runs on a pool of
+threads, so neither the HTTP requests nor the control socket wait for
+iptables and tc.
+
+The jobs of a same path run one at a time in submission order, so an
+activation followed by a deactivation can be pipelined. The jobs of different
+paths run concurrently.
+
+When a job completes, the 'job_completed' event is sent to the clients with
+the job:
+
+    {"id": "3f2a...", "operation": "activate_path", "params": {"id": 9528},
+     "status": "succeeded", "result": {"seed": 42}, "error": null,
+     "submitted": 1718000000.1, "wait": 0.002, "duration": 0.31}
+
+where 'wait' is the seconds the job was queued and 'duration' the seconds it
+took to apply.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional
+from . import logger
+from nethang.perf import perf
+
+# Operations of the control plane which can run as jobs
+JOB_OPERATIONS = ('activate_path', 'deactivate_path', 'update_path_members', 'delete_path')
+# Threads applying the jobs of different paths
+MAX_WORKERS = 4
+# Completed jobs kept for the status queries, the oldest are forgotten first
+MAX_COMPLETED_JOBS = 1000
+
+job_wait = perf.histogram('jobs.wait')
+job_failed = perf.counter('jobs.failed')
+
+class Job:
+    """An operation on a path, and its outcome once completed"""
+
+    def __init__(self, operation: str, params: Dict):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.params = params
+        self.status = 'queued'  # then 'running', then 'succeeded' or 'failed', 'cancelled' at shutdown
+        self.result = None
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.queued = time.perf_counter()
+        self.wait: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        """The jobs of a same key run in submission order"""
+        return self.params.get('id')
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'operation': self.operation,
+            'params': self.params,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'submitted': self.submitted,
+            'wait': self.wait,
+            'duration': self.duration,
+        }
+
+class JobExecutor:
+    """Run the jobs on a pool of threads, one at a time per path"""
+
+    def __init__(self, run: Callable[[str, Dict], object], on_complete: Optional[Callable[[Job], None]] = None,
+                 max_workers: int = MAX_WORKERS):
+        """
+        Args:
+            run: applies an operation with its parameters, returns its result
+            on_complete: called with each job once completed
+            max_workers: number of threads
+        """
+        self.run = run
+        self.on_complete = on_complete
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='nethang-job')
+        self.jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self.pending: Dict[object, Deque[Job]] = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def submit(self, operation: str, params: Optional[Dict] = None) -> Job:
+        """
+        Queue an operation, get its job at once.
+
+        Raises:
+            ValueError: if the operation cannot run as a job
+        """
+        if operation not in JOB_OPERATIONS:
+            raise ValueError(f'Invalid job operation: {operation}, one of {", ".join(JOB_OPERATIONS)}')
+        job = Job(operation, dict(params or {}))
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('The job executor is shut down')
+            self.jobs[job.id] = job
+            queue = self.pending.get(job.key)
+            if queue is not None:
+                # A job of the path is running, it runs this one after
+                queue.append(job)
+                return job
+            self.pending[job.key] = deque([job])
+        self.executor.submit(self._drain, job.key)
+        return job
+
+    def get(self, id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(id)
+
+    def list(self) -> List[Job]:
+        with self.lock:
+            return list(self.jobs.values())
+
+    def shutdown(self):
+        """Wait for the running jobs, the queued ones are not run"""
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=True)
+
+    def _drain(self, key):
+        """Run the jobs of a path until there is none left"""
+        while True:
+            with self.lock:
+                queue = self.pending[key]
+                if not queue or self.closed:
+                    for job in queue:
+                        job.status = 'cancelled'
+                        job.done.set()
+                    del self.pending[key]
+                    return
+                job = queue[0]
+            self._apply(job)
+            with self.lock:
+                queue.popleft()
+                self._forget_completed()
+
+    def _apply(self, job: Job):
+        job.wait = time.perf_counter() - job.queued
+        job_wait.record(job.wait)
+        job.status = 'running'
+        start = time.perf_counter()
+        try:
+            job.result = self.run(job.operation, job.params)
+            job.status = 'succeeded'
+        except Exception as e:
+            logger.error(f"Job {job.operation} {job.params} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+            job_failed.inc()
+        job.duration = time.perf_counter() - start
+        perf.histogram(f'jobs.{job.operation}').record(job.duration)
+        if self.on_complete is not None:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                logger.warning(f"Error in reporting the job {job.id}: {e}")
+        job.done.set()
+
+    def _forget_completed(self):
+        completed = [id for id, job in self.jobs.items() if job.done.is_set()]
+        for id in completed[:max(0, len(completed) - MAX_COMPLETED_JOBS)]:
+            del self.jobs[id]
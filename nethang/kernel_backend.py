@@ -0,0 +1,376 @@
+"""
+Kernel Backend
+
+This module provides the backends running the kernel commands (tc, iptables,
+ipset) of NetHang.
+
+ShellBackend runs the commands for real. FakeBackend is an in-process stand-in
+which needs no privileges: it models the qdisc/class/filter/mark/set state from
+the commands, records every operation with timestamps, and synthesizes
+plausible counters in the outputs read by TrafficMonitor. It is selected with
+'kernel_backend: fake' in config.yaml and makes it possible to benchmark the
+activation of many paths and long timelines anywhere.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import re
+import json
+import time
+import shlex
+import select
+import subprocess
+import threading
+from typing import Dict, List, Optional
+from . import logger
+
+class ShellBackend:
+    """Run the kernel commands for real"""
+    name = 'shell'
+
+    def run(self, cmd: str, mute: bool = True) -> str:
+        """Run a command line through the shell"""
+        if mute:
+            cmd += ' > /dev/null 2>&1'
+        return os.popen(cmd).read()
+
+    def run_batch(self, cmds: List[str]) -> str:
+        """Run tc commands in a single tc process"""
+        lines = [cmd[len('tc '):] for cmd in cmds]
+        # -force carries on with the next commands after a failed one
+        return subprocess.run(['tc', '-force', '-batch', '-'], input='\n'.join(lines) + '\n',
+                              capture_output=True, text=True).stdout
+
+    def query(self, cmd: List[str]) -> str:
+        """Run a command reading the kernel state and return its output"""
+        return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+
+class FakeBackend:
+    """
+    In-process stand-in of the kernel.
+
+    The operations of the forked timeline processes are sent to the owner
+    process through a pipe, one JSON line per operation. Writes smaller than
+    PIPE_BUF are atomic, so no lock is shared with processes which may be
+    terminated at any time.
+    """
+    name = 'fake'
+
+    # Traffic offered to each mark and direction, in kbit/s
+    DEFAULT_LOAD = 2000
+    PACKET_SIZE = 1000
+    # Cap of the operations kept in memory
+    MAX_OPERATIONS = 100000
+
+    def __init__(self, load_kbps: float = DEFAULT_LOAD):
+        self.load_kbps = load_kbps
+        self.owner_pid = os.getpid()
+        self.lock = threading.RLock()
+        self.operations: List[Dict] = []
+        self.operations_dropped = 0
+
+        self.qdiscs: Dict[str, Dict[str, Dict]] = {}    # iface -> handle -> qdisc
+        self.classes: Dict[str, Dict[str, Dict]] = {}   # iface -> classid -> class
+        self.filters: Dict[str, Dict[str, str]] = {}    # iface -> fw handle -> flowid
+        self.rules: List[Dict] = []                     # mangle FORWARD MARK rules
+        self.ipsets: Dict[str, set] = {}
+        self.last_advance = time.monotonic()
+        # Fractions of packet carried to the next advance, by rule and by netem qdisc
+        self.carried: Dict[tuple, float] = {}
+
+        self.read_fd, self.write_fd = os.pipe()
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    # Operations
+
+    def run(self, cmd: str, mute: bool = True) -> str:
+        operation = {'time': time.time(), 'monotonic': time.monotonic(), 'pid': os.getpid(), 'cmd': cmd}
+        if cmd.startswith('ipset restore'):
+            # The restore file is removed once the command returned
+            operation['input'] = FakeBackend._read_input(cmd)
+
+        if os.getpid() != self.owner_pid:
+            os.write(self.write_fd, (json.dumps(operation) + '\n').encode())
+            return ''
+        return self._apply(operation)
+
+    def run_batch(self, cmds: List[str]) -> str:
+        """Record the batch as one operation and apply its commands"""
+        operation = {'time': time.time(), 'monotonic': time.monotonic(), 'pid': os.getpid(),
+                     'cmd': 'tc -batch', 'batch': cmds}
+        if os.getpid() != self.owner_pid:
+            os.write(self.write_fd, (json.dumps(operation) + '\n').encode())
+            return ''
+        return self._apply(operation)
+
+    def query(self, cmd: List[str]) -> str:
+        with self.lock:
+            self._record({'time': time.time(), 'monotonic': time.monotonic(), 'pid': os.getpid(), 'cmd': ' '.join(cmd)})
+            self._advance()
+            if cmd[:2] == ['iptables', '-nvxL']:
+                return self._render_iptables()
+            if cmd[:3] == ['tc', '-s', 'qdisc']:
+                return self._render_tc(cmd[-1])
+            return ''
+
+    def get_operations(self, since: int = 0) -> Dict:
+        """Get the recorded operations from the given index"""
+        with self.lock:
+            return {
+                'next': self.operations_dropped + len(self.operations),
+                'dropped': self.operations_dropped,
+                'operations': self.operations[max(0, since - self.operations_dropped):],
+            }
+
+    def get_state(self) -> Dict:
+        """Get the modeled kernel state"""
+        with self.lock:
+            self._advance()
+            return {
+                'qdiscs': self.qdiscs,
+                'classes': self.classes,
+                'filters': self.filters,
+                'rules': self.rules,
+                'ipsets': {name: sorted(members) for name, members in self.ipsets.items()},
+            }
+
+    @staticmethod
+    def _read_input(cmd: str) -> str:
+        tokens = shlex.split(cmd)
+        if '<' in tokens and tokens.index('<') + 1 < len(tokens):
+            try:
+                with open(tokens[tokens.index('<') + 1], 'r') as f:
+                    return f.read()
+            except IOError:
+                pass
+        return ''
+
+    def _read_loop(self):
+        """Apply the operations sent by the timeline processes"""
+        buffer = b''
+        while True:
+            select.select([self.read_fd], [], [])
+            data = os.read(self.read_fd, 65536)
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                try:
+                    self._apply(json.loads(line))
+                except Exception as e:
+                    # The loop goes on with the next operations
+                    logger.error(f"Error in applying an operation of a timeline process {line[:200]!r}: {e}")
+
+    def _record(self, operation: Dict):
+        self.operations.append(operation)
+        if len(self.operations) > FakeBackend.MAX_OPERATIONS:
+            drop = len(self.operations) - FakeBackend.MAX_OPERATIONS
+            del self.operations[:drop]
+            self.operations_dropped += drop
+
+    def _apply(self, operation: Dict) -> str:
+        with self.lock:
+            self._record(operation)
+            self._advance()
+            for cmd in operation.get('batch', [operation['cmd']]):
+                self._apply_cmd(cmd, operation.get('input', ''))
+            return ''
+
+    def _apply_cmd(self, cmd: str, restore_input: str):
+        tokens = shlex.split(cmd)
+        # Drop the shell redirections
+        for i, token in enumerate(tokens):
+            if token.startswith('>') or token.startswith('<') or token in ['2>&1', '1>&2']:
+                tokens = tokens[:i]
+                break
+        if not tokens:
+            return
+        if tokens[0] == 'tc':
+            self._apply_tc(tokens[1:])
+        elif tokens[0] == 'iptables':
+            self._apply_iptables(tokens[1:])
+        elif tokens[0] == 'ipset':
+            self._apply_ipset(tokens[1:], restore_input)
+
+    # Commands
+
+    @staticmethod
+    def _option(tokens: List[str], name: str, default: Optional[str] = None) -> Optional[str]:
+        if name in tokens and tokens.index(name) + 1 < len(tokens):
+            return tokens[tokens.index(name) + 1]
+        return default
+
+    @staticmethod
+    def _parse_rate(value: str) -> float:
+        """Parse a tc rate to kbit/s"""
+        match = re.match(r'([\d.]+)([a-zA-Z]*)', value or '')
+        if not match:
+            return 0.0
+        units = {'': 0.001, 'bit': 0.001, 'kbit': 1, 'mbit': 1000, 'gbit': 1000000}
+        return float(match.group(1)) * units.get(match.group(2).lower(), 1)
+
+    @staticmethod
+    def _parse_netem(tokens: List[str]) -> Dict:
+        netem = {'limit': 1000, 'loss': 0.0, 'options': ' '.join(tokens)}
+        if 'limit' in tokens:
+            netem['limit'] = int(FakeBackend._option(tokens, 'limit'))
+        if 'loss' in tokens:
+            i = tokens.index('loss')
+            if tokens[i + 1] == 'gemodel':
+                p, r = float(tokens[i + 2].rstrip('%')), float(tokens[i + 3].rstrip('%'))
+                netem['loss'] = p / (p + r) if p + r > 0 else 0.0
+            else:
+                netem['loss'] = float(tokens[i + 1].rstrip('%')) / 100
+        return netem
+
+    def _apply_tc(self, tokens: List[str]):
+        if len(tokens) < 4:
+            return
+        obj, opt, iface = tokens[0], tokens[1], FakeBackend._option(tokens, 'dev', '')
+        qdiscs = self.qdiscs.setdefault(iface, {})
+        classes = self.classes.setdefault(iface, {})
+        filters = self.filters.setdefault(iface, {})
+
+        if obj == 'qdisc':
+            handle = (FakeBackend._option(tokens, 'handle', '') or '').rstrip(':')
+            if opt == 'del':
+                if 'root' in tokens:
+                    qdiscs.clear()
+                    classes.clear()
+                    filters.clear()
+                else:
+                    qdiscs.pop(handle, None)
+            elif 'netem' in tokens:
+                netem = FakeBackend._parse_netem(tokens[tokens.index('netem') + 1:])
+                if opt == 'add' and handle in qdiscs:
+                    return
+                counters = qdiscs.get(handle, {}).get('counters', {'bytes': 0, 'packets': 0, 'drops': 0, 'backlog': 0, 'backlog_packets': 0})
+                qdiscs[handle] = dict(netem, kind='netem', parent=FakeBackend._option(tokens, 'parent'), counters=counters)
+            elif 'root' in tokens and opt == 'add':
+                qdiscs.setdefault(handle, {'kind': 'htb', 'parent': 'root', 'counters': {'bytes': 0, 'packets': 0, 'drops': 0, 'backlog': 0, 'backlog_packets': 0}})
+
+        elif obj == 'class':
+            classid = FakeBackend._option(tokens, 'classid', '')
+            if opt == 'del':
+                classes.pop(classid, None)
+            elif opt in ['add', 'change', 'replace']:
+                if opt == 'add' and classid in classes:
+                    return
+                classes[classid] = {'rate': FakeBackend._parse_rate(FakeBackend._option(tokens, 'rate')),
+                                    'options': ' '.join(tokens[tokens.index('htb') + 1:]) if 'htb' in tokens else ''}
+
+        elif obj == 'filter':
+            handle = FakeBackend._option(tokens, 'handle', '')
+            if opt == 'del':
+                filters.pop(handle, None)
+            elif opt == 'add':
+                filters[handle] = FakeBackend._option(tokens, 'flowid', '')
+
+    def _apply_iptables(self, tokens: List[str]):
+        for action in ['-A', '-D']:
+            if action not in tokens:
+                continue
+            rule = {
+                'in': FakeBackend._option(tokens, '-i', ''),
+                'out': FakeBackend._option(tokens, '-o', ''),
+                'mark': int(FakeBackend._option(tokens, '--set-mark', '0')),
+                'match': ' '.join(tokens[tokens.index('-o') + 2:tokens.index('-j')]) if '-o' in tokens and '-j' in tokens else '',
+            }
+            if action == '-A':
+                self.rules.append(dict(rule, packets=0, bytes=0))
+            else:
+                for existing in self.rules:
+                    if all(existing[key] == rule[key] for key in rule):
+                        self.rules.remove(existing)
+                        break
+
+    def _apply_ipset(self, tokens: List[str], restore_input: str):
+        if tokens[0] == 'destroy' and len(tokens) > 1:
+            self.ipsets.pop(tokens[1], None)
+        elif tokens[0] == 'restore':
+            for line in restore_input.splitlines():
+                self._apply_ipset(line.split(), '')
+        elif tokens[0] == 'create':
+            self.ipsets.setdefault(tokens[1], set())
+        elif tokens[0] == 'flush':
+            self.ipsets[tokens[1]] = set()
+        elif tokens[0] == 'add':
+            self.ipsets.setdefault(tokens[1], set()).add(tokens[2])
+        elif tokens[0] == 'swap':
+            self.ipsets[tokens[1]], self.ipsets[tokens[2]] = self.ipsets.get(tokens[2], set()), self.ipsets.get(tokens[1], set())
+
+    # Counters
+
+    def _advance(self):
+        """Let the offered traffic flow through the modeled paths since the last call"""
+        now = time.monotonic()
+        elapsed = now - self.last_advance
+        self.last_advance = now
+        if elapsed <= 0:
+            return
+
+        offered_packets = self.load_kbps * 1000 / 8 * elapsed / FakeBackend.PACKET_SIZE
+        # Frequent calls would never credit a whole packet otherwise, the state of the rules gone is dropped
+        carried, self.carried = self.carried, {}
+        for rule in self.rules:
+            key = ('rule', rule['in'], rule['out'], rule['mark'], rule['match'])
+            packets = self._credit(key, carried.get(key, 0.0) + offered_packets)
+            rule['packets'] += packets
+            rule['bytes'] += packets * FakeBackend.PACKET_SIZE
+
+            # The mark is shaped on the egress interface if its leaf exists
+            handle = str(rule['mark'])
+            qdisc = self.qdiscs.get(rule['out'], {}).get(handle)
+            if not qdisc or qdisc.get('kind') != 'netem':
+                continue
+            rate_kbps = next((cls['rate'] for classid, cls in self.classes.get(rule['out'], {}).items()
+                              if classid.endswith(':' + handle)), self.load_kbps)
+            key = ('qdisc', rule['out'], handle)
+            sent_packets = self._credit(key, carried.get(key, 0.0) +
+                                        min(self.load_kbps, rate_kbps) * 1000 / 8 * elapsed * (1 - qdisc['loss']) / FakeBackend.PACKET_SIZE)
+            counters = qdisc['counters']
+            counters['packets'] += sent_packets
+            counters['bytes'] += sent_packets * FakeBackend.PACKET_SIZE
+            counters['drops'] += max(0, packets - sent_packets)
+            counters['backlog_packets'] = qdisc['limit'] if rate_kbps < self.load_kbps else 0
+            counters['backlog'] = counters['backlog_packets'] * FakeBackend.PACKET_SIZE
+
+    def _credit(self, key: tuple, packets: float) -> int:
+        """The whole packets of a count, its fraction carried to the next advance"""
+        whole = int(packets)
+        self.carried[key] = packets - whole
+        return whole
+
+    def _render_iptables(self) -> str:
+        lines = [
+            'Chain FORWARD (policy ACCEPT 0 packets, 0 bytes)',
+            '    pkts      bytes target     prot opt in     out     source               destination',
+        ]
+        for rule in self.rules:
+            lines.append('{:>8} {:>10} MARK       all  --  {:<6} {:<6}  0.0.0.0/0            0.0.0.0/0            {} MARK set {}'.format(
+                rule['packets'], rule['bytes'], rule['in'], rule['out'], rule['match'], hex(rule['mark'])))
+        return '\n'.join(lines) + '\n'
+
+    def _render_tc(self, iface: str) -> str:
+        lines = []
+        for handle, qdisc in self.qdiscs.get(iface, {}).items():
+            counters = qdisc['counters']
+            if qdisc['kind'] == 'netem':
+                lines.append(f"qdisc netem {handle}: parent {qdisc['parent']} {qdisc['options']}")
+            else:
+                lines.append(f"qdisc htb {handle}: root refcnt 2 r2q 10 default 0xffff direct_packets_stat 0 direct_qlen 1000")
+            lines.append(f" Sent {counters['bytes']} bytes {counters['packets']} pkt (dropped {counters['drops']}, overlimits 0 requeues 0)")
+            lines.append(f" backlog {counters['backlog']}b {counters['backlog_packets']}p requeues 0")
+        return '\n'.join(lines) + '\n'
+
+def create_backend(name: str = 'shell', **kwargs):
+    """Create the kernel backend selected in config.yaml"""
+    if name in [None, '', 'shell']:
+        return ShellBackend()
+    if name == 'fake':
+        return FakeBackend(**kwargs)
+    raise ValueError(f"Invalid kernel backend: {name}")
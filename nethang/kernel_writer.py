@@ -0,0 +1,303 @@
+"""
+Kernel Writer
+
+This module provides the single writer of the kernel state: every tc,
+iptables and ipset command changing it, from the request handlers, the jobs,
+the timeline processes or the cleanup, is queued to one thread of the process
+owning the paths, which applies them in order.
+
+Whatever is pending when the writer wakes up is applied as one transaction:
+the consecutive tc commands in a single 'tc -batch', the iptables lock taken
+once. Superseded commands are dropped before:
+
+- a 'tc class/qdisc change' followed by another change, or a deletion, of the
+  same class or qdisc, e.g. a timeslot change overtaken by the next one
+- the commands of a timeline process whose path is being deactivated
+
+The timeline processes send their commands to the owner through a pipe, one
+JSON line per command or batch. Writes smaller than PIPE_BUF are atomic, so
+the processes, which may be terminated at any time, share no lock with it.
+
+The queue depth and the latencies are in the perf registry:
+
+    kernel.queue_depth      gauge, the commands waiting for the writer
+    kernel.queue_wait       histogram, from queued to applied
+    kernel.transaction      histogram, applying a transaction
+    kernel.coalesced        counter, commands dropped as superseded
+    timeline.transition     histogram, from the commands of a timeline process
+                            sent to applied, once per process and transaction
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import json
+import time
+import atexit
+import select
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from . import logger
+from nethang.proc_lock import ProcLock
+from nethang.perf import perf
+
+queue_depth = perf.gauge('kernel.queue_depth')
+queue_wait = perf.histogram('kernel.queue_wait')
+transaction_latency = perf.histogram('kernel.transaction')
+coalesced_count = perf.counter('kernel.coalesced')
+transaction_count = perf.counter('kernel.transactions')
+transition_latency = perf.histogram('timeline.transition')
+
+# Bytes written to the pipe at once, atomically
+PIPE_BUF = getattr(select, 'PIPE_BUF', 512)
+# Seconds the source of a deactivated path is remembered, its process is terminated right after
+RETIRED_TIMEOUT = 60
+
+class _Mutation:
+    """Commands queued together, and their completion for the thread waiting for them"""
+    __slots__ = ('cmds', 'source', 'queued', 'done')
+
+    def __init__(self, cmds: List[str], source: Optional[str] = None, wait: bool = False,
+                 queued: Optional[float] = None):
+        self.cmds = cmds
+        self.source = source
+        # Monotonic, the same clock in the timeline processes
+        self.queued = time.monotonic() if queued is None else queued
+        self.done = threading.Event() if wait else None
+
+def target(cmd: str) -> Optional[Tuple[str, str, str, str]]:
+    """The verb of a tc class or qdisc command, and the class or qdisc it applies to, None for other commands"""
+    tokens = cmd.split()
+    if len(tokens) < 4 or tokens[0] != 'tc' or tokens[1] not in ('class', 'qdisc'):
+        return None
+
+    def option(name: str) -> str:
+        return tokens[tokens.index(name) + 1] if name in tokens[:-1] else ''
+
+    where = option('classid') if tokens[1] == 'class' else (option('parent') or 'root')
+    return tokens[2], tokens[1], option('dev'), where
+
+def coalesce(cmds: List[str]) -> List[str]:
+    """Drop the tc changes superseded by a later change, or deletion, of the same class or qdisc"""
+    superseded = set()
+    changes: Dict[Tuple[str, str, str], int] = {}
+    for index, cmd in enumerate(cmds):
+        parsed = target(cmd)
+        if parsed is None:
+            continue
+        verb, key = parsed[0], parsed[1:]
+        if verb in ('change', 'del') and key in changes:
+            superseded.add(changes.pop(key))
+        if verb == 'change':
+            changes[key] = index
+        else:
+            # Another command on the class or qdisc, the changes before it are kept
+            changes.pop(key, None)
+    if superseded:
+        coalesced_count.inc(len(superseded))
+    return [cmd for index, cmd in enumerate(cmds) if index not in superseded]
+
+class KernelWriter:
+    """Apply the kernel commands of the process and of its timeline processes, from a single thread"""
+
+    def __init__(self, backend, lock_file: str):
+        """
+        Args:
+            backend: the kernel backend running the commands
+            lock_file: the iptables lock, shared with the other NetHang processes
+        """
+        self.backend = backend
+        self.lock_file = lock_file
+        self.owner_pid = os.getpid()
+        # Source of the commands sent by a timeline process, set in that process
+        self.source: Optional[str] = None
+        # Sources retired, with the time they were
+        self.retired: Dict[str, float] = {}
+        self.pending: List[_Mutation] = []
+        self.condition = threading.Condition()
+        self.apply_lock = threading.Lock()
+        self.local = threading.local()
+        self.closed = False
+
+        self.read_fd, self.write_fd = os.pipe()
+        self.reader = threading.Thread(target=self._read_loop, name='nethang-kernel-reader', daemon=True)
+        self.reader.start()
+        self.writer = threading.Thread(target=self._write_loop, name='nethang-kernel-writer', daemon=True)
+        self.writer.start()
+        # The commands of the cleanup at exit are applied by their caller
+        atexit.register(self.close)
+
+    def submit(self, cmds: List[str], wait: bool = True):
+        """
+        Queue commands for the writer.
+
+        In the owner process, the caller waits for them to be applied unless
+        wait is False. In a timeline process, they are sent to the owner.
+        """
+        if not cmds:
+            return
+        if self.sender():
+            self._send(cmds)
+            return
+
+        collected = getattr(self.local, 'transaction', None)
+        if collected is not None:
+            collected.extend(cmds)
+            if not any('<' in cmd for cmd in cmds):
+                return
+            # The input file of the command is removed once it returned
+            cmds = collected[:]
+            collected.clear()
+
+        if self.closed:
+            with self.apply_lock:
+                self._apply(cmds)
+            return
+
+        mutation = _Mutation(list(cmds), wait=wait)
+        self._queue(mutation)
+        if wait:
+            mutation.done.wait()
+
+    def sender(self) -> bool:
+        """Whether the commands are sent to the owner process, from a timeline process"""
+        return os.getpid() != self.owner_pid
+
+    @contextmanager
+    def transaction(self):
+        """Collect the commands submitted by the thread, and apply them together at the end"""
+        if os.getpid() != self.owner_pid or getattr(self.local, 'transaction', None) is not None:
+            yield
+            return
+        self.local.transaction = []
+        try:
+            yield
+        finally:
+            cmds, self.local.transaction = self.local.transaction, None
+            self.submit(cmds)
+
+    def retire(self, source: str):
+        """Drop the commands of a timeline process, pending or still to come"""
+        with self.condition:
+            now = time.monotonic()
+            # The processes retired long ago are gone, and their commands with them
+            self.retired = {retired: since for retired, since in self.retired.items()
+                            if now - since < RETIRED_TIMEOUT}
+            self.retired[source] = now
+            kept = [mutation for mutation in self.pending if mutation.source != source]
+            coalesced_count.inc(sum(len(mutation.cmds) for mutation in self.pending) -
+                                sum(len(mutation.cmds) for mutation in kept))
+            self.pending = kept
+            queue_depth.set(sum(len(mutation.cmds) for mutation in self.pending))
+
+    def flush(self):
+        """Wait for the commands queued so far to be applied"""
+        mutation = _Mutation([], wait=True)
+        self._queue(mutation)
+        mutation.done.wait()
+
+    def close(self):
+        """Stop the writer once the pending commands are applied, the next ones are applied by their caller"""
+        if os.getpid() != self.owner_pid:
+            return
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+
+    def _queue(self, mutation: _Mutation):
+        with self.condition:
+            self.pending.append(mutation)
+            queue_depth.set(sum(len(mutation.cmds) for mutation in self.pending))
+            self.condition.notify()
+
+    def _send(self, cmds: List[str]):
+        """Send commands to the owner process, one message per command if they are too long for one write"""
+        message = (json.dumps({'source': self.source, 'sent': time.monotonic(), 'cmds': cmds}) + '\n').encode()
+        if len(message) <= PIPE_BUF or len(cmds) == 1:
+            os.write(self.write_fd, message)
+            return
+        for cmd in cmds:
+            self._send([cmd])
+
+    def _read_loop(self):
+        buffer = b''
+        while True:
+            try:
+                data = os.read(self.read_fd, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Invalid kernel commands from a timeline process: {line[:100]}")
+                    continue
+                with self.condition:
+                    if message['source'] in self.retired:
+                        coalesced_count.inc(len(message['cmds']))
+                    else:
+                        self._queue(_Mutation(message['cmds'], source=message['source'], queued=message['sent']))
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending and self.closed:
+                    return
+                mutations, self.pending = self.pending, []
+                queue_depth.set(0)
+
+            with self.apply_lock:
+                self._apply(coalesce([cmd for mutation in mutations for cmd in mutation.cmds]))
+            now = time.monotonic()
+            sent: Dict[str, float] = {}
+            for mutation in mutations:
+                queue_wait.record(now - mutation.queued)
+                if mutation.source is not None:
+                    sent[mutation.source] = min(sent.get(mutation.source, now), mutation.queued)
+                if mutation.done is not None:
+                    mutation.done.set()
+            # The kernel update of a timeslot, from the first command its process sent
+            for queued in sent.values():
+                transition_latency.record(now - queued)
+
+    def _apply(self, cmds: List[str]):
+        """Apply commands as one transaction"""
+        if not cmds:
+            return
+        start = time.perf_counter()
+        try:
+            if any(cmd.startswith('iptables') for cmd in cmds):
+                with ProcLock(self.lock_file):
+                    self._run(cmds)
+            else:
+                self._run(cmds)
+        except Exception as e:
+            logger.error(f"Error in applying the kernel commands: {e}")
+        transaction_latency.record(time.perf_counter() - start)
+        transaction_count.inc()
+
+    def _run(self, cmds: List[str]):
+        """Run the commands in order, the consecutive tc ones in a single batch"""
+        batch: List[str] = []
+        for cmd in cmds + [None]:
+            if cmd is not None and cmd.startswith('tc '):
+                batch.append(cmd)
+                continue
+            if len(batch) == 1:
+                self.backend.run(batch[0])
+            elif batch:
+                self.backend.run_batch(batch)
+            batch = []
+            if cmd is not None:
+                self.backend.run(cmd)
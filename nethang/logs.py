@@ -0,0 +1,194 @@
+"""
+Logs
+
+This module provides the logging pipeline of NetHang. The records are put on
+a queue by the threads logging them and written to the log file by a single
+listener thread, so the hot paths (timeslot transitions, kernel commands,
+monitor samples) never wait for the disk. The forked timeline processes write
+their records themselves.
+
+Structured records are built with kv(). Their message is formatted from the
+fields only when written, by the listener thread, and not at all when the
+level is disabled. A field may be a callable, called at that time:
+
+    logger.info(kv('set_rule', path=9528, direction='uplink', config=config))
+    -> set_rule path=9528 direction=uplink config={"rate_limit": 4000, ...}
+
+The fields must not be modified once logged.
+
+Each call site may log a burst of records, then a steady rate per second
+('log_rate_limit' and 'log_burst' of config.yaml). The records over the limit
+are dropped and counted in the 'log.suppressed' counter of the perf registry,
+the count is appended to the next record of the call site:
+
+    set_rule path=9528 direction=uplink ... [suppressed 120]
+
+Warnings and errors are never dropped.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+
+# Records per second of a call site, after its burst
+LOG_RATE_LIMIT = 10
+# Records a call site may log at once
+LOG_BURST = 20
+
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+class StructuredMessage:
+    """An event and its fields, formatted as 'event key=value ...' when written"""
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event: str, fields: Dict):
+        self.event = event
+        self.fields = fields
+
+    @staticmethod
+    def _format(value) -> str:
+        if callable(value):
+            value = value()
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value, separators=(',', ':'), default=str)
+        return str(value)
+
+    def __str__(self) -> str:
+        return ' '.join([self.event] + [f'{key}={self._format(value)}' for key, value in self.fields.items()])
+
+def kv(event: str, **fields) -> StructuredMessage:
+    """A structured record: an event name and its fields, see StructuredMessage"""
+    return StructuredMessage(event, fields)
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site, dropping the records of a site over its rate"""
+
+    def __init__(self, rate: float = LOG_RATE_LIMIT, burst: int = LOG_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (pathname, lineno) -> [tokens, last refill, suppressed records]
+        self.sites: Dict[Tuple[str, int], List] = {}
+        self.lock = threading.Lock()
+        self.suppressed = None
+
+    def configure(self, rate: float, burst: int):
+        """Set the rate, 0 for no limit, and the burst"""
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.sites.clear()
+        # Before the timeline processes are forked, for them to share the counter
+        self._counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get((record.pathname, record.lineno))
+            if site is None:
+                site = self.sites[(record.pathname, record.lineno)] = [float(self.burst), now, 0]
+            site[0] = min(float(self.burst), site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] < 1:
+                site[2] += 1
+                self._counter().inc()
+                return False
+            site[0] -= 1
+            if site[2]:
+                record.suppressed = site[2]
+                site[2] = 0
+        return True
+
+    def _counter(self):
+        if self.suppressed is None:
+            # Not at import, the perf registry is part of the engine
+            from nethang.perf import perf
+            self.suppressed = perf.counter('log.suppressed')
+        return self.suppressed
+
+class LogFormatter(logging.Formatter):
+    """Formatter appending the count of the records suppressed before this one"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f'{message} [suppressed {suppressed}]' if suppressed else message
+
+class _QueueHandler(QueueHandler):
+    """Queue the records as they are, formatted by the listener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue stays in the process, the record needs no pickling
+        return record
+
+class LogPipeline:
+    """The queue handler of a logger, and the listener writing its records"""
+
+    def __init__(self, logger: logging.Logger, handlers: List[logging.Handler]):
+        self.logger = logger
+        self.rate_limit = RateLimitFilter()
+        self.queue = queue.SimpleQueue()
+        self.handler = _QueueHandler(self.queue)
+        self.handler.addFilter(self.rate_limit)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.lock = threading.Lock()
+        logger.addHandler(self.handler)
+        self.listener.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def add_handler(self, handler: logging.Handler):
+        """Write the records to another handler too"""
+        with self.lock:
+            if handler not in self.listener.handlers:
+                self.listener.handlers = self.listener.handlers + (handler,)
+
+    def stop(self):
+        """Write the queued records and stop the listener"""
+        with self.lock:
+            if self.listener._thread is not None:
+                self.listener.stop()
+
+    def _after_fork(self):
+        # A forked process, a timeline process, ends with os._exit() without
+        # running atexit, the records of a listener of its own would be lost:
+        # it writes them synchronously
+        self.lock = threading.Lock()
+        self.rate_limit.lock = threading.Lock()
+        if self.listener._thread is None:
+            return
+        self.listener._thread = None
+        self.handler.enqueue = self.listener.handle
+
+# The pipeline of the package logger, see setup_logging()
+pipeline: Optional[LogPipeline] = None
+
+def setup_logging(logger: logging.Logger, log_file: str) -> LogPipeline:
+    """Log the records of the logger to a rotating log file, from a listener thread"""
+    global pipeline
+    error = None
+    try:
+        handler = RotatingFileHandler(log_file, maxBytes=10000000, backupCount=5)
+    except (IOError, PermissionError) as e:
+        # If we can't create the log file, just log to stderr
+        error = e
+        handler = logging.StreamHandler()
+    handler.setFormatter(LogFormatter(LOG_FORMAT))
+    handler.setLevel(logging.INFO)
+    pipeline = LogPipeline(logger, [handler])
+    if error is not None:
+        logger.warning(f"Could not create log file: {error}")
+        logger.warning("Logging to stderr instead")
+    return pipeline
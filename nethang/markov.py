@@ -0,0 +1,154 @@
+"""
+Markov Models
+
+This module provides the procedural models: instead of a fixed 'timeline'
+list, a model defines states, the transition probabilities between them and
+the distribution of the time spent in each state. The timeslots are
+generated lazily from a seeded random generator, so a run is endless and not
+periodic, uses a constant memory, and is reproduced exactly from its seed.
+
+Example (in models.yaml):
+
+    (Scenario) Commute:
+      global:
+        uplink: {rate_limit: 5000, delay: 40, throttle_type: "on", latency_type: "constant"}
+        downlink: {rate_limit: 20000, delay: 40, throttle_type: "on", latency_type: "constant"}
+      markov:
+        seed: 42                # optional, a random seed is drawn and logged otherwise
+        initial: good           # optional, the first state by default
+        states:
+          good:
+            dwell: {distribution: exponential, mean: 20, min: 2}
+            transitions: {handover: 0.7, fade: 0.3}
+          handover:
+            uplink: {loss: 10, loss_type: "burst-medium"}
+            downlink: {loss: 10, loss_type: "burst-medium"}
+            dwell: {distribution: uniform, min: 0.5, max: 2}
+            transitions: {good: 1}
+          fade:
+            uplink: {rate_limit: 500}
+            downlink: {rate_limit: 1000}
+            dwell: {distribution: lognormal, mu: 1.5, sigma: 0.5}
+            transitions: {good: 0.8, handover: 0.2}
+
+The dwell time is in seconds, either a number or a distribution among
+'constant' (value), 'uniform' (min, max), 'exponential' (mean), 'normal'
+(mean, stdev) and 'lognormal' (mu, sigma of the underlying normal), with
+optional 'min'/'max' bounds. A state without transitions is absorbing.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import random
+from typing import Dict, Iterator, Optional, Tuple
+
+# Lowest dwell time in seconds, so a chain of zero dwell times cannot spin
+MIN_DWELL = 0.01
+
+DISTRIBUTIONS = {
+    'constant': ('value',),
+    'uniform': ('min', 'max'),
+    'exponential': ('mean',),
+    'normal': ('mean', 'stdev'),
+    'lognormal': ('mu', 'sigma'),
+}
+
+class MarkovModel:
+    """A model generating its timeslots from a Markov chain"""
+
+    def __init__(self, spec: Dict, seed: Optional[int] = None):
+        """
+        Args:
+            spec: the 'markov' section of the model
+            seed: seed of the generator, overrides the one of the spec, drawn at random if none
+
+        Raises:
+            ValueError: if the spec is invalid
+        """
+        if not isinstance(spec, dict) or not spec.get('states'):
+            raise ValueError('A Markov model needs states')
+        self.states = list(spec['states'].keys())
+        self.indexes = {name: index for index, name in enumerate(self.states)}
+        self.initial = spec.get('initial', self.states[0])
+        if self.initial not in self.states:
+            raise ValueError(f'Invalid initial state: {self.initial}')
+
+        if seed is None:
+            seed = spec.get('seed')
+        self.seed = int(seed) if seed is not None else random.SystemRandom().randrange(2 ** 32)
+
+        self.settings: Dict[str, Dict] = {}
+        self.dwells: Dict[str, Dict] = {}
+        self.transitions: Dict[str, Tuple[list, list]] = {}
+        for name, state in spec['states'].items():
+            state = state or {}
+            self.settings[name] = {direction: state.get(direction) or {} for direction in ['uplink', 'downlink']}
+            self.dwells[name] = MarkovModel._parse_dwell(name, state.get('dwell'))
+            self.transitions[name] = MarkovModel._parse_transitions(name, state.get('transitions'), self.states)
+
+    @staticmethod
+    def _parse_dwell(name: str, dwell) -> Dict:
+        if isinstance(dwell, (int, float)):
+            dwell = {'distribution': 'constant', 'value': dwell}
+        if not isinstance(dwell, dict):
+            raise ValueError(f'Missing dwell time of state {name}')
+        distribution = dwell.get('distribution', 'constant')
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f'Invalid dwell distribution of state {name}: {distribution}')
+        for parameter in DISTRIBUTIONS[distribution]:
+            if not isinstance(dwell.get(parameter), (int, float)):
+                raise ValueError(f"Missing '{parameter}' of the dwell time of state {name}")
+        return dict(dwell, distribution=distribution)
+
+    @staticmethod
+    def _parse_transitions(name: str, transitions, states: list) -> Tuple[list, list]:
+        if not transitions:
+            # Absorbing state
+            return [name], [1.0]
+        targets, weights = [], []
+        for target, probability in transitions.items():
+            if target not in states:
+                raise ValueError(f'Invalid transition of state {name} to {target}')
+            if probability < 0:
+                raise ValueError(f'Negative transition probability of state {name} to {target}')
+            if probability > 0:
+                targets.append(target)
+                weights.append(float(probability))
+        if not targets:
+            raise ValueError(f'No transition of state {name}')
+        # The probabilities are normalized, they do not need to sum up to 1
+        total = sum(weights)
+        return targets, [weight / total for weight in weights]
+
+    def _draw_dwell(self, rng: random.Random, state: str) -> float:
+        dwell = self.dwells[state]
+        distribution = dwell['distribution']
+        if distribution == 'constant':
+            value = dwell['value']
+        elif distribution == 'uniform':
+            value = rng.uniform(dwell['min'], dwell['max'])
+        elif distribution == 'exponential':
+            value = rng.expovariate(1.0 / dwell['mean'])
+        elif distribution == 'normal':
+            value = rng.gauss(dwell['mean'], dwell['stdev'])
+        else:
+            value = rng.lognormvariate(dwell['mu'], dwell['sigma'])
+        if 'min' in dwell:
+            value = max(value, dwell['min'])
+        if 'max' in dwell:
+            value = min(value, dwell['max'])
+        return max(value, MIN_DWELL)
+
+    def timeslots(self) -> Iterator[Tuple[int, Dict]]:
+        """Iterate endlessly over (state index, timeslot) pairs"""
+        rng = random.Random(self.seed)
+        state = self.initial
+        while True:
+            yield self.indexes[state], {
+                'duration': self._draw_dwell(rng, state),
+                'uplink': self.settings[state]['uplink'],
+                'downlink': self.settings[state]['downlink'],
+            }
+            targets, weights = self.transitions[state]
+            state = rng.choices(targets, weights)[0]
@@ -0,0 +1,323 @@
+"""
+Matrix
+
+This module provides the scenario matrix runner: every combination of a list
+of models and a list of filters is run for a while on a temporary path, as
+many at a time as there are free marks, and the metrics of each run are
+collected into a single report.
+
+Example of a matrix (YAML or JSON):
+
+    models: [LTE_with_handover, High_speed_Driving]  # or 'all'
+    filters:
+      - {protocol: tcp, lan_ip: 10.0.0.5, wan_port: 443}
+      - {protocol: udp, lan_ip: 10.0.0.6}
+    duration: 60        # seconds of each run, optional with 'cycles'
+    speed: 1            # time compression of the timelines
+    cycles: null        # stop each run after its timeline cycles
+    concurrency: null   # cap of the concurrent runs, the free marks by default
+
+The runs of a same filter never overlap, since the first path matching a
+packet would shape it: the concurrency is bound by the number of filters.
+
+The runner lives in the server and is driven through /api/matrix. The command
+line below submits a matrix to a running server and waits for its report:
+
+    python -m nethang.matrix matrix.yaml --url http://localhost:9527 --output report.json
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import time
+import uuid
+import argparse
+import threading
+from typing import Dict, List, Optional
+from . import logger, PATHS_FILE
+from nethang.id_manager import IDManager
+from nethang.metrics_store import FIELDS
+from nethang.simu_path import SimuPath
+
+# Seconds between two checks of the running runs
+POLL_INTERVAL = 0.5
+# Finished matrices whose reports are kept, the oldest are dropped first
+MAX_FINISHED_MATRICES = 20
+# States of a matrix which is over
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+FILTER_DEFAULTS = {
+    'protocol': 'ip',
+    'lan_ip': '',
+    'lan_port': 'Any',
+    'wan_ip': '',
+    'wan_port': 'Any',
+}
+
+def summarize_metrics(metrics: Dict) -> Dict:
+    """Reduce the history of a run, as queried from MetricsStore, to min/max/avg per field"""
+    summary = {}
+    for direction, result in metrics.items():
+        series = result['series']
+        samples = len(series['timestamps'])
+        summary[direction] = {'samples': samples}
+        if not samples:
+            continue
+        for field in FIELDS:
+            summary[direction][field] = {
+                'min': min(series[field]['min']),
+                'max': max(series[field]['max']),
+                'avg': sum(series[field]['avg']) / samples,
+            }
+    return summary
+
+class MatrixRunner:
+    """Run a matrix of (model x filter) combinations on temporary paths"""
+
+    def __init__(self, manager, spec: Dict):
+        """
+        Args:
+            manager: the SimuPathManager running the paths
+            spec: the matrix, see the module documentation
+
+        Raises:
+            ValueError: if the matrix is invalid
+        """
+        self.manager = manager
+        self.id = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self.thread = None
+        self.cancelled = False
+        self.state = 'pending'
+        self.error = None
+        self.created = time.time()
+
+        models = spec.get('models')
+        if models == 'all':
+            models = list(manager.models.keys())
+        if not models or not isinstance(models, list):
+            raise ValueError('A matrix needs models')
+        for model in models:
+            if model not in manager.models:
+                raise ValueError(f'Model {model} not found')
+        filters = spec.get('filters') or [{}]
+        if not isinstance(filters, list) or not all(isinstance(filter_, dict) for filter_ in filters):
+            raise ValueError('Invalid filters')
+
+        self.duration = float(spec['duration']) if spec.get('duration') else None
+        self.cycles = int(spec['cycles']) if spec.get('cycles') else None
+        self.speed = SimuPath.parse_speed(spec.get('speed'))
+        if self.duration is None and self.cycles is None:
+            raise ValueError('A matrix needs a duration or cycles')
+        if self.duration is not None and self.duration <= 0:
+            raise ValueError('Invalid duration')
+        self.concurrency = int(spec['concurrency']) if spec.get('concurrency') else None
+
+        self.runs: List[Dict] = []
+        for model in models:
+            for filter_index, filter_ in enumerate(filters):
+                self.runs.append({
+                    'index': len(self.runs),
+                    'model': model,
+                    'filter': dict(FILTER_DEFAULTS, **filter_),
+                    'filter_index': filter_index,
+                    'status': 'queued',
+                    'path_id': None,
+                    'start': None,
+                    'end': None,
+                    'metrics': None,
+                    'error': None,
+                })
+
+    def start(self):
+        self.state = 'running'
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Stop the running runs and drop the queued ones"""
+        self.cancelled = True
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        try:
+            while not self.cancelled:
+                running = [run for run in self.runs if run['status'] == 'running']
+                for run in running:
+                    # A failure of a run fails that run only
+                    try:
+                        over = self._is_over(run)
+                    except Exception as e:
+                        run['error'] = str(e)
+                        self._finish(run, 'failed')
+                        continue
+                    if over:
+                        self._finish(run, 'done')
+                if not self._launch() and not any(run['status'] == 'running' for run in self.runs):
+                    break
+                time.sleep(POLL_INTERVAL)
+        except Exception as e:
+            logger.error(f"Error in matrix {self.id}: {e}")
+            self.error = str(e)
+        finally:
+            for run in self.runs:
+                if run['status'] == 'running':
+                    self._finish(run, 'cancelled')
+                elif run['status'] == 'queued':
+                    run['status'] = 'cancelled'
+            self.state = 'cancelled' if self.cancelled else 'failed' if self.error else 'done'
+            logger.info(f"Matrix {self.id} {self.state}")
+
+    def is_finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def _launch(self) -> bool:
+        """Start the queued runs which can run now, return whether any run is still queued"""
+        queued = [run for run in self.runs if run['status'] == 'queued']
+        for run in queued:
+            running = [run_ for run_ in self.runs if run_['status'] == 'running']
+            if self.concurrency and len(running) >= self.concurrency:
+                break
+            if any(run_['filter_index'] == run['filter_index'] for run_ in running):
+                continue
+            try:
+                path_id = self._add_path(run)
+            except Exception as e:
+                run.update(status='failed', error=str(e))
+                continue
+            if path_id is None:
+                # No free mark, wait for a run to finish
+                break
+            try:
+                self.manager.activate_path(path_id, speed=self.speed, cycles=self.cycles)
+                run.update(status='running', start=time.time())
+            except Exception as e:
+                run.update(status='failed', error=str(e))
+                self._delete_path(run)
+        return any(run['status'] == 'queued' for run in self.runs)
+
+    def _add_path(self, run: Dict) -> Optional[int]:
+        id_manager = IDManager(paths_file=PATHS_FILE, id_range=type(self.manager).mark_range)
+        with self.manager.paths_lock():
+            path_id = id_manager.acquire_id()
+            if path_id is None:
+                return None
+            self.manager.add_path({
+                'id': path_id,
+                'name': f"matrix {self.id} #{run['index']}",
+                'status': 'inactive',
+                'filter_settings': dict(run['filter'], mark=path_id),
+                'simu_settings': {
+                    'mode': 'model',
+                    'model': run['model'],
+                    'uplink': {'mode': 'bypass', 'restrict_settings': None},
+                    'downlink': {'mode': 'bypass', 'restrict_settings': None},
+                },
+            })
+        run['path_id'] = path_id
+        return path_id
+
+    def _delete_path(self, run: Dict):
+        try:
+            with self.manager.paths_lock():
+                self.manager.delete_path(run['path_id'])
+        except Exception as e:
+            logger.error(f"Error in deleting the path {run['path_id']} of matrix {self.id}: {e}")
+            run['error'] = run['error'] or str(e)
+            run['status'] = 'failed'
+
+    def _is_over(self, run: Dict) -> bool:
+        if self.duration is not None and time.time() - run['start'] >= self.duration:
+            return True
+        # Stopped by the manager after its cycles
+        return not self.manager.paths[run['path_id']].is_active()
+
+    def _finish(self, run: Dict, status: str):
+        run['end'] = time.time()
+        try:
+            if self.manager.paths[run['path_id']].is_active():
+                self.manager.deactivate_path(run['path_id'])
+            run['metrics'] = summarize_metrics(self.manager.metrics_store.query(run['path_id'], run['start'], run['end']))
+        except Exception as e:
+            run['error'] = run['error'] or str(e)
+            status = 'failed'
+        finally:
+            run['status'] = status
+            self._delete_path(run)
+
+    def report(self) -> Dict:
+        """Report of the matrix, with the metrics of the finished runs"""
+        return {
+            'id': self.id,
+            'state': self.state,
+            'error': self.error,
+            'created': self.created,
+            'duration': self.duration,
+            'cycles': self.cycles,
+            'speed': self.speed,
+            'counts': {status: sum(1 for run in self.runs if run['status'] == status)
+                       for status in ['queued', 'running', 'done', 'failed', 'cancelled']},
+            'runs': [{key: value for key, value in run.items() if key != 'filter_index'} for run in self.runs],
+        }
+
+def prune_matrices(matrices: Dict[str, MatrixRunner]):
+    """Drop the oldest finished matrices beyond MAX_FINISHED_MATRICES, the running ones are kept"""
+    finished = [id for id, matrix in matrices.items() if matrix.is_finished()]
+    for id in finished[:max(0, len(finished) - MAX_FINISHED_MATRICES)]:
+        del matrices[id]
+
+def print_report(report: Dict):
+    print(f"Matrix {report['id']}: {report['state']}")
+    if report.get('error'):
+        print(f"Error: {report['error']}")
+    print(f"{'model':<40} {'filter':<40} {'status':<10} {'up kbit/s':>10} {'down kbit/s':>12}")
+    for run in report['runs']:
+        filter_ = ' '.join(f'{key}={value}' for key, value in run['filter'].items() if value not in ['', 'Any'])
+        rates = []
+        for direction in ['uplink', 'downlink']:
+            stats = (run['metrics'] or {}).get(direction, {})
+            rates.append(f"{stats['bitRateOut']['avg'] / 1000:.0f}" if 'bitRateOut' in stats else '-')
+        print(f"{run['model']:<40} {filter_:<40} {run['status']:<10} {rates[0]:>10} {rates[1]:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a scenario matrix on a NetHang server')
+    parser.add_argument('matrix', help='matrix file (YAML or JSON)')
+    parser.add_argument('--url', default='http://localhost:9527', help='URL of the NetHang server')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--output', help='JSON file of the report')
+    args = parser.parse_args()
+
+    import json
+    import yaml
+    import requests
+
+    with open(args.matrix, 'r') as f:
+        spec = yaml.safe_load(f)
+
+    session = requests.Session()
+    session.post(args.url + '/login', data={'username': args.username, 'password': args.password})
+    result = session.post(args.url + '/api/matrix', json=spec).json()
+    if result.get('status') != 'success':
+        raise SystemExit(f"Matrix rejected: {result.get('message')}")
+
+    matrix_id = result['id']
+    try:
+        while True:
+            report = session.get(args.url + f'/api/matrix/{matrix_id}').json()['report']
+            if report['state'] in FINISHED_STATES:
+                break
+            time.sleep(2)
+    except KeyboardInterrupt:
+        report = session.delete(args.url + f'/api/matrix/{matrix_id}').json()['report']
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['state'] == 'failed':
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
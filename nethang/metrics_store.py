@@ -0,0 +1,355 @@
+"""
+Metrics Store
+
+This module provides a persistent on-disk time-series store for the traffic
+statistics of the paths.
+
+Each path and direction owns a set of memory-mapped ring files made of
+fixed-width records: one for the raw samples and one per rollup resolution
+(10 seconds and 1 minute) holding min/max/avg values. The rollups are computed
+incrementally as the samples come in, and queries only read the records of the
+requested range.
+
+The raw ring holds one record per RAW_INTERVAL at most, whatever the sampling
+interval of the monitor: the samples taken faster are averaged into the record
+of their interval, which keeps the retention of the ring a duration.
+
+Queries may ask for a number of points, the series are then downsampled to at
+most that many points whatever the range (see nethang/downsample.py).
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import mmap
+import struct
+import threading
+from typing import Dict, List, Optional
+from nethang.downsample import aggregate, lttb, DOWNSAMPLE_METHODS
+
+# Values kept for each sample, in record order
+FIELDS = (
+    'bitRateIn', 'bitRateOut',
+    'packetRateIn', 'packetRateOut',
+    'queueBytes', 'queuePackets',
+    'dropPackets', 'dropRate',
+)
+
+# Seconds per raw record at most, the faster samples are averaged into it
+RAW_INTERVAL = 1
+
+# (name, resolution in seconds, capacity in records)
+LEVELS = (
+    ('raw', 0, 7200),       # 2 hours, one record per RAW_INTERVAL at most
+    ('10s', 10, 8640),      # 24 hours
+    ('1m', 60, 10080),      # 7 days
+)
+
+def sample_from_stats(direction_stats: Dict) -> List[float]:
+    """Extract the stored values from the stats of a direction, as computed by TrafficMonitor"""
+    return [
+        direction_stats['ingress']['bitRate'],
+        direction_stats['egress']['bitRate'],
+        direction_stats['ingress']['packetRate'],
+        direction_stats['egress']['packetRate'],
+        direction_stats['queue']['bytes'],
+        direction_stats['queue']['packets'],
+        direction_stats['queue']['dropPackets'],
+        direction_stats['queue']['dropRate'],
+    ]
+
+class RingFile:
+    """Fixed-width records in a memory-mapped ring buffer file, ordered by timestamp"""
+
+    MAGIC = b'NHRING01'
+    # magic, record size, capacity, total records written
+    HEADER = struct.Struct('<8sIIQ')
+
+    def __init__(self, filename: str, record: struct.Struct, capacity: int):
+        self.filename = filename
+        self.record = record
+        self.capacity = capacity
+        size = self.HEADER.size + record.size * capacity
+
+        exists = os.path.exists(filename) and os.path.getsize(filename) == size
+        self.handle = open(filename, 'r+b' if exists else 'w+b')
+        if not exists:
+            self.handle.truncate(size)
+        self.mm = mmap.mmap(self.handle.fileno(), size)
+
+        magic, record_size, capacity_, self.written = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC or record_size != record.size or capacity_ != capacity:
+            # New or incompatible file, start from scratch
+            self.written = 0
+            self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self.mm, 0, self.MAGIC, self.record.size, self.capacity, self.written)
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER.size + (index % self.capacity) * self.record.size
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def append(self, *values):
+        self.record.pack_into(self.mm, self._offset(self.written), *values)
+        self.written += 1
+        self._write_header()
+
+    def replace_last(self, *values):
+        """Overwrite the latest record, its timestamp must be kept"""
+        self.record.pack_into(self.mm, self._offset(self.written - 1), *values)
+
+    def _timestamp(self, index: int) -> float:
+        # The timestamp is always the first field of a record
+        return struct.unpack_from('<d', self.mm, self._offset(index))[0]
+
+    def _bisect(self, timestamp: float) -> int:
+        """Index of the first record with a timestamp greater or equal to the given one"""
+        lo, hi = self.written - len(self), self.written
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def oldest(self) -> Optional[float]:
+        """Timestamp of the oldest record, None if empty"""
+        if len(self) == 0:
+            return None
+        return self._timestamp(self.written - len(self))
+
+    def read(self, start: float, end: float) -> List[tuple]:
+        """Read the records with start <= timestamp < end"""
+        first, last = self._bisect(start), self._bisect(end)
+        records = []
+        # At most two contiguous segments because of the wrap around
+        while first < last:
+            count = min(last - first, self.capacity - first % self.capacity)
+            offset = self._offset(first)
+            records.extend(self.record.iter_unpack(self.mm[offset:offset + count * self.record.size]))
+            first += count
+        return records
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.handle.close()
+
+class Rollup:
+    """Incremental min/max/avg aggregation of the samples into fixed time buckets"""
+
+    def __init__(self, resolution: int):
+        self.resolution = resolution
+        self.bucket = None
+        self.count = 0
+        self.min: List[float] = []
+        self.max: List[float] = []
+        self.sum: List[float] = []
+
+    def add(self, timestamp: float, values: List[float]) -> Optional[tuple]:
+        """
+        Add a sample to the current bucket.
+
+        Returns:
+            tuple: the completed previous bucket (start, count, values) if the
+                   sample starts a new one, otherwise None
+        """
+        bucket = timestamp - timestamp % self.resolution
+        completed = None
+        if self.bucket is not None and bucket != self.bucket:
+            completed = self.complete()
+        if self.count == 0:
+            self.bucket = bucket
+            self.min, self.max, self.sum = list(values), list(values), list(values)
+            self.count = 1
+        else:
+            for i, value in enumerate(values):
+                if value < self.min[i]:
+                    self.min[i] = value
+                if value > self.max[i]:
+                    self.max[i] = value
+                self.sum[i] += value
+            self.count += 1
+        return completed
+
+    def complete(self) -> tuple:
+        values = []
+        for i in range(len(self.sum)):
+            values += [self.min[i], self.max[i], self.sum[i] / self.count]
+        completed = (self.bucket, self.count, values)
+        self.bucket, self.count = None, 0
+        return completed
+
+class SeriesStore:
+    """Ring files and rollups of one path direction"""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.rings: Dict[str, RingFile] = {}
+        self.rollups: Dict[str, Rollup] = {}
+        for name, resolution, capacity in LEVELS:
+            if resolution == 0:
+                record = struct.Struct('<d' + 'f' * len(FIELDS))
+            else:
+                record = struct.Struct('<dI' + 'f' * len(FIELDS) * 3)
+                self.rollups[name] = Rollup(resolution)
+            self.rings[name] = RingFile(os.path.join(directory, f'{name}.ring'), record, capacity)
+        # The latest raw record: its interval, timestamp, number of samples and their sums
+        self.raw_interval = None
+        self.raw_timestamp = 0.0
+        self.raw_count = 0
+        self.raw_sum: List[float] = []
+
+    def append(self, timestamp: float, values: List[float]):
+        interval = timestamp - timestamp % RAW_INTERVAL
+        if interval == self.raw_interval:
+            # A faster sample, averaged into the record of its interval
+            self.raw_count += 1
+            self.raw_sum = [total + value for total, value in zip(self.raw_sum, values)]
+            self.rings['raw'].replace_last(self.raw_timestamp, *[total / self.raw_count for total in self.raw_sum])
+        else:
+            self.raw_interval, self.raw_timestamp, self.raw_count, self.raw_sum = interval, timestamp, 1, list(values)
+            self.rings['raw'].append(timestamp, *values)
+        for name, rollup in self.rollups.items():
+            completed = rollup.add(timestamp, values)
+            if completed:
+                bucket, count, aggregated = completed
+                self.rings[name].append(bucket, count, *aggregated)
+
+    def select_level(self, start: float, step: float) -> str:
+        """
+        Select the level to read.
+
+        The usable levels hold the range from its start or, when none reaches
+        back to the start, reach back as far as the level reaching the furthest,
+        short of one of its buckets. With a step, the coarsest usable level not
+        coarser than the step is used, otherwise the finest usable level.
+        """
+        oldest = {name: self.rings[name].oldest() for name, _, _ in LEVELS}
+        reached = [(oldest[name], resolution) for name, resolution, _ in LEVELS if oldest[name] is not None]
+        if not reached:
+            return [name for name, resolution, _ in LEVELS if resolution <= step][-1]
+        furthest, resolution = min(reached)
+        limit = max(start, furthest + resolution)
+        usable = [(name, resolution) for name, resolution, _ in LEVELS
+                  if oldest[name] is not None and oldest[name] <= limit]
+        if step:
+            within = [name for name, resolution in usable if resolution <= step]
+            if within:
+                return within[-1]
+        return usable[0][0]
+
+    def query(self, start: float, end: float, step: float = 0, points: int = 0,
+              method: str = DOWNSAMPLE_METHODS[0]) -> Dict:
+        """
+        Query the records between start and end.
+
+        With points, the series are downsampled to at most that many points:
+        with 'minmax', into buckets of (end - start) / points seconds, with
+        'lttb', to the samples of each field kept by Largest-Triangle-Three-Buckets,
+        each field having its own timestamps then.
+        """
+        if method not in DOWNSAMPLE_METHODS:
+            raise ValueError(f'Invalid downsampling method: {method}')
+        # Downsampled from the finest level holding the range, or reaching back as far as
+        # the history recorded when the range starts before it, see select_level()
+        level = self.select_level(start, step)
+        timestamps, counts, columns = self._read_columns(level, start, end)
+
+        resolution = dict((name, resolution) for name, resolution, _ in LEVELS)[level]
+        downsampled = None
+        if step and step > resolution:
+            timestamps, counts, columns = aggregate(timestamps, counts, columns, step)
+        if points and len(timestamps) > points:
+            downsampled = method
+            if method == 'minmax':
+                # Buckets from the start of the range, at most points of them
+                timestamps, counts, columns = aggregate(timestamps, counts, columns, (end - start) / points, start)
+
+        series = {} if downsampled == 'lttb' else {'timestamps': timestamps}
+        for i, field in enumerate(FIELDS):
+            field_columns = columns[i * 3:i * 3 + 3]
+            series[field] = {}
+            if downsampled == 'lttb':
+                # The samples kept by the shape of the average
+                kept = lttb(timestamps, field_columns[2], points)
+                series[field]['timestamps'] = [timestamps[index] for index in kept]
+                field_columns = [[column[index] for index in kept] for column in field_columns]
+            series[field].update(zip(('min', 'max', 'avg'), field_columns))
+        return {'level': level, 'resolution': resolution, 'downsampled': downsampled, 'series': series}
+
+    def _read_columns(self, level: str, start: float, end: float) -> tuple:
+        """The timestamps, the counts and the min, max and avg columns of every field of the records of a level"""
+        records = self.rings[level].read(start, end)
+        if not records:
+            return [], [], [[] for _ in range(len(FIELDS) * 3)]
+        columns = [list(column) for column in zip(*records)]
+        if level == 'raw':
+            # A raw sample is its own min, max and avg
+            return columns[0], [1] * len(records), [column for column in columns[1:] for _ in range(3)]
+        return columns[0], columns[1], columns[2:]
+
+    def flush(self):
+        for ring in self.rings.values():
+            ring.flush()
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+class MetricsStore:
+    """Persistent metrics history of all paths, one SeriesStore per path and direction"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self.series: Dict[tuple, SeriesStore] = {}
+        self.lock = threading.Lock()
+
+    def _get_series(self, path_id: int, direction: str) -> SeriesStore:
+        key = (int(path_id), direction)
+        if key not in self.series:
+            self.series[key] = SeriesStore(os.path.join(self.base_dir, str(int(path_id)), direction))
+        return self.series[key]
+
+    def append(self, path_id: int, direction: str, timestamp: float, values: List[float]):
+        """Append a sample of a path direction"""
+        with self.lock:
+            self._get_series(path_id, direction).append(timestamp, values)
+
+    def append_stats(self, stats: Dict):
+        """Append the samples of all the active paths from the stats computed by TrafficMonitor"""
+        for id, path_stats in stats.items():
+            for direction in ['uplink', 'downlink']:
+                direction_stats = path_stats['trafficStats'].get(direction)
+                if direction_stats:
+                    self.append(int(id), direction, path_stats['timeStamp'], sample_from_stats(direction_stats))
+
+    def query(self, path_id: int, start: float, end: float, step: float = 0,
+              directions: tuple = ('uplink', 'downlink'), points: int = 0,
+              method: str = DOWNSAMPLE_METHODS[0]) -> Dict:
+        """Query the history of a path between start and end (UNIX timestamps), see SeriesStore.query()"""
+        result = {}
+        with self.lock:
+            for direction in directions:
+                if not os.path.isdir(os.path.join(self.base_dir, str(int(path_id)), direction)):
+                    continue
+                result[direction] = self._get_series(path_id, direction).query(start, end, step, points, method)
+        return result
+
+    def flush(self):
+        with self.lock:
+            for series in self.series.values():
+                series.flush()
+
+    def close(self):
+        with self.lock:
+            for series in self.series.values():
+                series.close()
+            self.series.clear()
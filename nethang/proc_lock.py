@@ -13,10 +13,14 @@ The lock is automatically released when the `ProcLock` object is deleted.
 The lock is also automatically released when the `ProcLock` object is used
 in a with statement.
 
+`is_running` tells whether the process of a pid, which may hold such a
+lock or own a path, is still running.
+
 Author: Hang Yin
 Date: 2025-05-19
 """
 
+import os
 import fcntl
 
 class ProcLock:
@@ -41,3 +45,13 @@ class ProcLock:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.release()
+
+def is_running(pid: int) -> bool:
+    """Whether the process of the pid is running, of any user"""
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
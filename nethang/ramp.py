@@ -0,0 +1,99 @@
+"""
+Ramps
+
+This module provides the smooth transitions between timeslots. A timeslot
+with a 'ramp' moves from the settings of the previous timeslot to its own
+ones gradually instead of in a single step:
+
+    timeline:
+      - duration: 30
+        uplink: {rate_limit: 20000}
+      - duration: 30
+        ramp: {duration: 5000, shape: exponential}   # or just 'ramp: 5000' for linear
+        uplink: {rate_limit: 500, delay: 200}
+
+The rate, delay and loss are interpolated, linearly or exponentially, over
+the ramp duration in milliseconds. The other settings take their new values
+at the first step. The timeline runner applies one step per update period
+(ramp_update_rate in config.yaml), as a single batched kernel update of both
+directions.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+from typing import Dict, Iterator, Optional, Tuple
+
+SHAPES = ('linear', 'exponential')
+
+# Interpolated setting -> the type setting turning it off
+RAMP_KEYS = {
+    'rate_limit': 'throttle_type',
+    'delay': 'latency_type',
+    'loss': 'loss_type',
+}
+
+def parse_ramp(ramp) -> Optional[Dict]:
+    """
+    Parse the ramp of a timeslot.
+
+    Args:
+        ramp: duration in milliseconds, or a dict with 'duration' and 'shape'
+
+    Returns:
+        dict: 'duration' in seconds and 'shape', None if there is no ramp
+
+    Raises:
+        ValueError: if the ramp is invalid
+    """
+    if not ramp:
+        return None
+    if isinstance(ramp, (int, float)):
+        ramp = {'duration': ramp}
+    if not isinstance(ramp, dict) or not isinstance(ramp.get('duration'), (int, float)) or ramp['duration'] < 0:
+        raise ValueError(f'Invalid ramp: {ramp}')
+    shape = ramp.get('shape', 'linear')
+    if shape not in SHAPES:
+        raise ValueError(f'Invalid ramp shape: {shape}')
+    if ramp['duration'] == 0:
+        return None
+    return {'duration': ramp['duration'] / 1000, 'shape': shape}
+
+def effective_value(settings: Dict, key: str, max_rate: float) -> float:
+    """Value of an interpolated setting, taking its type setting into account"""
+    enabled = settings.get(RAMP_KEYS[key], 'off') != 'off'
+    if key == 'rate_limit':
+        return float(settings.get('rate_limit') or max_rate) if enabled else float(max_rate)
+    return float(settings.get(key) or 0) if enabled else 0.0
+
+def interpolate(start: Dict, end: Dict, fraction: float, shape: str, max_rate: float) -> Dict:
+    """Settings of a direction at a fraction of the ramp from start to end"""
+    step = dict(end)
+    for key, type_key in RAMP_KEYS.items():
+        first, last = effective_value(start, key, max_rate), effective_value(end, key, max_rate)
+        if first == last:
+            continue
+        if shape == 'exponential' and first > 0 and last > 0:
+            value = first * (last / first) ** fraction
+        else:
+            value = first + (last - first) * fraction
+        step[key] = round(value, 4) if key == 'loss' else int(round(value))
+        if end.get(type_key, 'off') == 'off':
+            # Turned off at the end of the ramp only
+            step[type_key] = start.get(type_key, 'off') if fraction < 1 else 'off'
+    return step
+
+def ramp_fractions(duration: float, update_rate: float) -> Iterator[Tuple[float, float]]:
+    """
+    Iterate over the steps of a ramp.
+
+    Args:
+        duration: ramp duration in seconds
+        update_rate: steps per second
+
+    Returns:
+        iterator: (offset in seconds from the start of the ramp, fraction of the ramp) pairs, ending at (duration, 1.0)
+    """
+    steps = max(1, int(round(duration * update_rate)))
+    for step in range(1, steps + 1):
+        yield duration * step / steps, step / steps
@@ -8,63 +8,101 @@ Date: 2025-05-19
 """
 
 import os
-import netifaces
 import hashlib
-import subprocess
-import tomli
 import yaml
 import sys
 import signal
-from . import app, ID_LOCK_FILE, ADMIN_USERNAME, PATHS_FILE
-from flask import render_template, request, jsonify, redirect, url_for, session, g
+import time
+from . import app, ADMIN_USERNAME
+from flask import render_template, request, jsonify, redirect, url_for, session, g, Response
 from functools import wraps
-from nethang.proc_lock import ProcLock
-from nethang.simu_path import SimuPathManager
-from nethang.id_manager import IDManager
+from nethang.simu_path import SimuPath, SimuPathManager, FilterSettings
 from nethang.extensions import socketio
 from nethang.config_manager import ConfigManager
+from nethang.exporter import CONTENT_TYPE_TEXT, CONTENT_TYPE_OPENMETRICS
+from nethang.control import Control, ControlClient, socket_path
+from nethang.server import Broadcaster
+from nethang.perf import perf
+from nethang.downsample import DOWNSAMPLE_METHODS, MAX_POINTS
 from nethang.version import __version__
 
-app.config['SECRET_KEY'] = os.urandom(24)
-socketio.init_app(app)
-
-ConfigManager().ensure_models()
-
-# Initialize SimuPathManager
-SimuPathManager()
+# Endpoints polled by machines, they skip the privileges check
+LIGHTWEIGHT_ENDPOINTS = ['metrics']
 
 chart_data = {
     'labels': [None for _ in range(100)],
     'data': [None for _ in range(100)]
 }
 
+# The control plane, see control()
+_control = None
+# Sender of the events to the Socket.IO clients, once the server started
+broadcaster = None
+
+def control():
+    """The control plane: a client of the control daemon if one is configured, the paths of this process otherwise"""
+    global _control
+    if _control is None:
+        path = socket_path()
+        _control = ControlClient(path) if path else Control()
+    return _control
+
 def cleanup(sig, frame):
     """Cleanup the application"""
     app.logger.info(f"Received signal {sig}, performing cleanup...")
+    # Let the jobs being applied finish first
+    control().close()
     SimuPathManager().deactivate_all_paths()
     sys.exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, cleanup)  # Handles Ctrl+C
-signal.signal(signal.SIGTERM, cleanup)  # Handles kill/termination
+def init_server():
+    """
+    Initialize what the server needs before serving: the models file, the
+    paths (whose kernel state is reset) and the cleanup on exit.
+
+    It runs only when the server starts, not when the app is created. With a
+    control daemon, which owns the paths, it only relays the daemon events.
+    """
+    global broadcaster
+    broadcaster = Broadcaster(socketio)
+    broadcaster.start()
+
+    if isinstance(control(), ControlClient):
+        control().subscribe(broadcaster.publish)
+        return
+
+    # The events are queued per client, the monitor runs as a task of the server
+    SimuPathManager.event_sink = broadcaster.publish
+    SimuPathManager.start_task = socketio.start_background_task
+
+    ConfigManager().ensure_models()
 
-def check_privileges():
-    """Check if the application has sufficient privileges for tc and iptables"""
-    tc_status = check_tc()
-    iptables_status = check_iptables()
+    # Initialize SimuPathManager
+    SimuPathManager()
 
-    return {
-        'tc_access': tc_status.get('tc_access', False),
-        'iptables_access': iptables_status.get('iptables_access', False),
-        'tc_error': tc_status.get('error', ''),
-        'iptables_error': iptables_status.get('error', '')
-    }
+    # Register signal handlers
+    signal.signal(signal.SIGINT, cleanup)  # Handles Ctrl+C
+    signal.signal(signal.SIGTERM, cleanup)  # Handles kill/termination
+
+@app.before_request
+def start_request_timer():
+    """Start measuring the latency of the request"""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Record the latency of the request per endpoint"""
+    if perf.enabled and 'request_start' in g and request.endpoint:
+        perf.histogram(f'http.{request.endpoint}').record(time.perf_counter() - g.request_start)
+    return response
 
 @app.before_request
 def before_request():
     """Check privileges before each request"""
-    g.privileges = check_privileges()
-    config = SimuPathManager().load_config()
+    if request.endpoint in LIGHTWEIGHT_ENDPOINTS:
+        return
+    g.privileges = control().privileges()
+    config = SimuPathManager.load_config()
     if 'lan_interface' not in config or 'wan_interface' not in config or config['lan_interface'] == '' or config['wan_interface'] == '':
         g.no_interface = True
     else:
@@ -87,6 +125,8 @@ def login_required(f):
     return decorated_function
 
 def get_network_interfaces():
+    import netifaces
+
     interfaces = []
     for iface in netifaces.interfaces():
         addrs = netifaces.ifaddresses(iface)
@@ -95,80 +135,6 @@ def get_network_interfaces():
             interfaces.append({'name': iface, 'ip': ip})
     return interfaces
 
-def check_iptables():
-    try:
-        # First check if iptables command exists
-        which_result = subprocess.run(
-            ['which', 'iptables'],
-            capture_output=True, text=True, check=True)
-
-        if not which_result.stdout.strip():
-            return {
-                'iptables_access': False,
-                'error': 'iptables command not found in system'
-            }
-
-        # Run a harmless iptables command (e.g., list rules)
-        result = subprocess.run(['iptables', '-L', '-n'], capture_output=True, text=True, check=True)
-        return {
-            'iptables_access': True,
-            'output': result.stdout,
-            'message': 'iptables command executed successfully'
-        }
-    except subprocess.CalledProcessError as e:
-        return {
-            'iptables_access': False,
-            'error': f'iptables command failed: {str(e)}'
-        }
-    except PermissionError:
-        return {
-            'iptables_access': False,
-            'error': 'Permission denied: Insufficient privileges for iptables'
-        }
-    except FileNotFoundError:
-        return {
-            'iptables_access': False,
-            'error': 'iptables command not found in system'
-        }
-
-def check_tc():
-    try:
-        # First check if tc command exists
-        which_result = subprocess.run(
-            ['which', 'tc'],
-            capture_output=True, text=True, check=True)
-
-        if not which_result.stdout.strip():
-            return {
-                'tc_access': False,
-                'error': 'tc command not found in system'
-            }
-
-        # Run a harmless tc command
-        result = subprocess.run(
-            ['tc', 'qdisc', 'add', 'dev', 'lo', 'handle', '0', 'netem', 'delay', '0ms'],
-            capture_output=True, text=True, check=True)
-        return {
-            'tc_access': True,
-            'output': result.stdout,
-            'message': 'tc command executed successfully'
-        }
-    except subprocess.CalledProcessError as e:
-        return {
-            'tc_access': True,
-            'error': f'tc command failed: {str(e)}'
-        }
-    except PermissionError:
-        return {
-            'tc_access': False,
-            'error': 'Permission denied: Insufficient privileges for tc'
-        }
-    except FileNotFoundError:
-        return {
-            'tc_access': False,
-            'error': 'tc command not found in system'
-        }
-
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -176,7 +142,7 @@ def login():
         password = request.form.get('password')
 
         # Get admin password from config
-        config = SimuPathManager().load_config()
+        config = SimuPathManager.load_config()
         admin_password = config.get('admin_password', hash_password('admin'))  # Default to hashed 'admin' if not set
 
         if username != ADMIN_USERNAME:
@@ -205,13 +171,13 @@ def index():
     """Render the main dashboard page"""
     try:
         # Load configuration
-        config = SimuPathManager().load_config()
+        config = SimuPathManager.load_config()
 
         # Load paths
-        paths = SimuPathManager().load_paths()
+        paths = control().load_paths()
 
         # Load models
-        models = SimuPathManager().load_models()
+        models = SimuPathManager.load_models()
 
         return render_template('index.html', paths=paths, config=config, models=models)
     except Exception as e:
@@ -224,22 +190,16 @@ def manage_paths():
     # Get paths
     if request.method == 'GET':
         app.logger.info("Getting paths")
-        return jsonify(SimuPathManager().load_paths())
+        return jsonify(control().load_paths())
 
     # Add path
     if request.method == 'POST':
         new_path = request.json
 
-        # Get a new path ID from IDManager
-        id_manager = IDManager(paths_file=PATHS_FILE, id_range=SimuPathManager.mark_range)
-        with ProcLock(ID_LOCK_FILE):
-            path_id = id_manager.acquire_id()
-            if path_id is None:
-                return jsonify({'status': 'error', 'message': 'Failed to acquire path ID'}), 500
-
-            new_path['id'] = path_id
-            new_path['filter_settings']['mark'] = path_id
-            SimuPathManager().add_path(new_path)
+        # The path gets a free mark as its ID
+        path_id = control().add_path(path=new_path)
+        if path_id is None:
+            return jsonify({'status': 'error', 'message': 'Failed to acquire path ID'}), 500
 
         app.logger.info(f"Adding path {new_path}")
         return jsonify({'status': 'success', 'message': 'Path added successfully', 'id': path_id})
@@ -247,20 +207,15 @@ def manage_paths():
     # Update path
     if request.method == 'PUT':
         app.logger.info(f"Updating path {request.json.get('id')}")
-        SimuPathManager().update_path_config(request.json.get('id'), request.json)
+        control().update_path(id=request.json.get('id'), path=request.json)
         return jsonify({'status': 'success', 'message': 'Path updated successfully'})
 
     # Delete path
     if request.method == 'DELETE':
         path_id = request.args.get('id')
         app.logger.info(f"Deleting path {path_id}")
-        # Find the path to be deleted
-        path_to_delete = SimuPathManager().get_path_config(int(path_id))
-
-        if path_to_delete:
-            # Delete the path in system
-            with ProcLock(ID_LOCK_FILE):
-                SimuPathManager().delete_path(int(path_id))
+        # Delete the path in system
+        if control().delete_path(id=int(path_id)):
             return jsonify({'status': 'success', 'message': 'Path deleted successfully'})
         else:
             return jsonify({'status': 'error', 'message': 'Path not found'}), 404
@@ -268,57 +223,258 @@ def manage_paths():
 @app.route('/api/paths/<path_id>/activate', methods=['POST'])
 @login_required
 def activate_path(path_id):
+    """Queue the activation of a path, its job reports the seed of the run, see /api/jobs/<job_id>"""
     app.logger.info(f"Activating path {path_id}")
+    # Optional time compression and number of cycles of the timeline
+    options = request.get_json(silent=True) or {}
     try:
-        SimuPathManager().activate_path(int(path_id))
-        return jsonify({'status': 'success', 'message': 'Path activated successfully'})
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        speed = SimuPath.parse_speed(options.get('speed'))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': f"Invalid speed: {options.get('speed')}"}), 400
+    return submit_job('activate_path', {'id': int(path_id), 'speed': speed, 'cycles': options.get('cycles')})
 
 @app.route('/api/paths/<path_id>/deactivate', methods=['POST'])
 @login_required
 def deactivate_path(path_id):
+    """Queue the deactivation of a path"""
     app.logger.info(f"Deactivating path {path_id}")
+    return submit_job('deactivate_path', {'id': int(path_id)})
+
+@app.route('/api/paths/<path_id>/members', methods=['PUT'])
+@login_required
+def update_path_members(path_id):
+    """Queue the replacement of the LAN/WAN address lists of a path"""
+    app.logger.info(f"Updating members of path {path_id}")
+    data = request.get_json(silent=True) or {}
+    try:
+        for side in ['lan_ip', 'wan_ip']:
+            FilterSettings.check_addresses(data.get(side))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return submit_job('update_path_members', {'id': int(path_id), 'lan_ip': data.get('lan_ip'),
+                                              'wan_ip': data.get('wan_ip')})
+
+def submit_job(operation, params):
+    """Queue an operation, answer with its job id at once"""
     try:
-        SimuPathManager().deactivate_path(int(path_id))
-        return jsonify({'status': 'success', 'message': 'Path deactivated successfully'})
+        job = control().submit_job(operation=operation, params=params)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
+    return jsonify({'status': 'success', 'message': 'Operation queued', 'job': job['id']}), 202
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@login_required
+def manage_jobs():
+    """
+    List the jobs, or queue the operations of the body at once:
+
+        {"operations": [{"operation": "activate_path", "params": {"id": 9528}},
+                        {"operation": "deactivate_path", "params": {"id": 9529}}]}
+
+    The jobs of a same path run in order, the completion of each is sent as
+    the 'job_completed' Socket.IO event.
+    """
+    if request.method == 'GET':
+        return jsonify(control().list_jobs())
+
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list):
+        return jsonify({'status': 'error', 'message': 'Expected a list of operations'}), 400
+    try:
+        jobs = control().submit_jobs(operations=operations)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'message': 'Operations queued', 'jobs': [job['id'] for job in jobs]}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    """Status of a job, with its result or error and its measured duration once completed"""
+    job = control().get_job(id=job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+def parse_metrics_query(args) -> dict:
+    """
+    Parse the parameters of a metrics history query, see path_metrics().
+
+    Raises:
+        ValueError: if a parameter is invalid
+    """
+    end = float(args.get('to', time.time()))
+    window = float(args.get('window', 3600))
+    start = float(args.get('from', end - window))
+    step = float(args.get('step', 0))
+    points = int(args.get('points', 0))
+    method = args.get('method', DOWNSAMPLE_METHODS[0])
+    direction = args.get('direction')
+    if step < 0 or window <= 0 or start > end:
+        raise ValueError('Invalid range or step')
+    if not 0 <= points <= MAX_POINTS:
+        raise ValueError(f'Invalid points: {points}, at most {MAX_POINTS}')
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f'Invalid downsampling method: {method}')
+    if direction not in [None, 'uplink', 'downlink']:
+        raise ValueError(f'Invalid direction: {direction}')
+
+    directions = (direction,) if direction else ('uplink', 'downlink')
+    return {'start': start, 'end': end, 'step': step, 'directions': directions, 'points': points, 'method': method}
+
+@app.route('/api/paths/<path_id>/metrics', methods=['GET'])
+@login_required
+def path_metrics(path_id):
+    """
+    Query the metrics history of a path.
+
+    Query parameters:
+        from: start of the range (UNIX timestamp), default 'window' before 'to'
+        to: end of the range (UNIX timestamp), default now
+        window: duration of the range in seconds without 'from', default 3600
+        step: bucket size in seconds, default the finest resolution available
+        points: downsample the series to at most that many points (up to 5000), default not
+        method: downsampling method, 'minmax' (default) or 'lttb'
+        direction: 'uplink' or 'downlink', default both
+    """
+    try:
+        query = parse_metrics_query(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    metrics = control().query_metrics(id=int(path_id), **query)
+    return jsonify({'status': 'success', 'id': int(path_id), 'from': query['start'], 'to': query['end'], 'metrics': metrics})
+
+@app.route('/api/paths/<path_id>/report', methods=['GET'])
+@login_required
+def path_report(path_id):
+    """
+    Get the per-slot report of the last run of a path.
+
+    Query parameters:
+        format: 'json' (default) or 'csv', one row per slot and direction
+    """
+    report_format = 'csv' if request.args.get('format') == 'csv' else 'json'
+    report = control().path_report(id=int(path_id), format=report_format)
+    if report is None:
+        return jsonify({'status': 'error', 'message': 'No run of the path'}), 404
+    if report_format == 'csv':
+        return Response(report, content_type='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename=path_{int(path_id)}_report.csv'})
+    return jsonify(dict(report, status='success', id=int(path_id)))
+
+@app.route('/api/matrix', methods=['GET', 'POST'])
+@login_required
+def manage_matrices():
+    """List the scenario matrices, or start one from the matrix in the body, see nethang/matrix.py"""
+    if request.method == 'GET':
+        return jsonify(control().list_matrices())
+
+    try:
+        matrix = control().run_matrix(spec=request.get_json(silent=True) or {})
+        return jsonify({'status': 'success', 'message': 'Matrix started', 'id': matrix['id'], 'runs': matrix['runs']})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/api/matrix/<matrix_id>', methods=['GET', 'DELETE'])
+@login_required
+def matrix_report(matrix_id):
+    """Get the report of a scenario matrix, or cancel it"""
+    report = control().matrix_report(id=matrix_id, cancel=request.method == 'DELETE')
+    if report is None:
+        return jsonify({'status': 'error', 'message': 'Matrix not found'}), 404
+    return jsonify({'status': 'success', 'report': report})
+
+@app.route('/metrics')
+def metrics():
+    """Expose the latest traffic statistics to Prometheus"""
+    openmetrics = 'application/openmetrics-text' in request.headers.get('Accept', '')
+    body = control().exposition(openmetrics=openmetrics)
+    return Response(body, content_type=CONTENT_TYPE_OPENMETRICS if openmetrics else CONTENT_TYPE_TEXT)
+
+@app.route('/api/debug/perf', methods=['GET', 'DELETE'])
+@login_required
+def debug_perf():
+    """Get or reset the latency histograms and counters of the instrumented operations"""
+    if request.method == 'DELETE':
+        control().reset_perf()
+        return jsonify({'status': 'success', 'message': 'Performance statistics reset'})
+
+    return jsonify(control().perf_snapshot())
+
+@app.route('/api/debug/kernel', methods=['GET'])
+@login_required
+def debug_kernel():
+    """Get the operations recorded and the state modeled by the fake kernel backend"""
+    backend = control().kernel_backend()
+    if backend != 'fake':
+        return jsonify({'status': 'error', 'message': f'Not available with the {backend} kernel backend'}), 404
+
+    return jsonify(control().kernel_operations(since=int(request.args.get('since', 0)), state=bool(request.args.get('state'))))
 
 @socketio.on('connect')
 def handle_connect():
     """Send initial chart data to new clients."""
     app.logger.info("Sending initial chart data to new clients")
+    if broadcaster is not None:
+        broadcaster.connect(request.sid)
+        broadcaster.send(request.sid, 'update_chart', {
+            'labels': chart_data['labels'],
+            'data': chart_data['data']
+        })
+        return
     socketio.emit('update_chart', {
         'labels': chart_data['labels'],
         'data': chart_data['data']
     })
 
-def emit_config_update():
-    """Emit configuration update event to all connected clients."""
-    app.logger.info("Emitting configuration update event to all connected clients")
-    socketio.emit('config_updated')
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    if broadcaster is not None:
+        broadcaster.disconnect(request.sid)
+
+@socketio.on('metrics_history')
+def handle_metrics_history(data):
+    """
+    Answer the metrics history of a path, e.g. the last 30 minutes in 500 points
+    for a chart: {"id": 9528, "window": 1800, "points": 500}. The other
+    parameters are the ones of path_metrics().
+    """
+    if 'logged_in' not in session:
+        return {'status': 'error', 'message': 'Login required'}
+    try:
+        data = data or {}
+        path_id = int(data['id'])
+        query = parse_metrics_query(data)
+    except (KeyError, TypeError, ValueError) as e:
+        return {'status': 'error', 'message': f'Invalid query: {e}'}
+
+    metrics = control().query_metrics(id=path_id, **query)
+    return {'status': 'success', 'id': path_id, 'from': query['start'], 'to': query['end'], 'metrics': metrics}
 
 @app.route('/config', methods=['GET', 'POST'])
 @login_required
 def config():
     if request.method == 'POST':
-        config_data = SimuPathManager().load_config()
+        config_data = SimuPathManager.load_config()
         config_data.update({
             'lan_interface': request.form.get('lan_interface', ''),
             'wan_interface': request.form.get('wan_interface', ''),
         })
-        app.logger.info(f"Saving configuration: {config_data}")
-        SimuPathManager().save_config(config_data)
-        emit_config_update()  # Emit config update event
+        # A secret key of the sessions is never logged
+        logged = {key: value for key, value in config_data.items() if key != 'secret_key'}
+        app.logger.info(f"Saving configuration: {logged}")
+        # The clients are notified if the configuration changed
+        control().save_config(config=config_data)
         return redirect(url_for('index'))
 
-    current_config = SimuPathManager().load_config()
+    current_config = SimuPathManager.load_config()
     interfaces = get_network_interfaces()
     return render_template('config.html', config=current_config, interfaces=interfaces)
 
 def get_version():
     """Read version from pyproject.toml"""
+    import tomli
+
     try:
         with open("pyproject.toml", "rb") as f:
             pyproject = tomli.load(f)
@@ -351,7 +507,7 @@ def settings_api():
     app.logger.info("Getting settings")
     if request.method == 'GET':
         # Get current settings
-        config = SimuPathManager().load_config()
+        config = SimuPathManager.load_config()
         settings = {
             'lan_interface': config.get('lan_interface', ''),
             'wan_interface': config.get('wan_interface', ''),
@@ -363,7 +519,7 @@ def settings_api():
         data = request.json
 
         # Load current config
-        config = SimuPathManager().load_config()
+        config = SimuPathManager.load_config()
 
         # Update config with new values
         config['lan_interface'] = data.get('lan_interface', '')
@@ -375,7 +531,7 @@ def settings_api():
 
         # Save config to file
         try:
-            SimuPathManager().save_config(config)
+            control().save_config(config=config)
             return jsonify({'status': 'success'})
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)})
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Server
+
+This module provides the production mode of the web server: the Socket.IO
+async mode is selected explicitly, eventlet or gevent when installed, and the
+events are sent to the clients without ever blocking their sender.
+
+Each client has its own queue of events. A single background task sends the
+next event of a client once it acknowledged the previous one, so a slow client
+only delays itself. The chart updates are snapshots, only the latest one is
+kept in a queue. A client which does not acknowledge an event in time, or
+whose queue overflows, is disconnected rather than let the queue grow.
+
+    async_mode: eventlet   # in config.yaml, or NETHANG_ASYNC_MODE, auto by default
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import time
+import threading
+import importlib.util
+from collections import deque
+from functools import partial
+from typing import Deque, Dict, Optional, Tuple
+from . import logger, CONFIG_FILE
+from nethang.perf import perf
+
+# Async modes of Flask-SocketIO supported, by order of preference
+ASYNC_MODES = ('eventlet', 'gevent', 'threading')
+# Seconds a client may take to acknowledge an event before it is disconnected
+ACK_TIMEOUT = 10
+# Events queued for a client, beyond which it is disconnected as too slow
+MAX_PENDING_EVENTS = 64
+# Events of which only the latest matters, replaced in the queue of a client instead of added
+COALESCED_EVENTS = ('update_chart',)
+# Seconds between two checks of the acknowledgment timeouts
+PUMP_INTERVAL = 1
+
+ack_latency = perf.histogram('socketio.ack')
+coalesced_count = perf.counter('socketio.coalesced')
+dropped_clients = perf.counter('socketio.dropped_clients')
+
+def select_async_mode() -> str:
+    """
+    The async mode of the server: NETHANG_ASYNC_MODE, else async_mode of
+    config.yaml, else the first of eventlet and gevent installed, else threading.
+
+    It only reads config.yaml, to be called before the monkey patching.
+
+    Raises:
+        ValueError: if the mode is not supported
+    """
+    mode = os.environ.get('NETHANG_ASYNC_MODE')
+    if not mode and os.path.exists(CONFIG_FILE):
+        import yaml
+        with open(CONFIG_FILE, 'r') as f:
+            mode = (yaml.safe_load(f) or {}).get('async_mode')
+    if mode and mode not in ASYNC_MODES:
+        raise ValueError(f'Invalid async mode: {mode}, one of {", ".join(ASYNC_MODES)}')
+    if not mode:
+        mode = next(mode for mode in ASYNC_MODES if mode == 'threading' or importlib.util.find_spec(mode))
+    return mode
+
+def monkey_patch(mode: str):
+    """Make the blocking calls of the standard library cooperative, for eventlet and gevent"""
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+def serve(app, socketio, host: str, port: int):
+    """Serve the app with the server of its async mode"""
+    if socketio.async_mode == 'threading':
+        logger.warning("Serving with the Werkzeug server, install eventlet or gevent for production")
+    socketio.run(app, host=host, port=port, debug=False, allow_unsafe_werkzeug=True)
+
+class _Client:
+    """Queue of a client, and the time its unacknowledged event was sent"""
+    __slots__ = ('sid', 'pending', 'sent')
+
+    def __init__(self, sid: str):
+        self.sid = sid
+        self.pending: Deque[Tuple[str, Optional[Dict]]] = deque()
+        self.sent: Optional[float] = None
+
+class Broadcaster:
+    """Send the events to the Socket.IO clients, with a queue per client"""
+
+    def __init__(self, socketio, ack_timeout: float = ACK_TIMEOUT, max_pending: int = MAX_PENDING_EVENTS):
+        """
+        Args:
+            socketio: the SocketIO extension, bound to the app
+            ack_timeout: seconds before a client not acknowledging its event is disconnected
+            max_pending: events queued for a client before it is disconnected
+        """
+        self.socketio = socketio
+        self.ack_timeout = ack_timeout
+        self.max_pending = max_pending
+        self.clients: Dict[str, _Client] = {}
+        self.lock = threading.Lock()
+        self.wakeup = None
+        self.task = None
+        self.running = False
+
+    def start(self):
+        """Start sending the events, on a background task of the async mode"""
+        self.wakeup = self.socketio.server.eio.create_event()
+        self.running = True
+        self.task = self.socketio.start_background_task(self._pump)
+
+    def stop(self):
+        self.running = False
+        if self.task:
+            self.wakeup.set()
+            self.task.join()
+            self.task = None
+
+    def connect(self, sid: str):
+        with self.lock:
+            self.clients[sid] = _Client(sid)
+
+    def disconnect(self, sid: str):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def publish(self, event: str, data: Optional[Dict] = None):
+        """Queue an event for every client, without waiting for any"""
+        with self.lock:
+            for client in self.clients.values():
+                self._queue(client, event, data)
+        if self.wakeup:
+            self.wakeup.set()
+
+    def send(self, sid: str, event: str, data: Optional[Dict] = None):
+        """Queue an event for a client"""
+        with self.lock:
+            if sid in self.clients:
+                self._queue(self.clients[sid], event, data)
+        if self.wakeup:
+            self.wakeup.set()
+
+    @staticmethod
+    def _queue(client: _Client, event: str, data: Optional[Dict]):
+        if event in COALESCED_EVENTS:
+            for index, (pending_event, _) in enumerate(client.pending):
+                if pending_event == event:
+                    client.pending[index] = (event, data)
+                    coalesced_count.inc()
+                    return
+        client.pending.append((event, data))
+
+    def _ack(self, sid: str, *args):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client is None or client.sent is None:
+                return
+            ack_latency.record(time.monotonic() - client.sent)
+            client.sent = None
+        self.wakeup.set()
+
+    def _next_events(self) -> Tuple[list, list]:
+        """The next event of each client ready for it, and the clients too slow"""
+        now = time.monotonic()
+        ready, slow = [], []
+        with self.lock:
+            for client in self.clients.values():
+                if len(client.pending) > self.max_pending or (
+                        client.sent is not None and now - client.sent > self.ack_timeout):
+                    slow.append(client.sid)
+                elif client.sent is None and client.pending:
+                    event, data = client.pending.popleft()
+                    client.sent = now
+                    ready.append((client.sid, event, data))
+            for sid in slow:
+                del self.clients[sid]
+        return ready, slow
+
+    def _pump(self):
+        while self.running:
+            self.wakeup.wait(PUMP_INTERVAL)
+            self.wakeup.clear()
+            ready, slow = self._next_events()
+            for sid in slow:
+                logger.warning(f"Disconnecting the Socket.IO client {sid}, too slow to receive the events")
+                dropped_clients.inc()
+                try:
+                    self.socketio.server.disconnect(sid, namespace='/')
+                except Exception as e:
+                    logger.warning(f"Error in disconnecting {sid}: {e}")
+            for sid, event, data in ready:
+                args = () if data is None else (data,)
+                try:
+                    self.socketio.emit(event, *args, to=sid, callback=partial(self._ack, sid))
+                except Exception as e:
+                    logger.warning(f"Error in sending {event} to {sid}: {e}")
+                    self.disconnect(sid)
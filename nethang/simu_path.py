@@ -12,14 +12,36 @@ import re
 import yaml
 import os
 import time
-import json
-from . import app, CONFIG_PATH, CONFIG_FILE, MODELS_FILE, PATHS_FILE, IPT_LOCK_FILE
-from multiprocessing import Process
+import threading
+import signal
+import uuid
+import copy
+import shutil
+import ipaddress
+import tempfile
+import contextlib
+from . import logger, CONFIG_PATH, CONFIG_FILE, MODELS_FILE, PATHS_FILE, IPT_LOCK_FILE, ID_LOCK_FILE, METRICS_PATH
+from itertools import cycle, chain, repeat
+from multiprocessing import Process, Value
 from dataclasses import dataclass
-from typing import Optional, Dict, List
-from nethang.proc_lock import ProcLock
-from nethang.traffic_monitor import TrafficMonitor
-from nethang.extensions import socketio
+from typing import Optional, Dict, List, Iterable, Tuple
+from nethang.proc_lock import ProcLock, is_running
+from nethang.perf import perf
+from nethang.kernel_backend import ShellBackend, create_backend
+from nethang.kernel_writer import KernelWriter
+from nethang import logs
+from nethang.logs import kv, LOG_RATE_LIMIT, LOG_BURST
+from nethang.trace import TraceSource
+from nethang.markov import MarkovModel
+from nethang.ramp import parse_ramp, interpolate, ramp_fractions
+
+# Declared at import, before the timeline processes are forked, to be shared with them
+run_cmd_latency = perf.histogram('kernel.run_cmd')
+run_batch_latency = perf.histogram('kernel.run_batch')
+transition_count = perf.counter('timeline.transitions')
+skipped_count = perf.counter('timeline.skipped_slots')
+ramp_step_latency = perf.histogram('timeline.ramp_step')
+ramp_step_count = perf.counter('timeline.ramp_steps')
 
 @dataclass
 class SimuSettings:
@@ -36,7 +58,7 @@ class SimuSettings:
                         value = self.get_default_value(key)
                         self.restrict_settings[key] = value
             except Exception as e:
-                app.logger.error(f"Error in SimuSettings: {e}")
+                logger.error(f"Error in SimuSettings: {e}")
 
     def get_default_value(self, key):
         if key == 'rate_limit':
@@ -56,7 +78,7 @@ class SimuSettings:
         elif key == 'throttle_type':
             return 'off'
         else:
-            app.logger.info(f"Not implemented key: {key}")
+            logger.info(f"Not implemented key: {key}")
 
     def __eq__(self, other):
         return (
@@ -83,20 +105,132 @@ class FilterSettings:
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    # iptables multiport accepts at most 15 ports (a range counts as two)
+    MULTIPORT_MAX = 15
+
     def __eq__(self, other):
         return self.protocol == other.protocol and self.lan_ip == other.lan_ip and self.lan_port == other.lan_port and self.wan_ip == other.wan_ip and self.wan_port == other.wan_port and self.mark == other.mark
 
+    @staticmethod
+    def _split(value) -> List[str]:
+        """Split a filter value given as a list or a comma separated string"""
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple, set)):
+            items = value
+        else:
+            items = str(value).split(',')
+        return [str(item).strip() for item in items if str(item).strip() != '']
+
+    @staticmethod
+    def check_addresses(value) -> List[str]:
+        """
+        Check the addresses (IPs or CIDRs) of a filter value, they end up in
+        the kernel commands and in the ipset restore files.
+
+        Raises:
+            ValueError: if an item is not an address or a network
+        """
+        addresses = FilterSettings._split(value)
+        for address in addresses:
+            try:
+                ipaddress.ip_network(address, strict=False)
+            except ValueError:
+                raise ValueError(f"Invalid address: {address!r}") from None
+        return addresses
+
+    def get_addresses(self, side: str) -> List[str]:
+        """
+        Get the addresses (IPs or CIDRs) of the LAN or WAN side.
+
+        Args:
+            side: 'lan' or 'wan'
+
+        Returns:
+            list: addresses, empty if the side matches any address
+        """
+        return FilterSettings._split(getattr(self, f'{side}_ip', None))
+
+    def get_ports(self, side: str) -> List[tuple]:
+        """
+        Get the port ranges of the LAN or WAN side.
+
+        Ports can be given as a single port, a range ('1000-2000' or '1000:2000')
+        or a comma separated list of both.
+
+        Args:
+            side: 'lan' or 'wan'
+
+        Returns:
+            list: (first, last) tuples, empty if the side matches any port
+        """
+        ports = []
+        for item in FilterSettings._split(getattr(self, f'{side}_port', None)):
+            if item == 'Any':
+                return []
+            first, _, last = item.replace(':', '-').partition('-')
+            first, last = int(first), int(last) if last else int(first)
+            if first <= 0 or last >= 65536 or first > last:
+                continue
+            ports.append((first, last))
+        return ports
+
+    def get_ipset(self, side: str) -> Optional[str]:
+        """
+        Get the name of the ipset matching the addresses of the LAN or WAN side.
+
+        An externally managed set given by 'lan_ipset'/'wan_ipset' takes
+        precedence. Otherwise a set owned by the path is used as soon as the
+        side has more than one address, so the lookup cost stays constant
+        whatever the size of the list.
+
+        Args:
+            side: 'lan' or 'wan'
+
+        Returns:
+            str: the set name, or None if a plain address match is enough
+        """
+        external = getattr(self, f'{side}_ipset', None)
+        if external:
+            return external
+        if len(self.get_addresses(side)) > 1:
+            return self.owned_ipset(side)
+        return None
+
+    def owned_ipset(self, side: str) -> str:
+        """Name of the ipset owned by the path for the LAN or WAN side"""
+        return f'nethang_{self.mark}_{side}'
+
+    def owns_ipset(self, side: str) -> bool:
+        """Check if the set matching the side is created and managed by the path"""
+        return self.get_ipset(side) == self.owned_ipset(side)
+
 class SimuPath:
     """Represents a network simulation path with filter and simulation settings"""
     def __init__(self, filter_settings: FilterSettings, mode: str, model: str, status: str,
-                 uplink_settings: SimuSettings, downlink_settings: SimuSettings):
+                 uplink_settings: SimuSettings, downlink_settings: SimuSettings,
+                 monitor_interval: Optional[float] = None, trace: Optional[Dict] = None,
+                 seed: Optional[int] = None, model_settings: Optional[Dict] = None):
         self.filter = filter_settings
-        self.mode = mode # 'model', 'custom'
+        self.mode = mode # 'model', 'custom', 'trace'
         self.model = model # models.yaml
+        self.trace = trace # Trace settings of the 'trace' mode, see TraceSource
+        self.seed = seed # Seed of a Markov model, None for the one of the model or a random one
+        self.markov_seed = None # Seed of the running Markov model
+        self.model_settings = model_settings # Settings of the model, None to look it up in models.yaml by name
+        self.speed = 1.0 # Time compression of the running timeline, 2 plays it twice as fast
+        self.cycles = None # Cycles of the running timeline before the path stops, None for endless
         self.status = status # "active" or "inactive"
         self.uplink_settings = uplink_settings
         self.downlink_settings = downlink_settings
+        self.monitor_interval = monitor_interval # Sampling interval wanted by the path, None for the default
         self.simu_proc = None
+        # Source of the kernel commands of the simulation process, see KernelWriter
+        self.writer_source = None
+        # Index of the running timeslot, shared with the simulation process. -1 if none
+        self.slot_index = Value('i', -1, lock=False)
+        # Cycle of the running timeline, shared with the simulation process. -1 if none
+        self.cycle_index = Value('i', -1, lock=False)
         self.__direction = {
             'uplink':{
                 'from':SimuPathManager.lan_ifname,
@@ -118,7 +252,7 @@ class SimuPath:
 
     def _cleanup(self, direction_ : str):
         """Cleanup the path by removing traffic control"""
-        app.logger.info(f"Cleaning up path {self.filter.mark} {direction_}")
+        logger.info(f"Cleaning up path {self.filter.mark} {direction_}")
         if hasattr(self, 'filter'):
             SimuPathManager.run_cmd('tc filter del dev {iface} parent {handle}: handle {host_num} protocol ip pref {prio} fw'.format(
                 iface = self.__direction[direction_]['to'], handle = SimuPathManager.handle_name, host_num = self.filter.mark, prio = SimuPathManager.PRIO ))
@@ -127,13 +261,13 @@ class SimuPath:
             SimuPathManager.run_cmd('tc qdisc del dev {iface} parent {handle}:{host_num} handle {host_num}'.format(
                 iface = self.__direction[direction_]['to'], handle = SimuPathManager.handle_name, host_num = self.filter.mark ))
         else:
-            app.logger.error(f'Cannot delete rules: filter not available')
+            logger.error(f'Cannot delete rules: filter not available')
 
         self.status = "inactive"
 
     def _init_tc(self, direction_ : str):
         """Initialize traffic control for a direction"""
-        app.logger.info(f"Initializing traffic control for {direction_}")
+        logger.info(f"Initializing traffic control for {direction_}")
         # SimuPathManager.run_cmd('tc qdisc add dev {iface} root handle {handle}: stab overhead {overhead} linklayer ethernet htb default 0xffff direct_qlen 1000'.format(
         #     iface = self.__direction[direction_]['to'], handle = SimuPathManager.handle_name, overhead = SimuPathManager.OVERHEAD))
         SimuPathManager.run_cmd('tc qdisc add dev {iface} root handle {handle}: htb default 0xffff direct_qlen 1000'.format(
@@ -141,6 +275,7 @@ class SimuPath:
         SimuPathManager.run_cmd('tc class add dev {iface} parent {handle}: classid {handle}:ffff htb rate {rate}kbit quantum 60000'.format(
             iface = self.__direction[direction_]['to'], handle = SimuPathManager.handle_name, rate = SimuPathManager.MAX_RATE))
 
+    @perf.timed('path.apply_tc')
     def _apply_tc(self, direction_ : str, opt : str = 'add',
             rate_limit : int = 1000000, rate_ceil : int = 1000000,
             rate_burst : int = 0, rate_cburst : int = 0,
@@ -151,8 +286,10 @@ class SimuPath:
             jitter_dist : str = 'normal',
             loss_type : str = 'off',
             latency_type : str = 'off',
-            throttle_type : str = 'off'
+            throttle_type : str = 'off',
+            batch : Optional[List[str]] = None
             ):
+        """Apply the settings of a direction, the tc commands are appended to batch instead of run if given"""
 
         class_str_ = ''
         if throttle_type == 'off':
@@ -216,11 +353,11 @@ class SimuPath:
                 probability_good2bad, probability_bad2good = self.__get_loss_state_param(loss / 100.0, loss_type)
                 netem_str_ += f' loss gemodel {probability_good2bad*100:.6f}% {probability_bad2good*100:.6f}%'
 
-        app.logger.info(f"class_str: {class_str_}")
-        app.logger.info(f"netem_str: {netem_str_}")
-        SimuPathManager.run_cmd('tc class {opt} dev {iface} parent {handle}: classid {handle}:{host_num} htb {class_str} quantum 60000'.format(
+        logger.info(kv('apply_tc', path=self.filter.mark, direction=direction_, opt=opt, htb=class_str_, netem=netem_str_))
+        run_cmd = batch.append if batch is not None else SimuPathManager.run_cmd
+        run_cmd('tc class {opt} dev {iface} parent {handle}: classid {handle}:{host_num} htb {class_str} quantum 60000'.format(
             opt = opt, iface = self.__direction[direction_]['to'], handle = SimuPathManager.handle_name, host_num = self.filter.mark, class_str = class_str_))
-        SimuPathManager.run_cmd('tc qdisc {opt} dev {iface} parent {handle}:{host_num} handle {host_num}: netem {netem_str}'.format(
+        run_cmd('tc qdisc {opt} dev {iface} parent {handle}:{host_num} handle {host_num}: netem {netem_str}'.format(
             opt = opt, iface = self.__direction[direction_]['to'], handle = SimuPathManager.handle_name, host_num = self.filter.mark, netem_str = netem_str_))
         if opt == 'add':
             SimuPathManager.run_cmd('tc filter add dev {iface} parent {handle}: prio {prio} protocol ip handle {host_num} fw flowid {handle}:{host_num}'.format(
@@ -229,7 +366,7 @@ class SimuPath:
     def _run_custom(self):
         """Run custom simulation"""
 
-        app.logger.info(f"Running custom simulation for PATH {self.filter.mark}")
+        logger.info(f"Running custom simulation for PATH {self.filter.mark}")
 
         for direction in ['uplink', 'downlink']:
             self._cleanup(direction)
@@ -237,23 +374,18 @@ class SimuPath:
         if self.uplink_settings.mode != 'bypass':
             self._set_rule('uplink', 'add', self.uplink_settings.to_dict())
         else:
-            app.logger.info(f"Bypassing uplink for PATH {self.filter.mark}")
+            logger.info(f"Bypassing uplink for PATH {self.filter.mark}")
             self._cleanup('uplink')
 
         if self.downlink_settings.mode != 'bypass':
             self._set_rule('downlink', 'add', self.downlink_settings.to_dict())
         else:
-            app.logger.info(f"Bypassing downlink for PATH {self.filter.mark}")
+            logger.info(f"Bypassing downlink for PATH {self.filter.mark}")
             self._cleanup('downlink')
 
     def _run_model(self):
-        app.logger.info(f"Running model simulation for PATH {self.filter.mark}")
-        try:
-            if self.model not in SimuPathManager().models:
-                raise ValueError(f'Case {self.model} not found, please check available models, exit ...')
-            model_ = SimuPathManager().get_model_settings(self.model)
-        except Exception as e:
-            raise e
+        logger.info(f"Running model simulation for PATH {self.filter.mark}")
+        model_ = self._get_model()
 
         # At first cleanup
         for direction in ['uplink', 'downlink']:
@@ -262,36 +394,137 @@ class SimuPath:
         model_global = model_.get('global', {})
         model_timeline = model_.get('timeline', [])
 
-        if not model_timeline:
+        if 'markov' in model_:
+            # Procedural model
+            self._run_timeline(model_global, MarkovModel(model_['markov'], self.markov_seed).timeslots(), cyclic=False)
+        elif not model_timeline:
             # Static model
             for direction in ['uplink', 'downlink']:
                 self._set_rule(direction, 'add', model_global[direction])
+        elif self.cycles:
+            # Dynamic model, stopped after its cycles
+            self._run_timeline(model_global, chain.from_iterable(repeat(list(enumerate(model_timeline)), self.cycles)))
         else:
             # Dynamic model
-            is_first_timeslot : bool = True
-            while True:
-                for model_timeslot in model_timeline:
+            self._run_timeline(model_global, cycle(enumerate(model_timeline)))
 
-                    merged_model = SimuPathManager.merge_dicts(model_global, model_timeslot)
-                    app.logger.info(f"merged_model: {json.dumps(merged_model, indent=2)}")
+    def _get_model(self) -> Dict:
+        """Get the settings of the model of the path"""
+        if self.model_settings is not None:
+            return self.model_settings
+        if self.model not in SimuPathManager().models:
+            raise ValueError(f'Case {self.model} not found, please check available models, exit ...')
+        return SimuPathManager().get_model_settings(self.model)
 
-                    if is_first_timeslot:
-                        opt_ = 'add'
-                        is_first_timeslot = False
-                    else:
-                        opt_ = 'change'
+    def _run_trace(self):
+        logger.info(f"Running trace simulation for PATH {self.filter.mark}")
+        trace_ = TraceSource(self.trace, self.cycles)
+
+        # At first cleanup
+        for direction in ['uplink', 'downlink']:
+            self._cleanup(direction)
+
+        self._run_timeline(trace_.global_settings, enumerate(trace_.timeslots()))
+
+    def _run_timeline(self, model_global: Dict, timeslots: Iterable, cyclic: bool = True):
+        """
+        Apply the timeslots of a timeline one after another.
 
-                    for direction in ['uplink', 'downlink']:
-                        self._set_rule(direction, opt_, merged_model[direction])
+        The timeslots are scheduled on absolute deadlines, so the time spent
+        applying a timeslot does not delay the next ones. A timeslot already
+        over when it is due is skipped, and a direction whose settings did not
+        change is not applied again. The changes of both directions are applied
+        in a single batch, or in steps over the 'ramp' of the timeslot.
 
-                    if 'duration' in model_timeslot:
-                        # Maybe need high precision sleep
-                        time.sleep(model_timeslot['duration'])
+        The durations are divided by the speed of the path, without going
+        below the min_slot_duration of config.yaml.
+
+        Args:
+            model_global: settings the timeslots are merged into
+            timeslots: (index, timeslot) pairs, may be lazy and endless
+            cyclic: whether a timeslot index going back starts a new cycle
+        """
+        applied = {}
+        deadline = time.monotonic()
+        last_index = None
+        self.cycle_index.value = 0
+        for slot_index, model_timeslot in timeslots:
+            if cyclic and last_index is not None and slot_index <= last_index:
+                self.cycle_index.value += 1
+            last_index = slot_index
+            duration = self._scaled_duration(float(model_timeslot.get('duration') or 0))
+            deadline += duration
+            if duration > 0 and deadline <= time.monotonic():
+                # Behind schedule, the next timeslot carries its own full settings
+                skipped_count.inc()
+                continue
+
+            self.slot_index.value = slot_index
+            merged_model = SimuPathManager.merge_dicts(model_global, model_timeslot)
+            logger.debug(kv('merged_model', path=self.filter.mark, slot=slot_index, model=merged_model))
+
+            changed = [direction for direction in ['uplink', 'downlink']
+                       if direction not in applied or applied[direction] != merged_model[direction]]
+            ramp = parse_ramp(model_timeslot.get('ramp'))
+            if ramp and changed and all(direction in applied for direction in changed):
+                ramp['duration'] /= self.speed
+                # Capped by the timeslot, a ramp longer than the timeslot ends with it
+                ramp['duration'] = min(ramp['duration'], duration)
+                self._run_ramp(applied, merged_model, changed, ramp)
+            else:
+                # The latency of the transition is recorded by the writer applying it
+                batch = []
+                for direction in changed:
+                    if direction in applied:
+                        self._set_rule(direction, 'change', merged_model[direction], batch)
+                    else:
+                        self._set_rule(direction, 'add', merged_model[direction])
+                if batch:
+                    SimuPathManager.run_batch(batch)
+            for direction in changed:
+                applied[direction] = merged_model[direction]
+            transition_count.inc()
+
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _scaled_duration(self, duration: float) -> float:
+        """Duration of a timeslot at the speed of the path"""
+        if self.speed == 1 or duration <= 0:
+            return duration
+        # The kernel updates of a timeslot must have the time to be applied
+        return max(duration / self.speed, SimuPathManager.min_slot_duration)
+
+    def _run_ramp(self, applied: Dict, merged_model: Dict, directions: List[str], ramp: Dict):
+        """
+        Move the directions from their applied settings to the ones of the timeslot.
 
-    def _set_rule(self, direction : str, opt : str, config : dict):
+        One step is applied per update period, both directions in a single
+        batch. A step already overtaken by the next one is skipped.
+        """
+        start = time.monotonic()
+        steps = list(ramp_fractions(ramp['duration'], SimuPathManager.ramp_update_rate))
+        for step, (offset, fraction) in enumerate(steps):
+            if step + 1 < len(steps) and start + steps[step + 1][0] <= time.monotonic():
+                continue
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Computing and sending the step, its application is in timeline.transition
+            with ramp_step_latency.time():
+                batch = []
+                for direction in directions:
+                    self._set_rule(direction, 'change', interpolate(applied[direction], merged_model[direction],
+                                   fraction, ramp['shape'], SimuPathManager.MAX_RATE), batch)
+                SimuPathManager.run_batch(batch)
+            ramp_step_count.inc()
+
+    def _set_rule(self, direction : str, opt : str, config : dict, batch : Optional[List[str]] = None):
         """Set traffic control rules using provided parameters"""
 
-        app.logger.info(f"set_rule: {direction} {opt} {config}")
+        logger.info(kv('set_rule', path=self.filter.mark, direction=direction, opt=opt, config=config))
 
         if opt == 'add':
             self._init_tc(direction)
@@ -308,32 +541,78 @@ class SimuPath:
             jitter_dist = config.get('jitter_dist', 'normal'),
             loss_type = config.get('loss_type', 'off'),
             latency_type = config.get('latency_type', 'off'),
-            throttle_type = config.get('throttle_type', 'off')
+            throttle_type = config.get('throttle_type', 'off'),
+            batch = batch
         )
 
     def _simu_path_worker(self):
         """Run tc command for path activation"""
-        app.logger.info(f"Running simulation for PATH {self.filter.mark}")
+        logger.info(f"Running simulation for PATH {self.filter.mark}")
+        # The handlers of the parent (server cleanup, daemon stop) are not for this process: it is
+        # stopped by the parent with SIGTERM, and leaves Ctrl+C of the terminal to the parent
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if SimuPathManager.writer is not None:
+            # The commands are sent to the writer of the parent, which drops them once the path is deactivated
+            SimuPathManager.writer.source = self.writer_source
 
         try:
             if self.mode == 'custom':
                 self._run_custom()
             elif self.mode == 'model':
                 self._run_model()
+            elif self.mode == 'trace':
+                self._run_trace()
             else:
                 raise ValueError(f"Invalid mode: {self.mode}")
 
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"Failed to set up traffic control: {e}")
 
-    def activate(self):
-        """Activate the path by setting up traffic control"""
-        app.logger.info(f"Activating path {self.filter.mark}")
+    @staticmethod
+    def parse_speed(speed) -> float:
+        """
+        The time compression of an activation, 1 when not given.
+
+        Raises:
+            ValueError: if the speed is not a positive number
+        """
+        speed_ = 1.0 if speed is None else float(speed)
+        if not speed_ > 0:
+            raise ValueError(f"Invalid speed: {speed}")
+        return speed_
+
+    def activate(self, speed: float = 1.0, cycles: Optional[int] = None):
+        """
+        Activate the path by setting up traffic control
+
+        Args:
+            speed: time compression of the timeline, 2 plays it twice as fast
+            cycles: cycles of the timeline or trace before the path stops, None for endless
+        """
+        logger.info(f"Activating path {self.filter.mark}")
         try:
+            self.speed = SimuPath.parse_speed(speed)
+            self.cycles = int(cycles) if cycles else None
+            if self.cycles is not None and self.cycles < 0:
+                raise ValueError(f"Invalid cycles: {cycles}")
+            model_ = self._get_model() if self.mode == 'model' else {}
+            if self.cycles and not (self.mode == 'trace' or (model_.get('timeline') and 'markov' not in model_)):
+                raise ValueError("Cycles need a dynamic model or a trace")
+            if self.mode == 'trace':
+                # Check the trace settings before touching the system
+                TraceSource(self.trace)
+            self.markov_seed = None
+            if 'markov' in model_:
+                # Check the model and draw its seed before forking, so the run can be reproduced
+                self.markov_seed = MarkovModel(model_['markov'], self.seed).seed
+                logger.info(f"Markov model {self.model} of PATH {self.filter.mark} seeded with {self.markov_seed}")
+
             # Create the path in system by creating a new iptables rule
             self.create()
 
             # Set up traffic control for both directions
+            self.writer_source = f'{self.filter.mark}-{uuid.uuid4().hex}'
             self.simu_proc = Process(target=self._simu_path_worker, args=(), daemon=True)
             self.simu_proc.start()
             self.status = "active"
@@ -342,94 +621,156 @@ class SimuPath:
 
     def deactivate(self):
         """Deactivate the path by removing traffic control"""
-        app.logger.info(f"Deactivating path {self.filter.mark}")
-        try:
-            if self.simu_proc:
-                self.simu_proc.terminate()
+        logger.info(f"Deactivating path {self.filter.mark}")
+        if self.simu_proc and SimuPathManager.writer is not None:
+            # The timeslot changes still queued are superseded by the teardown
+            SimuPathManager.writer.retire(self.writer_source)
+        with SimuPathManager.kernel_transaction():
+            try:
+                if self.simu_proc:
+                    self.simu_proc.terminate()
+
+                # Delete the path in system by deleting the iptables rule
+                self.delete()
+            finally:
+                for direction in ['uplink', 'downlink']:
+                    self._cleanup(direction)
+                self.status = "inactive"
+                self.slot_index.value = -1
+                self.cycle_index.value = -1
+
+    def _iptables_match(self, direction_ : str) -> str:
+        """Build the iptables match of the path for a direction"""
+        iptables_str_ = ''
+        lan_dir, wan_dir = ('src', 'dst') if direction_ == 'uplink' else ('dst', 'src')
+
+        for side, side_dir in [('lan', lan_dir), ('wan', wan_dir)]:
+            ipset_ = self.filter.get_ipset(side)
+            if ipset_:
+                iptables_str_ += ' -m set --match-set {} {}'.format(ipset_, side_dir)
+            elif self.filter.get_addresses(side):
+                iptables_str_ += ' {} {}'.format('-s' if side_dir == 'src' else '-d', self.filter.get_addresses(side)[0])
+
+        if self.filter.protocol in ['udp', 'tcp']:
+            iptables_str_ += ' -p {}'.format(self.filter.protocol)
+            for side, side_dir in [('lan', lan_dir), ('wan', wan_dir)]:
+                ports_ = self.filter.get_ports(side)
+                if not ports_:
+                    continue
+                if len(ports_) == 1 and ports_[0][0] == ports_[0][1]:
+                    iptables_str_ += ' --{}port {}'.format(side_dir[0], ports_[0][0])
+                elif sum(1 if first == last else 2 for first, last in ports_) <= FilterSettings.MULTIPORT_MAX:
+                    iptables_str_ += ' -m multiport --{}ports {}'.format(side_dir[0], ','.join(
+                        str(first) if first == last else f'{first}:{last}' for first, last in ports_))
+                else:
+                    # Too many ports for multiport, match them with a bitmap set
+                    iptables_str_ += ' -m set --match-set {} {}'.format(self.filter.owned_ipset(f'{side}_port'), side_dir)
+
+        return iptables_str_
+
+    def _port_set_needed(self, side: str) -> bool:
+        ports_ = self.filter.get_ports(side)
+        return self.filter.protocol in ['udp', 'tcp'] and \
+            sum(1 if first == last else 2 for first, last in ports_) > FilterSettings.MULTIPORT_MAX
+
+    def _create_ipsets(self):
+        """Create the ipsets owned by the path and fill them with the filter members"""
+        for side in ['lan', 'wan']:
+            if self.filter.owns_ipset(side):
+                self._restore_ipset(self.filter.owned_ipset(side), 'hash:net', self.filter.get_addresses(side))
+            if self._port_set_needed(side):
+                self._restore_ipset(self.filter.owned_ipset(f'{side}_port'), 'bitmap:port range 1-65535',
+                    [str(first) if first == last else f'{first}-{last}' for first, last in self.filter.get_ports(side)])
+
+    def _destroy_ipsets(self):
+        """Destroy the ipsets owned by the path, if any"""
+        for side in ['lan', 'wan']:
+            if self.filter.owns_ipset(side):
+                SimuPathManager.run_cmd('ipset destroy {}'.format(self.filter.owned_ipset(side)))
+            if self._port_set_needed(side):
+                SimuPathManager.run_cmd('ipset destroy {}'.format(self.filter.owned_ipset(f'{side}_port')))
+
+    def _restore_ipset(self, name: str, set_type: str, members: List[str]):
+        """
+        Atomically replace the members of an ipset.
 
-            # Delete the path in system by deleting the iptables rule
-            self.delete()
+        The members are loaded into a temporary set with a single 'ipset restore'
+        and swapped in, so the iptables rules referencing the set never see a
+        partially filled set and do not need to be touched.
+        """
+        if set_type == 'hash:net':
+            # The ports of a bitmap:port set are parsed as integers already
+            FilterSettings.check_addresses(members)
+        tmp_name_ = f'{name}_tmp'
+        restore_ = [f'create {name} {set_type} -exist', f'create {tmp_name_} {set_type} -exist', f'flush {tmp_name_}']
+        restore_ += [f'add {tmp_name_} {member} -exist' for member in members]
+        restore_ += [f'swap {tmp_name_} {name}', f'destroy {tmp_name_}']
+
+        restore_file_ = os.path.join(CONFIG_PATH, f'{tmp_name_}.ipset')
+        with open(restore_file_, 'w') as f:
+            f.write('\n'.join(restore_) + '\n')
+        try:
+            SimuPathManager.run_cmd('ipset restore -exist < {}'.format(restore_file_))
         finally:
-            for direction in ['uplink', 'downlink']:
-                self._cleanup(direction)
-            self.status = "inactive"
+            os.remove(restore_file_)
 
-    def create(self):
-        """ Create the path in system by creating a new iptables rule """
+    def update_members(self, lan_ip = None, wan_ip = None):
+        """
+        Update the addresses matched by the path in bulk.
 
-        def create_iptables_rule(direction_ : str):
-            iptables_str_ = ''
+        When both the current and the new addresses of a side are held in a set
+        owned by the path, the set is swapped in place. Otherwise the mark rules
+        are re-created. The shaping tree is never touched.
+        """
+        members_ = {'lan': lan_ip, 'wan': wan_ip}
+        for members in members_.values():
+            FilterSettings.check_addresses(members)
+        recreate_ = False
+        for side, members in members_.items():
+            if members is None:
+                continue
+            owned_before_ = self.filter.owns_ipset(side)
+            if not owned_before_ or len(FilterSettings._split(members)) <= 1:
+                recreate_ = True
+                break
 
-            if self.filter.lan_ip:
-                if direction_ == 'uplink':
-                    iptables_str_ += ' -s {}'.format(self.filter.lan_ip)
-                else:
-                    iptables_str_ += ' -d {}'.format(self.filter.lan_ip)
+        if self.is_active() and recreate_:
+            self.delete()
 
-            if self.filter.wan_ip:
-                if direction_ == 'uplink':
-                    iptables_str_ += ' -d {}'.format(self.filter.wan_ip)
-                else:
-                    iptables_str_ += ' -s {}'.format(self.filter.wan_ip)
+        for side, members in members_.items():
+            if members is not None:
+                setattr(self.filter, f'{side}_ip', members)
 
-            if self.filter.protocol in ['udp', 'tcp']:
-                iptables_str_ += ' -p {}'.format(self.filter.protocol)
-                if self.filter.lan_port and self.filter.lan_port != 'Any' and int(self.filter.lan_port) > 0 and int(self.filter.lan_port) < 65536:
-                    if direction_ == 'uplink':
-                        iptables_str_ += ' --sport {}'.format(self.filter.lan_port)
-                    else:
-                        iptables_str_ += ' --dport {}'.format(self.filter.lan_port)
+        if self.is_active():
+            if recreate_:
+                self.create()
+            else:
+                for side, members in members_.items():
+                    if members is not None:
+                        self._restore_ipset(self.filter.owned_ipset(side), 'hash:net', self.filter.get_addresses(side))
 
-                if self.filter.wan_port and self.filter.wan_port != 'Any' and int(self.filter.wan_port) > 0 and int(self.filter.wan_port) < 65536:
-                    if direction_ == 'uplink':
-                        iptables_str_ += ' --dport {}'.format(self.filter.wan_port)
-                    else:
-                        iptables_str_ += ' --sport {}'.format(self.filter.wan_port)
+    def create(self):
+        """ Create the path in system by creating a new iptables rule """
 
-            with ProcLock(IPT_LOCK_FILE):
+        def create_iptables_rule(direction_ : str):
+            with SimuPathManager.iptables_lock():
                 SimuPathManager.run_cmd('iptables -t mangle -A FORWARD -i {form_iface} -o {to_iface} {iptables_str} -j MARK --set-mark {host_num} > /dev/null 2>&1'.format(
-                    form_iface = self.__direction[direction_]['from'], to_iface = self.__direction[direction_]['to'], iptables_str=iptables_str_, host_num = self.filter.mark))
+                    form_iface = self.__direction[direction_]['from'], to_iface = self.__direction[direction_]['to'], iptables_str=self._iptables_match(direction_), host_num = self.filter.mark))
 
+        self._create_ipsets()
         create_iptables_rule('uplink')
         create_iptables_rule('downlink')
 
     def delete(self):
         """Delete the path in system by deleting the iptables rule"""
         def delete_iptables_rule(direction_ : str):
-            iptables_str_ = ''
-
-            if self.filter.lan_ip:
-                if direction_ == 'uplink':
-                    iptables_str_ += ' -s {}'.format(self.filter.lan_ip)
-                else:
-                    iptables_str_ += ' -d {}'.format(self.filter.lan_ip)
-
-            if self.filter.wan_ip:
-                if direction_ == 'uplink':
-                    iptables_str_ += ' -d {}'.format(self.filter.wan_ip)
-                else:
-                    iptables_str_ += ' -s {}'.format(self.filter.wan_ip)
-
-            if self.filter.protocol in ['udp', 'tcp']:
-                iptables_str_ += ' -p {}'.format(self.filter.protocol)
-                if self.filter.lan_port and self.filter.lan_port != 'Any' and int(self.filter.lan_port) > 0 and int(self.filter.lan_port) < 65536:
-                    if direction_ == 'uplink':
-                        iptables_str_ += ' --sport {}'.format(self.filter.lan_port)
-                    else:
-                        iptables_str_ += ' --dport {}'.format(self.filter.lan_port)
-
-                if self.filter.wan_port and self.filter.wan_port != 'Any' and int(self.filter.wan_port) > 0 and int(self.filter.wan_port) < 65536:
-                    if direction_ == 'uplink':
-                        iptables_str_ += ' --dport {}'.format(self.filter.wan_port)
-                    else:
-                        iptables_str_ += ' --sport {}'.format(self.filter.wan_port)
-
-            with ProcLock(IPT_LOCK_FILE):
+            with SimuPathManager.iptables_lock():
                 SimuPathManager.run_cmd('iptables -t mangle -D FORWARD -i {form_iface} -o {to_iface} {iptables_str} -j MARK --set-mark {host_num} > /dev/null 2>&1'.format(
-                    form_iface = self.__direction[direction_]['from'], to_iface = self.__direction[direction_]['to'], iptables_str=iptables_str_, host_num = self.filter.mark))
+                    form_iface = self.__direction[direction_]['from'], to_iface = self.__direction[direction_]['to'], iptables_str=self._iptables_match(direction_), host_num = self.filter.mark))
 
         delete_iptables_rule('uplink')
         delete_iptables_rule('downlink')
+        self._destroy_ipsets()
 
     def __del__(self):
         """Delete the path by removing traffic control"""
@@ -507,9 +848,78 @@ class SimuPath:
             model=data['simu_settings']['model'],
             status=data['status'],
             uplink_settings=SimuSettings(**data['simu_settings']['uplink']),
-            downlink_settings=SimuSettings(**data['simu_settings']['downlink'])
+            downlink_settings=SimuSettings(**data['simu_settings']['downlink']),
+            monitor_interval=data['simu_settings'].get('monitor_interval'),
+            trace=data['simu_settings'].get('trace'),
+            seed=data['simu_settings'].get('seed')
         )
 
+# Parsed YAML files by file name, with the content they were parsed from
+_yaml_cache: Dict[str, Tuple[bytes, object]] = {}
+
+def load_yaml(file: str):
+    """
+    Parse a YAML file once per content of the file.
+
+    The caller gets its own copy of the content, which it may modify.
+    """
+    # Compared by content, a rewrite by another process may keep the size, the
+    # modification time and even the inode of the file
+    with open(file, 'rb') as f:
+        content = f.read()
+    cached = _yaml_cache.get(file)
+    if cached is None or cached[0] != content:
+        cached = (content, yaml.safe_load(content))
+        _yaml_cache[file] = cached
+    return copy.deepcopy(cached[1])
+
+def dump_yaml(data, file: str):
+    """
+    Write a YAML file, and keep its content for the next load_yaml.
+
+    The file is replaced at once, a concurrent load_yaml reads either the
+    former content or the new one, never a partial file.
+    """
+    content = yaml.dump(data).encode()
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file)), prefix='.' + os.path.basename(file))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        # The mode of the file replaced, the temporary file is only readable by its owner
+        if os.path.exists(file):
+            shutil.copymode(file, temp_file)
+        else:
+            os.chmod(temp_file, 0o644)
+        os.replace(temp_file, file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_file)
+        raise
+    _yaml_cache[file] = (content, copy.deepcopy(data))
+
+def diff_paths(old: List[Dict], new: List[Dict]) -> List[Tuple[str, Dict]]:
+    """
+    The events turning a list of paths into another one:
+
+        path_added           {path}
+        path_removed         {'id': id}
+        path_status_changed  {'id': id, 'status': status}, when only the status changed
+        path_updated         {path}
+    """
+    old_paths = {int(path['id']): path for path in old if 'id' in path}
+    new_paths = {int(path['id']): path for path in new if 'id' in path}
+    events = [('path_removed', {'id': id}) for id in old_paths if id not in new_paths]
+    for id, path in new_paths.items():
+        before = old_paths.get(id)
+        if before is None:
+            events.append(('path_added', path))
+        elif before != path:
+            if dict(before, status=path.get('status')) == path:
+                events.append(('path_status_changed', {'id': id, 'status': path.get('status')}))
+            else:
+                events.append(('path_updated', path))
+    return events
+
 class SimuPathManager:
     """Manages network simulation paths"""
     _instance = None
@@ -521,6 +931,25 @@ class SimuPathManager:
     lan_ifname = None
     wan_ifname = None
     mark_range = (9528, 9560)
+    backend = ShellBackend()
+    # Single writer of the kernel commands, once the manager is initialized, see nethang/kernel_writer.py
+    writer = None
+    # Steps per second of the ramps between timeslots
+    ramp_update_rate = 10.0
+    # Lowest duration in seconds of a time compressed timeslot
+    min_slot_duration = 0.1
+    # Receiver of the events instead of Socket.IO, set by the control daemon or the server
+    event_sink = None
+    # Starts the monitor loop as a background task of the server, a thread by default
+    start_task = None
+
+    # Defaults of the monitor settings in config.yaml
+    MONITOR_DEFAULTS = {
+        'monitor_interval': 1,              # Sampling interval in seconds
+        'monitor_transition_interval': 0.1, # Sampling interval around timeslot transitions
+        'monitor_transition_window': 2,     # Seconds of fast sampling after a transition
+        'monitor_cpu_budget': 0.25,         # Fraction of a CPU the sampling may use
+    }
 
     def __new__(cls):
         if cls._instance is None:
@@ -532,61 +961,147 @@ class SimuPathManager:
         if self._initialized:
             return
 
-        self.load_config()
+        SimuPathManager.configure(self.load_config())
+        SimuPathManager.writer = KernelWriter(SimuPathManager.backend, IPT_LOCK_FILE)
 
         self.paths: Dict[int, SimuPath] = {}
+        # Held while paths.yaml is read, modified and saved, and the monitor started or stopped:
+        # the jobs of different paths run concurrently, only their kernel work in parallel
+        self.lock = threading.RLock()
+        # The lock of paths.yaml against the other processes, see paths_lock
+        self.paths_file_lock = None
+        self.paths_lock_depth = 0
         self.refresh_paths()
         self.reset_all_paths()
 
         self.models = self.load_models()['models']
+        # The monitoring is only needed by the server, not by the command line
+        from nethang.traffic_monitor import TrafficMonitor
+        from nethang.metrics_store import MetricsStore
+
+        self.metrics_store = MetricsStore(METRICS_PATH)
+        self.monitor_settings = self.get_monitor_settings()
+        perf.enabled = bool(self.load_config().get('perf_instrumentation', True))
+        self.last_slots: Dict[int, int] = {}
+        self.last_transition = None
+        self.matrices: Dict[str, 'MatrixRunner'] = {}
+        self.slot_reports: Dict[int, 'SlotReport'] = {}
         self.traffic_monitor = TrafficMonitor(
-            interval=1, # Seems it is not necessary to make it configurable
+            interval=self.monitor_settings['monitor_interval'],
             lan_iface=SimuPathManager.lan_ifname,
             wan_iface=SimuPathManager.wan_ifname,
             id_range=SimuPathManager.mark_range,
-            stats_callback=SimuPathManager.emit_chart_data
+            stats_callback=SimuPathManager.emit_chart_data,
+            metrics_store=self.metrics_store,
+            cpu_budget=self.monitor_settings['monitor_cpu_budget'],
+            interval_callback=self.get_monitor_interval,
+            sample_callback=self.record_slot_samples,
+            backend=SimuPathManager.backend,
+            start_task=SimuPathManager.start_task
         )
 
         self._initialized = True
 
+    @staticmethod
+    def configure(config: Dict):
+        """Set the settings of config.yaml shared by all the paths"""
+        SimuPathManager.backend = create_backend(config.get('kernel_backend', 'shell'))
+        SimuPathManager.ramp_update_rate = float(config.get('ramp_update_rate', SimuPathManager.ramp_update_rate))
+        SimuPathManager.min_slot_duration = float(config.get('min_slot_duration', SimuPathManager.min_slot_duration))
+        # The pipeline is set up by the entry points, see nethang.init_logging()
+        if logs.pipeline is not None:
+            logs.pipeline.rate_limit.configure(float(config.get('log_rate_limit', LOG_RATE_LIMIT)),
+                                               int(config.get('log_burst', LOG_BURST)))
+        if config.get('max_paths'):
+            SimuPathManager.mark_range = (SimuPathManager.mark_range[0], SimuPathManager.mark_range[0] + int(config['max_paths']))
+
+    def get_monitor_settings(self) -> Dict:
+        """Get the monitor settings from config.yaml, with defaults for the missing ones"""
+        config = self.load_config()
+        settings = dict(SimuPathManager.MONITOR_DEFAULTS)
+        for key in settings:
+            if config.get(key) not in [None, '']:
+                settings[key] = float(config[key])
+        return settings
+
+    def get_monitor_interval(self) -> float:
+        """
+        Get the sampling interval wanted for the next monitor sample.
+
+        The shortest of the configured interval and of the intervals wanted by
+        the active paths, or the transition interval for a while after any
+        active path moved to a new timeslot.
+        """
+        now = time.monotonic()
+        interval = self.monitor_settings['monitor_interval']
+        for id, path in list(self.paths.items()):
+            if not path.is_active():
+                continue
+            if path.monitor_interval:
+                interval = min(interval, float(path.monitor_interval))
+            slot_index = path.slot_index.value
+            if self.last_slots.get(id, slot_index) != slot_index:
+                self.last_transition = now
+            self.last_slots[id] = slot_index
+
+        if self.last_transition is not None and now - self.last_transition < self.monitor_settings['monitor_transition_window']:
+            interval = min(interval, self.monitor_settings['monitor_transition_interval'])
+        return interval
+
+    def record_slot_samples(self, stats: Dict):
+        """Attribute the samples of the timeline paths to their running (cycle, slot)"""
+        for id, path_stats in stats.items():
+            path = self.paths.get(int(id))
+            report = self.slot_reports.get(int(id))
+            if path is None or report is None or not path.is_active() or path.slot_index.value < 0:
+                continue
+            report.add_sample(path.cycle_index.value, path.slot_index.value, path_stats['timeStamp'], path_stats['trafficStats'])
+
     def refresh_paths(self):
-        """Refresh paths by loading from paths.yaml"""
+        """Refresh paths by loading from paths.yaml, but the ones of a running command line"""
         self.paths.clear()
         for path in self.load_paths():
+            if SimuPathManager.applied_by_cli(path):
+                continue
             self.paths[path['id']] = SimuPath.from_dict(path)
 
-    def load_models(self):
+    @staticmethod
+    def applied_by_cli(path: Dict) -> bool:
+        """Whether a path of paths.yaml is applied by a running 'nethang apply', which owns it"""
+        return bool(path.get('cli')) and is_running(int(path['cli']['pid']))
+
+    @staticmethod
+    def load_models():
         try:
             if os.path.exists(MODELS_FILE):
-                with open(MODELS_FILE, 'r') as f:
-                    models = yaml.safe_load(f)
-                    if 'models' in models:
-                        return models
-                    else:
-                        return {'models': {}}
+                models = load_yaml(MODELS_FILE)
+                if 'models' in models:
+                    return models
+                else:
+                    return {'models': {}}
             else:
                 return {'models': {}}
         except Exception as e:
-            app.logger.error(f"Error loading models: {e}")
+            logger.error(f"Error loading models: {e}")
             return {'models': {}}
 
-    def load_config(self):
+    @staticmethod
+    def load_config():
         """Load configuration from config.yaml"""
         if os.path.exists(CONFIG_FILE):
-            config = {}
-            with open(CONFIG_FILE, 'r') as f:
-                config = yaml.safe_load(f)
-                if config:
-                    SimuPathManager.lan_ifname = config.get('lan_interface', '') if 'lan_interface' in config else ''
-                    SimuPathManager.wan_ifname = config.get('wan_interface', '') if 'wan_interface' in config else ''
-                    return config
-                else:
-                    SimuPathManager.lan_ifname = ''
-                    SimuPathManager.wan_ifname = ''
-                    return {
-                        'lan_interface': '',
-                        'wan_interface': '',
-                    }
+            # Parsed again only when the file changed, it is loaded by every request
+            config = load_yaml(CONFIG_FILE)
+            if config:
+                SimuPathManager.lan_ifname = config.get('lan_interface', '') if 'lan_interface' in config else ''
+                SimuPathManager.wan_ifname = config.get('wan_interface', '') if 'wan_interface' in config else ''
+                return config
+            else:
+                SimuPathManager.lan_ifname = ''
+                SimuPathManager.wan_ifname = ''
+                return {
+                    'lan_interface': '',
+                    'wan_interface': '',
+                }
         else:
             SimuPathManager.lan_ifname = ''
             SimuPathManager.wan_ifname = ''
@@ -596,23 +1111,23 @@ class SimuPathManager:
             }
 
     def save_config(self, config):
-        """Save configuration to config.yaml"""
+        """Save configuration to config.yaml, the clients are notified only if it changed"""
+        if os.path.exists(CONFIG_FILE) and load_yaml(CONFIG_FILE) == config:
+            return
         os.makedirs(CONFIG_PATH, exist_ok=True)
-        with open(CONFIG_FILE, 'w') as f:
-            yaml.dump(config, f)
+        dump_yaml(config, CONFIG_FILE)
         self.emit_config_update()  # Emit config update event
 
     def load_paths(self) -> List:
         """Load paths from paths.yaml"""
         if os.path.exists(PATHS_FILE):
             try:
-                with open(PATHS_FILE, 'r') as f:
-                    paths_data = yaml.safe_load(f)
-                    if paths_data is None:
-                        paths_data = []
-                    return paths_data
+                paths_data = load_yaml(PATHS_FILE)
+                if paths_data is None:
+                    paths_data = []
+                return paths_data
             except yaml.YAMLError as e:
-                app.logger.error(f"Error parsing paths.yaml: {e}")
+                logger.error(f"Error parsing paths.yaml: {e}")
                 # If the file is corrupted, create a new one with empty paths
                 paths = []
                 self.save_paths(paths)
@@ -620,17 +1135,42 @@ class SimuPathManager:
         return []
 
     def save_paths(self, paths):
-        """Save paths to paths.yaml"""
+        """Save paths to paths.yaml, the clients get the changes as events, see diff_paths"""
+        try:
+            previous = self.load_paths() if os.path.exists(PATHS_FILE) else []
+        except Exception:
+            previous = []
         os.makedirs(CONFIG_PATH, exist_ok=True)
-        with open(PATHS_FILE, 'w') as f:
-            yaml.dump(paths, f)
-        self.emit_config_update()  # Emit config update event
+        dump_yaml(paths, PATHS_FILE)
+        for event, data in diff_paths(previous, paths):
+            SimuPathManager.emit(event, data)
 
     def deactivate_all_paths(self):
         """Deactivate all paths"""
         for path in self.paths.values():
             path.deactivate()
 
+    @contextlib.contextmanager
+    def paths_lock(self):
+        """
+        Hold the lock of paths.yaml, reentrant in a thread.
+
+        The in-process lock is taken first, then the lock file the command
+        line takes too (see nethang/cli.py), by the outermost holder only.
+        """
+        with self.lock:
+            if self.paths_lock_depth == 0:
+                self.paths_file_lock = ProcLock(ID_LOCK_FILE)
+                self.paths_file_lock.acquire()
+            self.paths_lock_depth += 1
+            try:
+                yield
+            finally:
+                self.paths_lock_depth -= 1
+                if self.paths_lock_depth == 0:
+                    self.paths_file_lock.release()
+                    self.paths_file_lock = None
+
     def reset_all_paths(self):
         """Reset all paths according to the config"""
 
@@ -638,34 +1178,53 @@ class SimuPathManager:
         self.deactivate_all_paths()
 
         # Update paths.yaml
-        paths_data = self.load_paths()
-        for p in paths_data:
-            p['status'] = 'inactive'
+        with self.paths_lock():
+            paths_data = self.load_paths()
+            for p in paths_data:
+                # The command line tears its paths down itself
+                if not SimuPathManager.applied_by_cli(p):
+                    p['status'] = 'inactive'
 
-        self.save_paths(paths_data)
+            self.save_paths(paths_data)
 
     def add_to_path_config(self, path: SimuPath):
         """Add a path to paths.yaml"""
-        paths_data = self.load_paths()
-        paths_data.append(path)
-        self.save_paths(paths_data)
+        with self.paths_lock():
+            paths_data = self.load_paths()
+            paths_data.append(path)
+            self.save_paths(paths_data)
 
     def update_path_config(self, id: int, path):
         """Update a path in paths.yaml"""
-        paths_data = self.load_paths()
-        for i, p in enumerate(paths_data):
-            if int(p['id']) == id:
-                paths_data[i] = path
-                break
-        self.save_paths(paths_data)
-        self.refresh_paths()
+        with self.paths_lock():
+            paths_data = self.load_paths()
+            for i, p in enumerate(paths_data):
+                if int(p['id']) == id:
+                    paths_data[i] = path
+                    break
+            self.save_paths(paths_data)
+            self.refresh_paths()
 
     def delete_from_path_config(self, id: int):
         """Delete a path from paths.yaml"""
+        with self.paths_lock():
+            paths_data = self.load_paths()
+            for p in paths_data:
+                if int(p['id']) == id:
+                    paths_data.remove(p)
+                    break
+            self.save_paths(paths_data)
+
+    def _set_path_config(self, id: int, **settings):
+        """Set settings of a path in paths.yaml, paths_lock held"""
         paths_data = self.load_paths()
         for p in paths_data:
             if int(p['id']) == id:
-                paths_data.remove(p)
+                for key, value in settings.items():
+                    if key in ('lan_ip', 'wan_ip'):
+                        p['filter_settings'][key] = value
+                    else:
+                        p[key] = value
                 break
         self.save_paths(paths_data)
 
@@ -679,33 +1238,63 @@ class SimuPathManager:
 
     def add_path(self, path):
         """Add a path in system by creating a new iptables rule and save it to paths.yaml"""
-        self.paths[path['id']] = SimuPath.from_dict(path)
-        self.add_to_path_config(path)
+        with self.paths_lock():
+            self.paths[path['id']] = SimuPath.from_dict(path)
+            self.add_to_path_config(path)
 
     def delete_path(self, id: int):
         """Delete a path in system by deleting the iptables rule and save it to paths.yaml"""
         if id not in self.paths:
             raise ValueError(f"Path with id {id} not found")
 
-        del self.paths[id]
-        self.delete_from_path_config(id)
+        with self.paths_lock():
+            del self.paths[id]
+            self.delete_from_path_config(id)
 
-    def activate_path(self, id: int):
-        """Activate a path by id"""
+    def update_path_members(self, id: int, lan_ip = None, wan_ip = None):
+        """Update the LAN/WAN addresses of a path in bulk without touching its shaping tree"""
         if id not in self.paths:
             raise ValueError(f"Path with id {id} not found")
 
-        self.paths[id].activate()
+        self.paths[id].update_members(lan_ip=lan_ip, wan_ip=wan_ip)
 
         # Update paths.yaml
-        paths_data = self.load_paths()
-        for p in paths_data:
-            if int(p['id']) == id:
-                p['status'] = 'active'
-                break
-        self.save_paths(paths_data)
-        self.traffic_monitor.start()
+        members = {key: value for key, value in (('lan_ip', lan_ip), ('wan_ip', wan_ip)) if value is not None}
+        with self.paths_lock():
+            self._set_path_config(id, **members)
 
+    @perf.timed('path.activate')
+    def activate_path(self, id: int, speed: float = 1.0, cycles: Optional[int] = None):
+        """Activate a path by id, see SimuPath.activate for the speed and cycles"""
+        if id not in self.paths:
+            raise ValueError(f"Path with id {id} not found")
+
+        self.paths[id].activate(speed, cycles)
+        # A new run, with a new report
+        from nethang.slot_report import SlotReport
+        self.slot_reports[id] = SlotReport()
+        if self.paths[id].cycles:
+            threading.Thread(target=self._stop_after_cycles, args=(id, self.paths[id].simu_proc), daemon=True).start()
+
+        # Update paths.yaml
+        with self.paths_lock():
+            self._set_path_config(id, status='active')
+            self.traffic_monitor.start()
+
+    def _stop_after_cycles(self, id: int, simu_proc: Process):
+        """Deactivate a path once its simulation process ran all its cycles"""
+        simu_proc.join()
+        path = self.paths.get(id)
+        # Not if the path was deactivated, or activated again, in the meantime
+        if path is None or path.simu_proc is not simu_proc or not path.is_active() or simu_proc.exitcode != 0:
+            return
+        logger.info(f"Path {id} ran its {path.cycles} cycles, stopping")
+        try:
+            self.deactivate_path(id)
+        except Exception as e:
+            logger.error(f"Error in stopping path {id}: {e}")
+
+    @perf.timed('path.deactivate')
     def deactivate_path(self, id: int):
         """Deactivate a path by id"""
         if id not in self.paths:
@@ -714,15 +1303,21 @@ class SimuPathManager:
         self.paths[id].deactivate()
 
         # Update paths.yaml
-        paths_data = self.load_paths()
-        for p in paths_data:
-            if int(p['id']) == id:
-                p['status'] = 'inactive'
-                break
-        self.save_paths(paths_data)
-
-        if len(self.get_active_paths()) == 0:
-            self.traffic_monitor.stop()
+        with self.paths_lock():
+            self._set_path_config(id, status='inactive')
+
+            if len(self.get_active_paths()) == 0:
+                self.traffic_monitor.stop()
+
+    def run_matrix(self, spec: Dict) -> 'MatrixRunner':
+        """Start running a scenario matrix, see MatrixRunner"""
+        from nethang.matrix import MatrixRunner, prune_matrices
+        matrix = MatrixRunner(self, spec)
+        prune_matrices(self.matrices)
+        self.matrices[matrix.id] = matrix
+        logger.info(f"Running matrix {matrix.id} of {len(matrix.runs)} runs")
+        matrix.start()
+        return matrix
 
     def get_active_paths(self) -> List[SimuPath]:
         """Get all active paths"""
@@ -740,10 +1335,23 @@ class SimuPathManager:
         """Get settings for a specific model"""
         return self.models.get(model_name)
 
+    @staticmethod
+    def emit(event: str, data: Optional[Dict] = None):
+        """Send an event to the clients: to the event sink when set (the control daemon), to Socket.IO otherwise"""
+        if SimuPathManager.event_sink is not None:
+            SimuPathManager.event_sink(event, data)
+            return
+        from nethang.extensions import socketio
+        if data is None:
+            socketio.emit(event)
+        else:
+            socketio.emit(event, data)
+
     @staticmethod
     def emit_chart_data(chart_data_callback):
         """Send chart data to all connected clients."""
-        socketio.emit('update_chart', {
+        SimuPathManager.emit('update_chart', {
+            'seq': chart_data_callback.get('seq'),
             'labels': chart_data_callback['labels'],
             'data': chart_data_callback['data']
         })
@@ -751,16 +1359,49 @@ class SimuPathManager:
     @staticmethod
     def emit_config_update():
         """Emit configuration update event to all connected clients."""
-        socketio.emit('config_updated')
+        SimuPathManager.emit('config_updated')
 
     @staticmethod
     def run_cmd(cmd : str = '', mute : bool = True) -> str:
-        app.logger.debug(f"Run command: {cmd}")
-        if mute:
-            cmd += ' > /dev/null 2>&1'
+        logger.debug("Run command: %s", cmd)
+        writer = SimuPathManager.writer
+        if writer is not None and writer.sender():
+            # Only sent to the writer of the parent, timed there
+            writer.submit([cmd])
+            return ''
+        with run_cmd_latency.time():
+            if writer is not None:
+                writer.submit([cmd])
+                return ''
+            return SimuPathManager.backend.run(cmd, mute)
 
-        ret = os.popen(cmd).read()
-        return ret
+    @staticmethod
+    def run_batch(cmds : List[str]) -> str:
+        """Run tc commands as a single kernel update"""
+        logger.debug("Run batch: %s", cmds)
+        writer = SimuPathManager.writer
+        if writer is not None and writer.sender():
+            writer.submit(cmds)
+            return ''
+        with run_batch_latency.time():
+            if writer is not None:
+                writer.submit(cmds)
+                return ''
+            return SimuPathManager.backend.run_batch(cmds)
+
+    @staticmethod
+    def kernel_transaction():
+        """Apply the commands run by the thread in the block as a single kernel transaction"""
+        if SimuPathManager.writer is None:
+            return contextlib.nullcontext()
+        return SimuPathManager.writer.transaction()
+
+    @staticmethod
+    def iptables_lock():
+        """The iptables lock, taken by the writer itself when there is one"""
+        if SimuPathManager.writer is None:
+            return ProcLock(IPT_LOCK_FILE)
+        return contextlib.nullcontext()
 
     @staticmethod
     def merge_dicts(base: dict, update: dict) -> dict:
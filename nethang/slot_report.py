@@ -0,0 +1,175 @@
+"""
+Slot Report
+
+This module provides the per-slot reports of the paths: each sample of the
+traffic monitor is attributed to the (cycle, slot) the path is running, and
+folded into streaming aggregates of that slot. The memory used per slot is
+constant whatever the number of samples, so a long run is summarized without
+keeping its samples.
+
+For each slot and direction, the report holds the mean, standard deviation
+(Welford's online algorithm), min and max of the rates and of the queue, the
+total of the dropped packets and the high-water mark of the queue.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import io
+import csv
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# (field, path in the direction stats computed by TrafficMonitor)
+FIELDS = (
+    ('bitRateIn', ('ingress', 'bitRate')),
+    ('bitRateOut', ('egress', 'bitRate')),
+    ('packetRateIn', ('ingress', 'packetRate')),
+    ('packetRateOut', ('egress', 'packetRate')),
+    ('queuePackets', ('queue', 'packets')),
+    ('dropRate', ('queue', 'dropRate')),
+)
+
+# Cap of the slots kept per report, the oldest ones are dropped beyond
+MAX_SLOTS = 10000
+
+class RunningStats:
+    """Streaming count, mean, variance, min and max of a series"""
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def stdev(self) -> float:
+        """Sample standard deviation, 0 below two values"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict:
+        if not self.count:
+            return {'mean': None, 'stdev': None, 'min': None, 'max': None}
+        return {'mean': self.mean, 'stdev': self.stdev, 'min': self.min, 'max': self.max}
+
+class DirectionAggregate:
+    """Aggregates of a direction in a slot"""
+    __slots__ = ('samples', 'start', 'end', 'drops', 'queue_max_bytes', 'queue_max_packets', 'stats')
+
+    def __init__(self):
+        self.samples = 0
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+        self.drops = 0
+        self.queue_max_bytes = 0
+        self.queue_max_packets = 0
+        self.stats = {field: RunningStats() for field, _ in FIELDS}
+
+    def add(self, timestamp: float, direction_stats: Dict, drops: int):
+        self.samples += 1
+        if self.start is None:
+            self.start = timestamp
+        self.end = timestamp
+        self.drops += drops
+        self.queue_max_bytes = max(self.queue_max_bytes, direction_stats['queue']['bytes'])
+        self.queue_max_packets = max(self.queue_max_packets, direction_stats['queue']['packets'])
+        for field, (group, key) in FIELDS:
+            self.stats[field].add(direction_stats[group][key])
+
+    def to_dict(self) -> Dict:
+        result = {
+            'samples': self.samples,
+            'start': self.start,
+            'end': self.end,
+            'drops': self.drops,
+            'queueMaxBytes': self.queue_max_bytes,
+            'queueMaxPackets': self.queue_max_packets,
+        }
+        for field, _ in FIELDS:
+            result[field] = self.stats[field].to_dict()
+        return result
+
+class SlotReport:
+    """Per-slot aggregates of a path run"""
+
+    def __init__(self, max_slots: int = MAX_SLOTS):
+        self.max_slots = max_slots
+        self.lock = threading.Lock()
+        self.slots: 'OrderedDict[Tuple[int, int], Dict[str, DirectionAggregate]]' = OrderedDict()
+        self.last_drops: Dict[str, int] = {}
+        self.slots_dropped = 0
+
+    def add_sample(self, cycle: int, slot: int, timestamp: float, traffic_stats: Dict):
+        """
+        Attribute a sample of the path to a slot.
+
+        Args:
+            cycle: cycle of the timeline, 0 for a timeline without cycles
+            slot: index of the running timeslot
+            timestamp: time of the sample
+            traffic_stats: the 'trafficStats' of the path, as computed by TrafficMonitor
+        """
+        with self.lock:
+            key = (cycle, slot)
+            if key not in self.slots:
+                self.slots[key] = {}
+                if len(self.slots) > self.max_slots:
+                    self.slots.popitem(last=False)
+                    self.slots_dropped += 1
+            for direction, direction_stats in traffic_stats.items():
+                if not direction_stats:
+                    continue
+                # The drops are a counter, restarting when the qdisc is added again
+                total = direction_stats['queue']['dropPackets']
+                drops = total - self.last_drops.get(direction, 0)
+                self.last_drops[direction] = total
+                self.slots[key].setdefault(direction, DirectionAggregate()).add(
+                    timestamp, direction_stats, drops if drops >= 0 else total)
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'slotsDropped': self.slots_dropped,
+                'slots': [
+                    {'cycle': cycle, 'slot': slot,
+                     **{direction: aggregate.to_dict() for direction, aggregate in directions.items()}}
+                    for (cycle, slot), directions in self.slots.items()
+                ],
+            }
+
+    def rows(self) -> List[Dict]:
+        """One flat row per slot and direction"""
+        rows = []
+        with self.lock:
+            for (cycle, slot), directions in self.slots.items():
+                for direction, aggregate in directions.items():
+                    row = {'cycle': cycle, 'slot': slot, 'direction': direction}
+                    for key, value in aggregate.to_dict().items():
+                        if isinstance(value, dict):
+                            for stat, stat_value in value.items():
+                                row[f'{key}_{stat}'] = stat_value
+                        else:
+                            row[key] = value
+                    rows.append(row)
+        return rows
+
+    def to_csv(self) -> str:
+        columns = ['cycle', 'slot', 'direction', 'samples', 'start', 'end', 'drops', 'queueMaxBytes', 'queueMaxPackets']
+        columns += [f'{field}_{stat}' for field, _ in FIELDS for stat in ['mean', 'stdev', 'min', 'max']]
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(self.rows())
+        return output.getvalue()
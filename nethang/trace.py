@@ -0,0 +1,236 @@
+"""
+Trace
+
+This module provides the trace-driven emulation: recorded bandwidth, delay
+and loss traces are replayed as the timeslots of a path.
+
+Two trace formats are supported:
+
+- Mahimahi: one line per delivery opportunity of an MTU sized packet
+  (1500 bytes), in milliseconds since the start of the trace. The
+  opportunities are counted per 'interval' milliseconds to get the rate.
+- CSV: a header line, then one line per sample with a 'time' column in
+  milliseconds and any of 'rate_limit' (kbit/s), 'delay' (ms), 'jitter' (ms)
+  and 'loss' (%) columns. A sample holds until the next one.
+
+The trace files are memory-mapped and decoded line by line while the
+timeline runs, so hours-long traces are never loaded in memory. Consecutive
+samples with the same settings are coalesced in a single timeslot.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import mmap
+import math
+from itertools import repeat
+from typing import Dict, Iterator, Optional, Tuple
+
+FORMATS = ('mahimahi', 'csv')
+CSV_COLUMNS = ('rate_limit', 'delay', 'jitter', 'loss')
+
+# Bits of a Mahimahi delivery opportunity
+MTU_BITS = 1500 * 8
+# htb does not accept a null rate, an outage is emulated with the lowest one
+MIN_RATE = 1
+# Upper bound of a coalesced timeslot, so a constant looping trace still yields timeslots
+MAX_COALESCED = 60.0
+
+def _settings(values: Dict[str, float]) -> Dict:
+    """Convert the values of a sample to the settings of a timeslot direction"""
+    settings = {}
+    if 'rate_limit' in values:
+        settings['rate_limit'] = max(MIN_RATE, int(round(values['rate_limit'])))
+        settings['throttle_type'] = 'on'
+    if 'delay' in values or 'jitter' in values:
+        settings['delay'] = int(round(values.get('delay', 0)))
+        settings['jitter'] = int(round(values.get('jitter', 0)))
+        settings['latency_type'] = 'jitter-reorder-off' if settings['jitter'] > 0 else 'constant'
+    if 'loss' in values:
+        settings['loss'] = values['loss']
+        settings['loss_type'] = 'random' if values['loss'] > 0 else 'off'
+    return settings
+
+class TraceFile:
+    """A memory-mapped trace file, decoded lazily"""
+
+    def __init__(self, path: str, format: str = 'auto', interval: float = 100):
+        """
+        Args:
+            path: trace file
+            format: 'mahimahi', 'csv' or 'auto' to detect it from the first line
+            interval: bin size in milliseconds of the Mahimahi rate, and hold time of the last CSV sample
+        """
+        self.path = path
+        self.interval = float(interval)
+        if self.interval <= 0:
+            raise ValueError(f'Invalid trace interval: {interval}')
+        self.file = open(path, 'rb')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.close()
+            raise ValueError(f'Empty trace file: {path}')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if format == 'auto':
+            end = self.mm.find(b'\n')
+            format = TraceFile.detect_format(self.mm[:end if end >= 0 else len(self.mm)])
+        if format not in FORMATS:
+            self.close()
+            raise ValueError(f'Invalid trace format: {format}')
+        self.format = format
+
+    @staticmethod
+    def detect_format(first_line: bytes) -> str:
+        """A Mahimahi trace only has integers, a CSV trace starts with its header"""
+        return 'mahimahi' if first_line.strip().isdigit() else 'csv'
+
+    def _lines(self) -> Iterator[bytes]:
+        """Iterate over the non empty lines from the start of the file"""
+        self.mm.seek(0)
+        while True:
+            line = self.mm.readline()
+            if not line:
+                return
+            line = line.strip()
+            if line and not line.startswith(b'#'):
+                yield line
+
+    def samples(self) -> Iterator[Tuple[float, Dict]]:
+        """Iterate once over the samples of the trace as (duration in seconds, settings)"""
+        if self.format == 'mahimahi':
+            return self._mahimahi_samples()
+        return self._csv_samples()
+
+    def _mahimahi_samples(self) -> Iterator[Tuple[float, Dict]]:
+        interval = self.interval
+        current_bin, count = 0, 0
+        for line in self._lines():
+            bin_ = int(int(line) // interval)
+            if bin_ != current_bin:
+                yield interval / 1000, _settings({'rate_limit': count * MTU_BITS / interval})
+                if bin_ > current_bin + 1:
+                    # No delivery opportunity during the gap
+                    yield (bin_ - current_bin - 1) * interval / 1000, _settings({'rate_limit': 0})
+                current_bin, count = bin_, 0
+            count += 1
+        yield interval / 1000, _settings({'rate_limit': count * MTU_BITS / interval})
+
+    def _csv_samples(self) -> Iterator[Tuple[float, Dict]]:
+        lines = self._lines()
+        header = [column.strip() for column in next(lines, b'').decode().split(',')]
+        if 'time' not in header:
+            raise ValueError(f"Missing 'time' column in trace {self.path}")
+        time_index = header.index('time')
+        columns = [(index, column) for index, column in enumerate(header) if column in CSV_COLUMNS]
+
+        previous: Optional[Tuple[float, Dict]] = None
+        for line in lines:
+            cells = line.decode().split(',')
+            values = {}
+            for index, column in columns:
+                if index < len(cells) and cells[index].strip() != '':
+                    values[column] = float(cells[index])
+            time_ = float(cells[time_index])
+            if previous is not None and time_ > previous[0]:
+                yield (time_ - previous[0]) / 1000, previous[1]
+            previous = (time_, _settings(values))
+        if previous is not None:
+            yield self.interval / 1000, previous[1]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+def merge_directions(uplink: Iterator[Tuple[float, Dict]],
+                     downlink: Iterator[Tuple[float, Dict]]) -> Iterator[Tuple[float, Dict, Dict]]:
+    """Merge the samples of both directions in segments where neither changes"""
+    up, down = next(uplink, None), next(downlink, None)
+    up_left = up[0] if up else 0
+    down_left = down[0] if down else 0
+    while up is not None and down is not None:
+        step = min(up_left, down_left)
+        if step > 0:
+            yield step, up[1], down[1]
+        up_left -= step
+        down_left -= step
+        if up_left <= 1e-9:
+            up = next(uplink, None)
+            up_left = up[0] if up else 0
+        if down_left <= 1e-9:
+            down = next(downlink, None)
+            down_left = down[0] if down else 0
+
+def coalesce(segments: Iterator[Tuple[float, Dict, Dict]],
+             max_duration: float = MAX_COALESCED) -> Iterator[Tuple[float, Dict, Dict]]:
+    """Merge consecutive segments with the same settings"""
+    pending = None
+    for duration, up, down in segments:
+        if pending and pending[1] == up and pending[2] == down and pending[0] < max_duration:
+            pending[0] += duration
+            continue
+        if pending:
+            yield tuple(pending)
+        pending = [duration, up, down]
+    if pending:
+        yield tuple(pending)
+
+class TraceSource:
+    """
+    The timeslots of a trace path.
+
+    Settings (the 'trace' of the simulation settings of the path):
+        file: trace file of both directions
+        uplink_file / downlink_file: trace file of a direction, override 'file'
+        format: 'mahimahi', 'csv' or 'auto' (default)
+        interval: bin size in milliseconds of the Mahimahi traces, default 100
+        loop: replay the trace forever, default true
+        global: settings of the directions not given by the trace, like in a model
+
+    The cycles given at the activation of the path, if any, override 'loop'.
+    """
+
+    def __init__(self, settings: Dict, cycles: Optional[int] = None):
+        self.settings = settings or {}
+        self.cycles = cycles
+        self.files = {}
+        for direction in ['uplink', 'downlink']:
+            path = self.settings.get(f'{direction}_file') or self.settings.get('file')
+            if path:
+                self.files[direction] = os.path.expanduser(path)
+        if not self.files:
+            raise ValueError('No trace file')
+        for path in self.files.values():
+            if not os.path.isfile(path):
+                raise ValueError(f'Trace file {path} not found')
+        self.format = self.settings.get('format', 'auto')
+        if self.format not in FORMATS + ('auto',):
+            raise ValueError(f"Invalid trace format: {self.format}")
+        self.interval = float(self.settings.get('interval', 100))
+        self.loop = bool(self.settings.get('loop', True))
+        self.global_settings = self.settings.get('global') or {'uplink': {}, 'downlink': {}}
+
+    def _direction_samples(self, direction: str) -> Iterator[Tuple[float, Dict]]:
+        if direction not in self.files:
+            # The direction only has the global settings
+            return repeat((math.inf, {}))
+        return self._replay(TraceFile(self.files[direction], self.format, self.interval))
+
+    def _replay(self, trace: TraceFile) -> Iterator[Tuple[float, Dict]]:
+        try:
+            replays = 0
+            while True:
+                empty = True
+                for sample in trace.samples():
+                    empty = False
+                    yield sample
+                replays += 1
+                if empty or (self.cycles and replays >= self.cycles) or (not self.cycles and not self.loop):
+                    return
+        finally:
+            trace.close()
+
+    def timeslots(self) -> Iterator[Dict]:
+        """Iterate lazily over the timeslots of the trace"""
+        segments = merge_directions(self._direction_samples('uplink'), self._direction_samples('downlink'))
+        for duration, up, down in coalesce(segments):
+            yield {'duration': duration, 'uplink': up, 'downlink': down}
@@ -8,22 +8,42 @@ Date: 2025-05-19
 """
 
 import re
-import subprocess
 import time
 import random
-from . import app
+from . import logger
+from nethang.perf import perf
+from nethang.logs import kv
+from nethang.kernel_backend import ShellBackend
 from typing import Dict, List
 from threading import Thread
 
 class TrafficMonitor:
     # Ethernet Frame Header Size
     ETHERNET_HEADER_SIZE = 14
+    # Shortest sampling interval in seconds
+    MIN_INTERVAL = 0.05
     def __init__(
             self, id_range: tuple,
             interval: float = 1,
             lan_iface: str = '', wan_iface: str = '',
-            stats_callback=None):
+            stats_callback=None,
+            metrics_store=None,
+            cpu_budget: float = 0.25,
+            chart_interval: float = 1,
+            interval_callback=None,
+            backend=None,
+            sample_callback=None,
+            start_task=None):
         self.interval = interval
+        self.cpu_budget = cpu_budget # Fraction of a CPU the sampling may use, 0 for no limit
+        self.chart_interval = chart_interval # Interval of the chart data emitted to the clients
+        self.interval_callback = interval_callback # Returns the wanted interval of the next sample
+        self.sample_callback = sample_callback # Called with the stats of each sample
+        self.start_task = start_task # Starts the loop as a background task of the server, a thread by default
+        self.effective_interval = interval
+        self.backend = backend if backend else ShellBackend()
+        self.avg_tick_cost = None
+        self.query_time = 0.0 # Time spent waiting for the commands of the queries
         self.lan_iface = lan_iface
         self.wan_iface = wan_iface
         self.ids = range(id_range[0], id_range[1]) # Total 32 marks are available. Seems it is not necessary to make it configurable
@@ -31,6 +51,8 @@ class TrafficMonitor:
         self.thread = None
         self.stats: Dict = {}
         self.data_to_emit: Dict = {
+            # Samples appended so far, for the clients to append only the new ones to their charts
+            'seq': 0,
             'labels': [None for _ in range(100)],
             'data': {
                 str(id): {
@@ -65,13 +87,19 @@ class TrafficMonitor:
         }
         self.previous_stats: Dict = {}
         self.start_time = None
+        self.start_monotonic = None
         self.stats_callback = stats_callback
+        self.metrics_store = metrics_store
 
     def _run_command(self, cmd: List[str]) -> str:
         """Run shell command"""
-        app.logger.debug(f"Run command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return result.stdout
+        logger.debug("Run command: %s", cmd)
+        start, thread_start = time.monotonic(), time.thread_time()
+        try:
+            return self.backend.query(cmd)
+        finally:
+            # The CPU time of this thread is counted by _cpu_time already
+            self.query_time += (time.monotonic() - start) - (time.thread_time() - thread_start)
 
     def _extract_iptables_stats(self, iptables_output: str, in_iface: str, out_iface: str, id: int) -> Dict:
         for line in iptables_output.splitlines():
@@ -123,13 +151,14 @@ class TrafficMonitor:
 
         return stats
 
-    def _get_direction_stats(self, direction: str, iptables_stats: Dict, egress_tc: str, current_time: float, id: int) -> Dict:
+    def _get_direction_stats(self, direction: str, iptables_stats: Dict, egress_tc: str, monotonic_time: float, id: int) -> Dict:
         tc_stats_egress = self._extract_tc_stats(egress_tc, id)
         if tc_stats_egress == {}:
             return {}
 
-        previous_time = self.stats.get(str(id), {}).get('timeStamp', current_time)
-        elapsed_time = current_time - previous_time
+        # Use the monotonic clock, the wall clock may jump between two close samples
+        previous_time = self.stats.get(str(id), {}).get('monotonicTime', monotonic_time)
+        elapsed_time = monotonic_time - previous_time
 
         previous_ingress_bytes = self.stats.get(str(id), {}).get('trafficStats', {}).get(direction, {}).get('ingress', {}).get('bytes', 0)
         previous_ingress_packets = self.stats.get(str(id), {}).get('trafficStats', {}).get(direction, {}).get('ingress', {}).get('packets', 0)
@@ -172,7 +201,7 @@ class TrafficMonitor:
             'egress': {'bytes': 0, 'packets': 0, 'bitRate': 0, 'packetRate': 0}
         }
 
-    def _create_base_stats(self, timestamp: float, id: int) -> Dict:
+    def _create_base_stats(self, timestamp: float, monotonic_time: float, id: int) -> Dict:
         return {
             'filter': {
                 'lan': self.lan_iface,
@@ -180,23 +209,37 @@ class TrafficMonitor:
                 'mark_id': id,
             },
             'timeStamp': timestamp,
-            'elapsedTime': int(timestamp - self.start_time),
+            'monotonicTime': monotonic_time,
+            'elapsedTime': int(monotonic_time - self.start_monotonic),
             'trafficStats': {
                 'uplink': self._create_empty_direction_stats(),
                 'downlink': self._create_empty_direction_stats()
             }
         }
 
-    def _process_stats(self, iptables_output: str, tc_lan_output: str, tc_wan_output: str, current_time: float) -> Dict:
+    @perf.timed('monitor.process_stats')
+    def _process_stats(self, iptables_output: str, tc_lan_output: str, tc_wan_output: str, current_time: float, monotonic_time: float = None) -> Dict:
         stats_ = {}
+        if monotonic_time is None:
+            monotonic_time = current_time
+        if self.start_monotonic is None:
+            self.start_monotonic = monotonic_time
 
         # TODO: performance improvement needed
         for id in self.ids:
             iptables_uplink_stats = self._extract_iptables_stats(iptables_output, self.lan_iface, self.wan_iface, id)
             iptables_downlink_stats = self._extract_iptables_stats(iptables_output, self.wan_iface, self.lan_iface, id)
-            stats_[str(id)] = self._create_base_stats(current_time, id)
-            stats_[str(id)]['trafficStats']['uplink'] = self._get_direction_stats('uplink', iptables_uplink_stats, tc_wan_output, current_time, id)
-            stats_[str(id)]['trafficStats']['downlink'] = self._get_direction_stats('downlink', iptables_downlink_stats, tc_lan_output, current_time, id)
+            stats_[str(id)] = self._create_base_stats(current_time, monotonic_time, id)
+            stats_[str(id)]['trafficStats']['uplink'] = self._get_direction_stats('uplink', iptables_uplink_stats, tc_wan_output, monotonic_time, id)
+            stats_[str(id)]['trafficStats']['downlink'] = self._get_direction_stats('downlink', iptables_downlink_stats, tc_lan_output, monotonic_time, id)
+
+        return stats_
+
+    def _append_chart_data(self, stats_: Dict, current_time: float):
+        """Append a sample to the chart data emitted to the clients"""
+        for id in self.ids:
+            if str(id) not in stats_:
+                continue
 
             for direction in ['uplink', 'downlink']:
                 if stats_[str(id)]['trafficStats'][direction] and stats_[str(id)]['trafficStats'][direction] != {}:
@@ -226,27 +269,89 @@ class TrafficMonitor:
 
         self.data_to_emit['labels'].append(time.strftime('%H:%M:%S', time.localtime(current_time)))
         self.data_to_emit['labels'].pop(0)
+        self.data_to_emit['seq'] += 1
 
-        return stats_
-
+    @perf.timed('monitor.sample')
     def _get_current_stats(self) -> Dict:
         iptables_output = self._run_command(['iptables', '-nvxL', 'FORWARD', '-t', 'mangle'])
         tc_lan_output = self._run_command(['tc', '-s', 'qdisc', 'show', 'dev', self.lan_iface])
         tc_wan_output = self._run_command(['tc', '-s', 'qdisc', 'show', 'dev', self.wan_iface])
 
-        return self._process_stats(iptables_output, tc_lan_output, tc_wan_output, time.time())
+        return self._process_stats(iptables_output, tc_lan_output, tc_wan_output, time.time(), time.monotonic())
+
+    def _cpu_time(self) -> float:
+        """
+        CPU time of the calling thread and of its own queries.
+
+        The commands of the queries (tc, iptables) are charged for the time
+        waited on them, the other children of the process are not counted.
+        """
+        return time.thread_time() + self.query_time
+
+    def _next_interval(self, tick_cost: float) -> float:
+        """
+        Get the interval until the next sample.
+
+        The wanted interval is stretched when the average CPU cost of a sample
+        would exceed the CPU budget at that rate.
+        """
+        if self.avg_tick_cost is None:
+            self.avg_tick_cost = tick_cost
+        else:
+            self.avg_tick_cost = 0.8 * self.avg_tick_cost + 0.2 * tick_cost
+
+        interval = self.interval_callback() if self.interval_callback else self.interval
+        interval = wanted_interval = max(interval, TrafficMonitor.MIN_INTERVAL)
+        if self.cpu_budget > 0:
+            interval = max(interval, self.avg_tick_cost / self.cpu_budget)
+
+        if self.cpu_budget > 0 and self.avg_tick_cost / self.cpu_budget > wanted_interval:
+            perf.counter('monitor.budget_backoffs').inc()
+
+        if interval != self.effective_interval:
+            logger.debug(kv('monitor_tick', interval=interval, cost_ms=self.avg_tick_cost * 1000))
+        self.effective_interval = interval
+        return interval
 
     def monitor_loop(self):
         """Main monitoring loop"""
         self.start_time = time.time()
+        self.start_monotonic = time.monotonic()
+        next_tick = next_chart = time.monotonic()
         while self.running:
+            tick_start = self._cpu_time()
             self.stats = self._get_current_stats()
 
-            # Call callback function if provided
-            if self.stats_callback:
-                self.stats_callback(self.data_to_emit)
-
-            time.sleep(self.interval)  # Update every interval
+            # Keep the history on disk
+            if self.metrics_store:
+                try:
+                    self.metrics_store.append_stats(self.stats)
+                except Exception as e:
+                    logger.warning(f"Warning in storing metrics: {e}")
+
+            if self.sample_callback:
+                try:
+                    self.sample_callback(self.stats)
+                except Exception as e:
+                    logger.warning(f"Warning in sample callback: {e}")
+
+            # Update the chart at its own pace, whatever the sampling interval
+            if time.monotonic() >= next_chart:
+                self._append_chart_data(self.stats, time.time())
+                next_chart += self.chart_interval
+                if next_chart < time.monotonic():
+                    next_chart = time.monotonic() + self.chart_interval
+
+                # Call callback function if provided
+                if self.stats_callback:
+                    self.stats_callback(self.data_to_emit)
+
+            next_tick += self._next_interval(self._cpu_time() - tick_start)
+            now = time.monotonic()
+            if next_tick < now:
+                # Behind schedule, do not try to catch up
+                next_tick = now
+            time.sleep(next_tick - now)
 
     def restart(self):
         """Restart the monitor"""
@@ -257,11 +362,13 @@ class TrafficMonitor:
         """Stop the monitor"""
         self.running = False
         try:
-            if self.thread and self.thread.is_alive():
+            if self.thread:
                 self.thread.join()
             self.thread = None
+            if self.metrics_store:
+                self.metrics_store.flush()
         except Exception as e:
-            app.logger.warning(f"Warning in stop traffic monitor: {e}")
+            logger.warning(f"Warning in stop traffic monitor: {e}")
             self.restart()
 
     def start(self):
@@ -269,10 +376,12 @@ class TrafficMonitor:
         self.running = True
 
         try:
-            if self.thread is None:
+            if self.thread is None and self.start_task:
+                self.thread = self.start_task(self.monitor_loop)
+            elif self.thread is None:
                 self.thread = Thread(target=self.monitor_loop, daemon=True)
                 self.thread.start()
 
         except Exception as e:
-            app.logger.warning(f"Warning in start traffic monitor: {e}")
+            logger.warning(f"Warning in start traffic monitor: {e}")
             self.restart()
@@ -7,10 +7,29 @@ Author: Hang Yin
 Date: 2025-05-19
 """
 
-from nethang import app
+import sys
+
+# Commands of the headless command line, see nethang/cli.py
+CLI_COMMANDS = ['apply', 'stop', 'status', 'daemon']
 
 def main():
-    app.run(host='0.0.0.0', port=9527, debug=False)
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        from nethang.cli import main as cli_main
+        sys.exit(cli_main())
+
+    from nethang.server import select_async_mode, monkey_patch, serve
+
+    # Before the app and the engine, whose blocking calls must be cooperative
+    async_mode = select_async_mode()
+    monkey_patch(async_mode)
+
+    from nethang import create_app
+    from nethang.routes import init_server
+    from nethang.extensions import socketio
+
+    app = create_app(async_mode=async_mode)
+    init_server()
+    serve(app, socketio, host='0.0.0.0', port=9527)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
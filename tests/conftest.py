@@ -43,10 +43,9 @@ def mock_config_paths():
 
 @pytest.fixture
 def mock_app_logger():
-    """Mock Flask app logger for testing."""
-    with patch('nethang.config_manager.app') as mock_app:
-        mock_app.logger = MagicMock()
-        yield mock_app
+    """Mock the logger for testing."""
+    with patch('nethang.config_manager.logger') as mock_logger:
+        yield mock_logger
 
 
 @pytest.fixture
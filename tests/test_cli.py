@@ -0,0 +1,97 @@
+"""
+Tests for nethang/cli.py
+
+This module contains tests for the headless command line.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import yaml
+import pytest
+from unittest.mock import patch
+from nethang import cli
+from nethang.kernel_backend import FakeBackend
+from nethang.simu_path import SimuPathManager
+
+MODELS = {
+    'Steps': {
+        'global': {'uplink': {'latency_type': 'constant'}, 'downlink': {'latency_type': 'constant'}},
+        'timeline': [{'duration': 0.05, 'uplink': {'delay': 10}, 'downlink': {}},
+                     {'duration': 0.05, 'uplink': {'delay': 20}, 'downlink': {}}],
+    },
+}
+
+
+@pytest.fixture
+def env(tmp_path):
+    """A fake kernel, with paths.yaml and the locks in a temporary directory"""
+    backend = FakeBackend()
+    config = {'lan_interface': 'eth1', 'wan_interface': 'eth0', 'kernel_backend': 'fake'}
+    with patch('nethang.cli.PATHS_FILE', str(tmp_path / 'paths.yaml')), \
+            patch('nethang.cli.ID_LOCK_FILE', str(tmp_path / 'id.lock')), \
+            patch('nethang.cli.init_logging'), \
+            patch('nethang.simu_path.IPT_LOCK_FILE', str(tmp_path / 'ipt.lock')), \
+            patch.object(SimuPathManager, 'lan_ifname', 'eth1'), \
+            patch.object(SimuPathManager, 'wan_ifname', 'eth0'), \
+            patch.object(SimuPathManager, 'backend', backend), \
+            patch.object(SimuPathManager, 'load_config', return_value=config), \
+            patch.object(SimuPathManager, 'load_models', return_value={'models': MODELS}), \
+            patch('nethang.simu_path.create_backend', return_value=backend):
+        yield backend
+
+
+class TestFilter:
+    """Test cases for the filter options"""
+
+    def test_endpoints(self):
+        assert cli.build_filter(None, '10.0.0.5:443', None) == {
+            'protocol': 'tcp', 'lan_ip': '', 'lan_port': 'Any', 'wan_ip': '10.0.0.5', 'wan_port': '443'}
+        assert cli.build_filter('10.0.0.0/24', None, None)['protocol'] == 'ip'
+        assert cli.build_filter(None, '10.0.0.5:53', 'udp')['protocol'] == 'udp'
+
+    @pytest.mark.parametrize('lan, wan, protocol', [(None, '10.0.0.5:https', None), ('10.0.0.5:80', None, 'ip')])
+    def test_invalid(self, lan, wan, protocol):
+        with pytest.raises(ValueError):
+            cli.build_filter(lan, wan, protocol)
+
+
+class TestCommands:
+    """Test cases for the commands"""
+
+    def test_apply_then_teardown(self, env, capsys):
+        assert cli.main(['apply', 'Steps', '--wan', '10.0.0.5:443', '--duration', '0.3']) == 0
+        assert 'Applied Steps on mark' in capsys.readouterr().out
+        # The path was registered then removed, its kernel state with it
+        assert cli.cli_paths() == []
+        state = env.get_state()
+        assert state['rules'] == []
+        assert all(':9528' not in classid for classid in state['classes'].get('eth0', {}))
+        commands = [cmd for operation in env.get_operations()['operations']
+                    for cmd in operation.get('batch', [operation['cmd']])]
+        assert any('delay 20ms' in cmd for cmd in commands)
+
+    def test_apply_cycles(self, env):
+        assert cli.main(['apply', 'Steps', '--cycles', '2', '--speed', '2', '--duration', '5']) == 0
+
+    def test_unknown_model(self, env, capsys):
+        assert cli.main(['apply', 'Missing']) == 2
+        assert 'not found' in capsys.readouterr().err
+
+    def test_status_and_stop_of_dead_process(self, env, capsys, tmp_path):
+        entry = {
+            'id': 9530, 'name': 'cli 1', 'status': 'active',
+            'filter_settings': dict(cli.build_filter('10.0.0.7', None, None), mark=9530),
+            'simu_settings': {'mode': 'model', 'model': 'Steps', 'uplink': {'mode': 'bypass', 'restrict_settings': None},
+                              'downlink': {'mode': 'bypass', 'restrict_settings': None}},
+            'cli': {'pid': 2 ** 22 + 1, 'started': 0, 'duration': None},
+        }
+        with open(tmp_path / 'paths.yaml', 'w') as f:
+            yaml.dump([entry, {'id': 9528, 'name': 'web'}], f)
+
+        assert cli.main(['status']) == 0
+        assert 'dead' in capsys.readouterr().out
+        assert cli.main(['stop']) == 0
+        with open(tmp_path / 'paths.yaml') as f:
+            assert yaml.safe_load(f) == [{'id': 9528, 'name': 'web'}]
+        assert cli.main(['stop']) == 1
@@ -88,8 +88,8 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
-    def test_ensure_models_file_exists(self, mock_app, mock_config_path, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_ensure_models_file_exists(self, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test ensure_models when models file already exists"""
         # Mock that file exists
         with patch('os.path.exists', return_value=True):
@@ -99,8 +99,8 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
-    def test_ensure_models_file_not_exists(self, mock_app, mock_config_path, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_ensure_models_file_not_exists(self, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test ensure_models when models file doesn't exist"""
         # Mock that file doesn't exist
         with patch('os.path.exists', return_value=False):
@@ -110,9 +110,9 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
+    @patch('nethang.config_manager.logger')
     @patch('requests.get')
-    def test_create_config_from_github_success(self, mock_get, mock_app, mock_config_path, mock_models_file, config_manager):
+    def test_create_config_from_github_success(self, mock_get, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test successful config download from GitHub"""
         # Mock successful response
         mock_response = MagicMock()
@@ -134,9 +134,9 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
+    @patch('nethang.config_manager.logger')
     @patch('requests.get')
-    def test_create_config_from_github_invalid_yaml(self, mock_get, mock_app, mock_config_path, mock_models_file, config_manager):
+    def test_create_config_from_github_invalid_yaml(self, mock_get, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test config download with invalid YAML"""
         # Mock response with invalid YAML
         mock_response = MagicMock()
@@ -151,9 +151,9 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
+    @patch('nethang.config_manager.logger')
     @patch('requests.get')
-    def test_create_config_from_github_request_error(self, mock_get, mock_app, mock_config_path, mock_models_file, config_manager):
+    def test_create_config_from_github_request_error(self, mock_get, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test config download with request error"""
         # Mock request error
         mock_get.side_effect = Exception("Network error")
@@ -165,8 +165,8 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
-    def test_create_fallback_config_success(self, mock_app, mock_config_path, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_create_fallback_config_success(self, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test successful fallback config creation"""
         with patch('builtins.open', mock_open()) as mock_file:
             with patch('os.makedirs') as mock_makedirs:
@@ -177,8 +177,8 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
-    def test_create_fallback_config_error(self, mock_app, mock_config_path, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_create_fallback_config_error(self, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test fallback config creation with error"""
         with patch('builtins.open', side_effect=Exception("Write error")):
             with patch('os.makedirs'):
@@ -186,16 +186,16 @@ class TestConfigManager:
                 # Should log warning but not raise exception
 
     @patch('nethang.config_manager.MODELS_FILE')
-    @patch('nethang.config_manager.app')
-    def test_check_config_update_force(self, mock_app, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_check_config_update_force(self, mock_logger, mock_models_file, config_manager):
         """Test config update check with force update"""
         with patch.object(config_manager, 'update_config_from_github') as mock_update:
             config_manager.check_config_update(force_update=True)
             mock_update.assert_called_once()
 
     @patch('nethang.config_manager.MODELS_FILE')
-    @patch('nethang.config_manager.app')
-    def test_check_config_update_old_file(self, mock_app, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_check_config_update_old_file(self, mock_logger, mock_models_file, config_manager):
         """Test config update check with old file"""
         # Mock old file (8 days old)
         with patch('os.path.getmtime', return_value=0):
@@ -205,8 +205,8 @@ class TestConfigManager:
                     mock_update.assert_called_once()
 
     @patch('nethang.config_manager.MODELS_FILE')
-    @patch('nethang.config_manager.app')
-    def test_check_config_update_recent_file(self, mock_app, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_check_config_update_recent_file(self, mock_logger, mock_models_file, config_manager):
         """Test config update check with recent file"""
         # Mock recent file (1 day old)
         with patch('os.path.getmtime', return_value=0):
@@ -217,9 +217,9 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
+    @patch('nethang.config_manager.logger')
     @patch('requests.get')
-    def test_update_config_from_github_success(self, mock_get, mock_app, mock_config_path, mock_models_file, config_manager):
+    def test_update_config_from_github_success(self, mock_get, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test successful config update from GitHub"""
         # Mock successful response
         mock_response = MagicMock()
@@ -242,9 +242,9 @@ class TestConfigManager:
 
     @patch('nethang.config_manager.MODELS_FILE')
     @patch('nethang.config_manager.CONFIG_PATH')
-    @patch('nethang.config_manager.app')
+    @patch('nethang.config_manager.logger')
     @patch('requests.get')
-    def test_update_config_from_github_error_with_backup(self, mock_get, mock_app, mock_config_path, mock_models_file, config_manager):
+    def test_update_config_from_github_error_with_backup(self, mock_get, mock_logger, mock_config_path, mock_models_file, config_manager):
         """Test config update error with backup restoration"""
         # Mock request error
         mock_get.side_effect = Exception("Network error")
@@ -258,8 +258,8 @@ class TestConfigManager:
                 mock_copy.assert_called_with(backup_file, mock_models_file)
 
     @patch('nethang.config_manager.MODELS_FILE')
-    @patch('nethang.config_manager.app')
-    def test_load_models_success(self, mock_app, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_load_models_success(self, mock_logger, mock_models_file, config_manager):
         """Test successful models loading"""
         with patch('builtins.open', mock_open(read_data=yaml.dump({
             'version': '0.1.0',
@@ -275,8 +275,8 @@ class TestConfigManager:
             assert result['version'] == '0.1.0'
 
     @patch('nethang.config_manager.MODELS_FILE')
-    @patch('nethang.config_manager.app')
-    def test_load_models_file_not_found(self, mock_app, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_load_models_file_not_found(self, mock_logger, mock_models_file, config_manager):
         """Test models loading when file doesn't exist"""
         with patch('builtins.open', side_effect=FileNotFoundError("File not found")):
             result = config_manager.load_models()
@@ -285,8 +285,8 @@ class TestConfigManager:
             assert result == config_manager.fallback_models
 
     @patch('nethang.config_manager.MODELS_FILE')
-    @patch('nethang.config_manager.app')
-    def test_load_models_yaml_error(self, mock_app, mock_models_file, config_manager):
+    @patch('nethang.config_manager.logger')
+    def test_load_models_yaml_error(self, mock_logger, mock_models_file, config_manager):
         """Test models loading with YAML parsing error"""
         with patch('builtins.open', mock_open(read_data="invalid: yaml: [")):
             result = config_manager.load_models()
@@ -0,0 +1,213 @@
+"""
+Tests for nethang/control.py
+
+This module contains tests for the control daemon and its clients.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import pytest
+from unittest.mock import patch
+from nethang import cli
+from nethang.control import Control, ControlDaemon, ControlClient, ControlError
+from nethang.simu_path import SimuPathManager
+
+
+class StubPath:
+    markov_seed = 42
+
+
+class StubManager:
+    """The part of SimuPathManager used by Control"""
+
+    def __init__(self):
+        self.paths = {}
+        self.entries = {}
+        self.calls = []
+        self.lock = threading.RLock()
+
+    def paths_lock(self):
+        return self.lock
+
+    def load_paths(self):
+        return list(self.entries.values())
+
+    def get_path_config(self, id):
+        return self.entries.get(id)
+
+    def add_path(self, path):
+        self.paths[path['id']] = StubPath()
+        self.entries[path['id']] = path
+        self.calls.append(('add', path['id']))
+
+    def delete_path(self, id):
+        del self.paths[id]
+        del self.entries[id]
+        self.calls.append(('delete', id))
+
+    def activate_path(self, id, speed=1.0, cycles=None):
+        if id not in self.paths:
+            raise ValueError(f"Path with id {id} not found")
+        self.entries[id]['status'] = 'active'
+        self.calls.append(('activate', id, speed, cycles))
+
+    def deactivate_path(self, id):
+        self.entries[id]['status'] = 'inactive'
+        self.calls.append(('deactivate', id))
+
+    def save_config(self, config):
+        SimuPathManager.emit_config_update()
+
+
+@pytest.fixture
+def socket_dir():
+    # The path of a Unix socket is limited to about 100 characters
+    path = tempfile.mkdtemp(prefix='nh', dir='/tmp')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def daemon(socket_dir):
+    """A daemon serving a stub manager, with paths.yaml and the lock in a temporary directory"""
+    manager = StubManager()
+    with patch('nethang.control.PATHS_FILE', os.path.join(socket_dir, 'paths.yaml')), \
+            patch.object(SimuPathManager, 'mark_range', (9528, 9530)):
+        daemon = ControlDaemon(Control(manager), os.path.join(socket_dir, 'control.sock'))
+        thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+        thread.start()
+        SimuPathManager.event_sink = daemon.broadcast
+        yield daemon
+        SimuPathManager.event_sink = None
+        daemon.shutdown()
+        daemon.close()
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestControlClient:
+    """Test cases for the operations through the socket"""
+
+    def test_ping(self, daemon):
+        client = ControlClient(daemon.path)
+        assert client.ping()['pid'] == os.getpid()
+        # A second call reuses the connection
+        assert client.ping()['pid'] == os.getpid()
+        client.close()
+
+    def test_path_lifecycle(self, daemon):
+        client = ControlClient(daemon.path)
+        entry = {'name': 'test', 'status': 'inactive', 'filter_settings': {'protocol': 'ip'}}
+        path_id = client.add_path(path=entry)
+        assert path_id == 9528
+        assert client.get_path(id=path_id)['filter_settings']['mark'] == 9528
+        assert client.activate_path(id=path_id, speed=10, cycles=2) == {'seed': 42}
+        assert daemon.control.manager.calls[-1] == ('activate', 9528, 10, 2)
+        client.deactivate_path(id=path_id)
+        assert client.delete_path(id=path_id) is True
+        assert client.delete_path(id=path_id) is False
+        assert client.load_paths() == []
+
+    def test_errors(self, daemon):
+        client = ControlClient(daemon.path)
+        with pytest.raises(ValueError, match='not found'):
+            client.activate_path(id=9600)
+        with pytest.raises(ValueError, match='Invalid speed'):
+            client.activate_path(id=9600, speed=0)
+        with pytest.raises(ValueError, match='Unknown method'):
+            client.call('shutdown')
+        with pytest.raises(AttributeError):
+            client.shutdown
+
+    def test_unreachable(self, socket_dir):
+        with pytest.raises(ControlError, match='not reachable'):
+            ControlClient(os.path.join(socket_dir, 'missing.sock')).ping()
+
+    def test_reconnect_after_restart(self, daemon):
+        client = ControlClient(daemon.path)
+        client.ping()
+        daemon.shutdown()
+        daemon.close()
+        restarted = ControlDaemon(Control(StubManager()), daemon.path)
+        threading.Thread(target=restarted.serve_forever, daemon=True).start()
+        try:
+            assert client.ping()['pid'] == os.getpid()
+        finally:
+            restarted.shutdown()
+            restarted.close()
+        # Already stopped for the fixture
+        daemon.shutdown = lambda: None
+        daemon.close = lambda: None
+
+
+class TestControlDaemon:
+    """Test cases for the daemon socket and its events"""
+
+    def test_events(self, daemon):
+        events = []
+        subscriber = ControlClient(daemon.path)
+        subscriber.subscribe(lambda event, data: events.append((event, data)))
+        assert wait_for(lambda: daemon.subscribers)
+        ControlClient(daemon.path).save_config(config={})
+        SimuPathManager.emit_chart_data({'seq': 1, 'labels': [1], 'data': [2]})
+        assert wait_for(lambda: len(events) == 2)
+        assert events == [('config_updated', None), ('update_chart', {'seq': 1, 'labels': [1], 'data': [2]})]
+        subscriber.close()
+
+    def test_slow_subscriber_dropped(self, daemon):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock, \
+                patch('nethang.control.MAX_PENDING_EVENTS', 2):
+            sock.connect(daemon.path)
+            sock.sendall(b'{"id": 1, "method": "subscribe"}\n')
+            assert sock.recv(1024).startswith(b'{"id": 1, "result": true}')
+            # The subscriber does not read its events
+            for _ in range(100):
+                daemon.broadcast('update_chart', {'data': 'x' * 65536})
+            assert wait_for(lambda: not daemon.subscribers)
+
+    def test_socket_mode(self, daemon):
+        assert os.stat(daemon.path).st_mode & 0o777 == 0o600
+
+    def test_already_running(self, daemon):
+        with pytest.raises(RuntimeError, match='already listens'):
+            ControlDaemon(Control(StubManager()), daemon.path)
+
+    def test_stale_socket(self, socket_dir):
+        path = os.path.join(socket_dir, 'stale.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+        daemon = ControlDaemon(Control(StubManager()), path)
+        daemon.close()
+        assert not os.path.exists(path)
+
+
+class TestRemoteApply:
+    """Test cases for the command line as a client of the daemon"""
+
+    def test_apply(self, daemon, capsys):
+        config = {'lan_interface': 'eth1', 'wan_interface': 'eth0'}
+        with patch.dict(os.environ, {'NETHANG_CONTROL_SOCKET': daemon.path}), \
+                patch('nethang.cli.init_logging'), \
+                patch.object(SimuPathManager, 'lan_ifname', 'eth1'), \
+                patch.object(SimuPathManager, 'wan_ifname', 'eth0'), \
+                patch.object(SimuPathManager, 'load_config', return_value=config), \
+                patch.object(SimuPathManager, 'load_models', return_value={'models': {'Steps': {}}}):
+            assert cli.main(['apply', 'Steps', '--wan', '10.0.0.5:443', '--duration', '0.2']) == 0
+        assert 'Applied Steps on mark 9528, seed 42' in capsys.readouterr().out
+        calls = daemon.control.manager.calls
+        assert [call[0] for call in calls] == ['add', 'activate', 'deactivate', 'delete']
@@ -0,0 +1,69 @@
+"""
+Tests for nethang/downsample.py
+
+This module contains tests for the downsampling of the metrics history.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import math
+import pytest
+from unittest.mock import patch
+from nethang import downsample
+from nethang.downsample import aggregate, lttb
+
+
+def wave(length):
+    """A sine wave with a spike in the middle"""
+    timestamps = [float(t) for t in range(length)]
+    values = [math.sin(t / 50) for t in range(length)]
+    values[length // 2] = 10.0
+    return timestamps, values
+
+
+class TestLttb:
+    """Test cases for Largest-Triangle-Three-Buckets"""
+
+    def test_bounded(self):
+        timestamps, values = wave(10000)
+        kept = lttb(timestamps, values, 500)
+        assert len(kept) == 500
+        assert kept == sorted(set(kept))
+        assert kept[0] == 0 and kept[-1] == 9999
+
+    def test_keeps_spike(self):
+        timestamps, values = wave(10000)
+        assert 5000 in lttb(timestamps, values, 100)
+
+    def test_short_series(self):
+        assert lttb([0.0, 1.0, 2.0], [1.0, 2.0, 3.0], 10) == [0, 1, 2]
+        assert lttb([0.0, 1.0, 2.0], [1.0, 2.0, 3.0], 2) == [0, 2]
+
+    def test_numpy_same_samples(self):
+        pytest.importorskip('numpy')
+        timestamps, values = wave(3000)
+        kept = lttb(timestamps, values, 50)
+        with patch.object(downsample, 'numpy', None):
+            assert lttb(timestamps, values, 50) == kept
+
+
+class TestAggregate:
+    """Test cases for the min/max buckets"""
+
+    def test_buckets(self):
+        columns = [[1.0, 5.0, 3.0, 7.0], [2.0, 6.0, 4.0, 8.0], [1.5, 5.5, 3.5, 7.5]]
+        # The averages weighted by the counts
+        assert aggregate([10.0, 11.0, 12.0, 13.0], [1, 1, 3, 1], columns, 2, origin=10) == (
+            [10.0, 12.0], [2, 4], [[1.0, 3.0], [6.0, 8.0], [3.5, 4.5]]
+        )
+
+    def test_numpy_same_buckets(self):
+        pytest.importorskip('numpy')
+        timestamps, values = wave(1000)
+        columns = [values, values, values]
+        merged = aggregate(timestamps, [1] * 1000, columns, 7.5, origin=0.5)
+        with patch.object(downsample, 'numpy', None):
+            expected = aggregate(timestamps, [1] * 1000, columns, 7.5, origin=0.5)
+        assert merged[:2] == expected[:2]
+        assert merged[2] == [pytest.approx(column) for column in expected[2]]
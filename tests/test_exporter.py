@@ -0,0 +1,74 @@
+"""
+Tests for nethang/exporter.py
+
+This module contains tests for the Prometheus exposition of the traffic statistics.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+from nethang import app
+from nethang.exporter import MetricsExporter
+
+
+def direction_stats(bytes_):
+    return {
+        'ingress': {'bytes': bytes_, 'packets': 10, 'bitRate': 0, 'packetRate': 0},
+        'queue': {'bytes': 1500, 'packets': 1, 'dropPackets': 2, 'dropRate': 0},
+        'egress': {'bytes': bytes_ - 100, 'packets': 9, 'bitRate': 0, 'packetRate': 0},
+    }
+
+
+@pytest.fixture
+def stats():
+    return {
+        '9528': {
+            'timeStamp': 1000.0,
+            'trafficStats': {'uplink': direction_stats(5000), 'downlink': {}},
+        }
+    }
+
+
+class TestMetricsExporter:
+    """Test cases for MetricsExporter"""
+
+    def test_render_text(self, stats):
+        text = MetricsExporter().render(stats, {9528: 3})
+        assert '# TYPE nethang_ingress_bytes_total counter' in text
+        assert 'nethang_ingress_bytes_total{path="9528",direction="uplink"} 5000' in text
+        assert 'nethang_queue_backlog_packets{path="9528",direction="uplink"} 1' in text
+        assert 'direction="downlink"' not in text
+        assert 'nethang_timeline_slot{path="9528"} 3' in text
+        assert '# EOF' not in text
+
+    def test_render_openmetrics(self, stats):
+        text = MetricsExporter().render(stats, {}, openmetrics=True)
+        assert '# TYPE nethang_ingress_bytes counter' in text
+        assert 'nethang_ingress_bytes_total{path="9528",direction="uplink"} 5000' in text
+        assert text.endswith('# EOF\n')
+
+    def test_cached_until_new_stats(self, stats):
+        exporter = MetricsExporter()
+        exporter.render(stats, {})
+        stats['9528']['trafficStats']['uplink']['ingress']['bytes'] = 6000
+        assert '} 5000' in exporter.render(stats, {})
+        assert '} 6000' in exporter.render(dict(stats), {})
+
+
+def test_metrics_endpoint(stats):
+    """Served from the stats of the monitor, of a stub manager: the real one would reset the paths"""
+    from nethang import routes
+    from nethang.control import Control
+    path = Mock()
+    path.slot_index.value = 3
+    manager = Mock(paths={9528: path})
+    manager.traffic_monitor.stats = stats
+    app.config['TESTING'] = True
+    with patch.object(routes, '_control', Control(manager)), app.test_client() as client:
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        assert b'nethang_timeline_slot{path="9528"} 3' in response.data
+        assert b'nethang_ingress_bytes_total{path="9528",direction="uplink"} 5000' in response.data
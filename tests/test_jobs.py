@@ -0,0 +1,209 @@
+"""
+Tests for nethang/jobs.py
+
+This module contains tests for the executor of the path operations.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import gc
+import fcntl
+import time
+import threading
+import yaml
+import pytest
+from unittest.mock import patch
+from nethang.jobs import JobExecutor
+from nethang.control import Control
+from nethang.simu_path import SimuPathManager, load_yaml
+
+
+class SlowKernel:
+    """Apply the operations slowly, recording their order"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.applied = []
+        self.lock = threading.Lock()
+
+    def run(self, operation, params):
+        time.sleep(self.delay)
+        if params.get('fail'):
+            raise ValueError('tc failed')
+        with self.lock:
+            self.applied.append((operation, params['id']))
+        return {'seed': params['id']}
+
+
+@pytest.fixture
+def kernel():
+    return SlowKernel()
+
+
+@pytest.fixture
+def executor(kernel):
+    completed = []
+    executor = JobExecutor(kernel.run, completed.append)
+    executor.completed = completed
+    yield executor
+    executor.shutdown()
+
+
+class TestJobExecutor:
+    """Test cases for the jobs"""
+
+    def test_submit_returns_at_once(self, executor):
+        start = time.perf_counter()
+        job = executor.submit('activate_path', {'id': 1})
+        assert time.perf_counter() - start < 0.05
+        assert job.status in ('queued', 'running')
+        assert job.done.wait(2)
+        assert job.status == 'succeeded'
+        assert job.result == {'seed': 1}
+        assert job.duration >= 0.05
+        assert executor.completed == [job]
+
+    def test_order_per_path(self, executor, kernel):
+        for operation in ('activate_path', 'deactivate_path', 'activate_path'):
+            job = executor.submit(operation, {'id': 1})
+        assert job.done.wait(2)
+        assert kernel.applied == [('activate_path', 1), ('deactivate_path', 1), ('activate_path', 1)]
+
+    def test_paths_run_concurrently(self, executor):
+        start = time.perf_counter()
+        submitted = [executor.submit('activate_path', {'id': id}) for id in range(4)]
+        assert all(job.done.wait(2) for job in submitted)
+        # The four paths were applied at the same time
+        assert time.perf_counter() - start < 0.18
+
+    def test_failure(self, executor):
+        job = executor.submit('activate_path', {'id': 1, 'fail': True})
+        assert job.done.wait(2)
+        assert job.status == 'failed'
+        assert job.error == 'tc failed'
+        assert executor.get(job.id).to_dict()['error'] == 'tc failed'
+
+    def test_invalid_operation(self, executor):
+        with pytest.raises(ValueError, match='Invalid job operation'):
+            executor.submit('save_config', {})
+
+    def test_forget_completed(self, executor):
+        with patch('nethang.jobs.MAX_COMPLETED_JOBS', 2):
+            submitted = [executor.submit('deactivate_path', {'id': 1}) for _ in range(4)]
+            assert submitted[-1].done.wait(2)
+        assert [job.id for job in executor.list()] == [job.id for job in submitted[-2:]]
+
+    def test_shutdown_cancels_queued(self, executor, kernel):
+        first = executor.submit('activate_path', {'id': 1})
+        queued = executor.submit('deactivate_path', {'id': 1})
+        while first.status == 'queued':
+            time.sleep(0.005)
+        executor.shutdown()
+        assert first.status == 'succeeded'
+        assert queued.status == 'cancelled'
+        with pytest.raises(RuntimeError):
+            executor.submit('activate_path', {'id': 1})
+
+
+class StubManager:
+    """The part of SimuPathManager used by the jobs"""
+
+    def __init__(self):
+        self.paths = {}
+
+    def activate_path(self, id, speed=1.0, cycles=None):
+        self.paths[id] = type('Path', (), {'markov_seed': 7})()
+
+    def deactivate_path(self, id):
+        self.paths.pop(id)
+
+
+def test_control_jobs():
+    """The jobs of Control send the 'job_completed' event with their duration"""
+    events = []
+    control = Control(StubManager())
+    with patch.object(SimuPathManager, 'event_sink', lambda event, data: events.append((event, data))):
+        submitted = control.submit_jobs(operations=[
+            {'operation': 'activate_path', 'params': {'id': '9528'}},
+            {'operation': 'deactivate_path', 'params': {'id': 9528}},
+        ])
+        assert control.jobs.get(submitted[1]['id']).done.wait(2)
+    control.close()
+    assert [event for event, _ in events] == ['job_completed', 'job_completed']
+    assert events[0][1]['id'] == submitted[0]['id']
+    assert events[0][1]['result'] == {'seed': 7}
+    assert events[1][1]['status'] == 'succeeded'
+    assert events[1][1]['duration'] is not None
+    assert control.get_job(id=submitted[1]['id'])['status'] == 'succeeded'
+    with pytest.raises(ValueError):
+        Control(StubManager()).submit_jobs(operations=[{'operation': 'run_matrix'}])
+
+
+def path_entry(id):
+    return {
+        'id': id,
+        'status': 'inactive',
+        'filter_settings': {'protocol': 'ip', 'lan_ip': f'10.0.0.{id - 9500}', 'lan_port': 'Any',
+                            'wan_ip': '', 'wan_port': 'Any', 'mark': id},
+        'simu_settings': {'mode': 'custom', 'model': '',
+                          'uplink': {'mode': 'bypass', 'restrict_settings': {}},
+                          'downlink': {'mode': 'bypass', 'restrict_settings': {}}},
+    }
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """A manager of its own, with the fake kernel backend and its files in tmp_path"""
+    (tmp_path / 'config.yaml').write_text(yaml.dump({'lan_interface': 'eth1', 'wan_interface': 'eth0', 'kernel_backend': 'fake'}))
+    (tmp_path / 'paths.yaml').write_text(yaml.dump([path_entry(id) for id in range(9528, 9540)]))
+    with patch('nethang.simu_path.CONFIG_PATH', str(tmp_path)), \
+            patch('nethang.simu_path.CONFIG_FILE', str(tmp_path / 'config.yaml')), \
+            patch('nethang.simu_path.PATHS_FILE', str(tmp_path / 'paths.yaml')), \
+            patch('nethang.simu_path.MODELS_FILE', str(tmp_path / 'models.yaml')), \
+            patch('nethang.simu_path.METRICS_PATH', str(tmp_path / 'metrics')), \
+            patch('nethang.simu_path.IPT_LOCK_FILE', str(tmp_path / 'ipt.lock')), \
+            patch('nethang.simu_path.ID_LOCK_FILE', str(tmp_path / 'id.lock')), \
+            patch.object(SimuPathManager, '_instance', None), \
+            patch.object(SimuPathManager, 'backend'), \
+            patch.object(SimuPathManager, 'writer'), \
+            patch.object(SimuPathManager, 'mark_range'), \
+            patch.object(SimuPathManager, 'event_sink', lambda event, data=None: None):
+        manager = SimuPathManager()
+        yield manager
+        manager.traffic_monitor.stop()
+        # Torn down with the fake backend, not by the garbage collector with the real one
+        manager.paths.clear()
+        gc.collect()
+        SimuPathManager.writer.close()
+
+
+def test_concurrent_jobs_real_manager(manager, tmp_path):
+    """Concurrent activations of different paths all end up active in paths.yaml"""
+    control = Control(manager)
+    submitted = control.submit_jobs(operations=[
+        {'operation': 'activate_path', 'params': {'id': id}} for id in range(9528, 9540)
+    ])
+    assert all(control.jobs.get(job['id']).done.wait(10) for job in submitted)
+    assert [control.get_job(id=job['id'])['status'] for job in submitted] == ['succeeded'] * 12
+    paths = load_yaml(str(tmp_path / 'paths.yaml'))
+    assert sorted(path['id'] for path in paths if path['status'] == 'active') == list(range(9528, 9540))
+    assert manager.traffic_monitor.running
+
+    submitted = control.submit_jobs(operations=[
+        {'operation': 'deactivate_path', 'params': {'id': id}} for id in range(9528, 9540)
+    ])
+    assert all(control.jobs.get(job['id']).done.wait(10) for job in submitted)
+    control.close()
+    assert [path['status'] for path in load_yaml(str(tmp_path / 'paths.yaml'))] == ['inactive'] * 12
+    assert not manager.traffic_monitor.running
+
+
+def test_paths_lock_shared_with_the_command_line(manager, tmp_path):
+    """The server holds the lock file of the command line while it writes paths.yaml"""
+    with open(tmp_path / 'id.lock', 'wb') as f:
+        with manager.paths_lock(), manager.paths_lock():
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,154 @@
+"""
+Tests for nethang/kernel_backend.py
+
+This module contains tests for the fake kernel backend.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import time
+import pytest
+from multiprocessing import Process
+from unittest.mock import patch
+from nethang.kernel_backend import FakeBackend, ShellBackend, create_backend
+from nethang.simu_path import SimuPath, SimuPathManager, SimuSettings, FilterSettings
+from nethang.traffic_monitor import TrafficMonitor
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = FakeBackend(load_kbps=8000)
+    with patch.object(SimuPathManager, 'backend', backend), \
+            patch.object(SimuPathManager, 'writer', None), \
+            patch.object(SimuPathManager, 'lan_ifname', 'eth1'), \
+            patch.object(SimuPathManager, 'wan_ifname', 'eth0'), \
+            patch('nethang.simu_path.IPT_LOCK_FILE', str(tmp_path / 'ipt.lock')):
+        yield backend
+
+
+def make_path():
+    return SimuPath(
+        filter_settings=FilterSettings(protocol='ip', lan_ip='10.0.0.2', lan_port='Any',
+                                       wan_ip='', wan_port='Any', mark=9528),
+        mode='custom',
+        model='',
+        status='inactive',
+        uplink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+        downlink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+    )
+
+
+def test_create_backend():
+    assert isinstance(create_backend('shell'), ShellBackend)
+    assert isinstance(create_backend('fake'), FakeBackend)
+    with pytest.raises(ValueError):
+        create_backend('unknown')
+
+
+def test_models_state(backend):
+    path = make_path()
+    path.create()
+    path._set_rule('uplink', 'add', {'rate_limit': 4000, 'throttle_type': 'on', 'loss': 10, 'loss_type': 'random'})
+
+    state = backend.get_state()
+    assert len(state['rules']) == 2
+    assert state['filters']['eth0'] == {'9528': '9527:9528'}
+    assert state['classes']['eth0']['9527:9528']['rate'] == 4000
+    assert state['qdiscs']['eth0']['9528']['loss'] == pytest.approx(0.1)
+
+    path.deactivate()
+    state = backend.get_state()
+    assert state['rules'] == []
+    assert '9528' not in state['qdiscs']['eth0']
+    assert backend.get_operations()['next'] > 0
+
+
+def test_counters_read_by_monitor(backend):
+    path = make_path()
+    path.create()
+    path._set_rule('uplink', 'add', {'rate_limit': 4000, 'throttle_type': 'on'})
+
+    monitor = TrafficMonitor(id_range=(9528, 9529), lan_iface='eth1', wan_iface='eth0', backend=backend)
+    monitor.stats = monitor._get_current_stats()
+    time.sleep(0.05)
+    uplink = monitor._get_current_stats()['9528']['trafficStats']['uplink']
+
+    assert uplink['ingress']['bitRate'] > 0
+    # Shaped at half of the offered load
+    assert uplink['egress']['bitRate'] < uplink['ingress']['bitRate']
+    assert uplink['queue']['dropPackets'] > 0
+    path.deactivate()
+
+
+def test_operations_of_child_processes(backend):
+    process = Process(target=SimuPathManager.run_cmd, args=('tc qdisc add dev eth0 root handle 9527: htb default 0xffff',))
+    process.start()
+    process.join()
+
+    for _ in range(100):
+        if '9527' in backend.get_state()['qdiscs'].get('eth0', {}):
+            break
+        time.sleep(0.01)
+    operations = backend.get_operations()['operations']
+    assert operations[-1]['pid'] == process.pid
+
+
+def test_bad_operation_logged(backend):
+    with patch('nethang.kernel_backend.logger') as logger:
+        os.write(backend.write_fd, b'not json\n')
+        process = Process(target=SimuPathManager.run_cmd, args=('tc qdisc add dev eth0 root handle 9527: htb default 0xffff',))
+        process.start()
+        process.join()
+        for _ in range(100):
+            if '9527' in backend.get_state()['qdiscs'].get('eth0', {}):
+                break
+            time.sleep(0.01)
+    assert '9527' in backend.get_state()['qdiscs']['eth0']
+    assert "b'not json'" in logger.error.call_args[0][0]
+
+
+def test_batch(backend):
+    path = make_path()
+    path.create()
+    path._set_rule('uplink', 'add', {'rate_limit': 4000, 'throttle_type': 'on'})
+    path._set_rule('downlink', 'add', {'rate_limit': 4000, 'throttle_type': 'on'})
+
+    batch = []
+    path._set_rule('uplink', 'change', {'rate_limit': 2000, 'throttle_type': 'on'}, batch)
+    path._set_rule('downlink', 'change', {'rate_limit': 1000, 'throttle_type': 'on'}, batch)
+    assert len(batch) == 4
+    count = backend.get_operations()['next']
+    SimuPathManager.run_batch(batch)
+
+    # One operation for the whole batch
+    assert backend.get_operations()['next'] == count + 1
+    state = backend.get_state()
+    assert state['classes']['eth0']['9527:9528']['rate'] == 2000
+    assert state['classes']['eth1']['9527:9528']['rate'] == 1000
+    path.deactivate()
+
+
+def test_shell_batch():
+    with patch('nethang.kernel_backend.subprocess.run') as run:
+        ShellBackend().run_batch(['tc class change dev eth0 x', 'tc qdisc change dev eth0 y'])
+    assert run.call_args.args[0] == ['tc', '-force', '-batch', '-']
+    assert run.call_args.kwargs['input'] == 'class change dev eth0 x\nqdisc change dev eth0 y\n'
+
+
+def test_frequent_reads_credit_packets(backend):
+    """The fractions of packet of each read add up"""
+    path = make_path()
+    path.create()
+    path._set_rule('uplink', 'add', {'rate_limit': 4000, 'throttle_type': 'on'})
+    backend.carried.clear()
+    start = backend.last_advance
+    before = [rule['packets'] for rule in backend.rules]
+    sent = backend.qdiscs['eth0']['9528']['counters']['packets']
+    # 1000 reads of 0.1 ms, 0.1 packet offered and 0.05 sent each
+    with patch('nethang.kernel_backend.time.monotonic', side_effect=[start + (i + 1) / 10000 for i in range(1000)]):
+        for _ in range(1000):
+            backend._advance()
+    assert [rule['packets'] - packets for rule, packets in zip(backend.rules, before)] == [100, 100]
+    assert backend.qdiscs['eth0']['9528']['counters']['packets'] - sent == 50
@@ -0,0 +1,150 @@
+"""
+Tests for nethang/kernel_writer.py
+
+This module contains tests for the single writer of the kernel commands.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import time
+import pytest
+from multiprocessing import Process
+from nethang.kernel_backend import FakeBackend
+from nethang.kernel_writer import KernelWriter, coalesce
+from nethang import kernel_writer
+
+CHANGE_1 = 'tc class change dev eth0 parent 9527: classid 9527:9528 htb rate 1000kbit'
+CHANGE_2 = 'tc class change dev eth0 parent 9527: classid 9527:9528 htb rate 2000kbit'
+ADD = 'tc qdisc add dev eth0 root handle 9527: htb default 0xffff'
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend()
+
+
+@pytest.fixture
+def writer(backend, tmp_path):
+    writer = KernelWriter(backend, str(tmp_path / 'ipt.lock'))
+    yield writer
+    writer.close()
+
+
+def commands(backend):
+    return [operation.get('batch', operation['cmd']) for operation in backend.get_operations()['operations']]
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestCoalesce:
+    """Test cases for the superseded commands"""
+
+    def test_change_superseded(self):
+        assert coalesce([CHANGE_1, CHANGE_2]) == [CHANGE_2]
+
+    def test_change_superseded_by_deletion(self):
+        delete = 'tc class del dev eth0 classid 9527:9528'
+        assert coalesce([CHANGE_1, delete]) == [delete]
+
+    def test_other_targets_kept(self):
+        other = CHANGE_2.replace('dev eth0', 'dev eth1')
+        qdisc = 'tc qdisc change dev eth0 parent 9527:9528 handle 9528: netem loss 1%'
+        assert coalesce([CHANGE_1, other, qdisc]) == [CHANGE_1, other, qdisc]
+
+    def test_barrier(self):
+        add = CHANGE_1.replace('change', 'add')
+        assert coalesce([CHANGE_1, add, CHANGE_2]) == [CHANGE_1, add, CHANGE_2]
+
+
+class TestKernelWriter:
+    """Test cases for the writer"""
+
+    def test_submit_waits(self, writer, backend):
+        writer.submit([ADD])
+        assert commands(backend) == [ADD]
+
+    def test_pending_batched(self, writer, backend):
+        coalesced = kernel_writer.coalesced_count.get()
+        # Hold the writer while the commands queue up
+        with writer.apply_lock:
+            writer.submit([ADD], wait=False)
+            # Let the writer take the first mutation and block on the lock
+            assert wait_for(lambda: not writer.pending)
+            writer.submit([CHANGE_1], wait=False)
+            writer.submit([CHANGE_2, 'iptables -t mangle -A FORWARD -j MARK --set-mark 9528'], wait=False)
+            assert kernel_writer.queue_depth.get() == 3
+        writer.flush()
+        # The first change superseded by the second one
+        assert commands(backend) == [ADD, CHANGE_2, 'iptables -t mangle -A FORWARD -j MARK --set-mark 9528']
+        assert kernel_writer.coalesced_count.get() == coalesced + 1
+        assert kernel_writer.queue_depth.get() == 0
+
+    def test_single_tc_batch(self, writer, backend):
+        with writer.apply_lock:
+            writer.submit([ADD], wait=False)
+            assert wait_for(lambda: not writer.pending)
+            writer.submit([CHANGE_1], wait=False)
+            writer.submit([CHANGE_1.replace('eth0', 'eth1')], wait=False)
+        writer.flush()
+        assert commands(backend) == [ADD, [CHANGE_1, CHANGE_1.replace('eth0', 'eth1')]]
+
+    def test_transaction(self, writer, backend):
+        with writer.transaction():
+            writer.submit([ADD])
+            writer.submit([CHANGE_1])
+            assert commands(backend) == []
+        assert commands(backend) == [[ADD, CHANGE_1]]
+
+    def test_child_process(self, writer, backend):
+        writer.source = 'path'
+        process = Process(target=writer.submit, args=([ADD],))
+        process.start()
+        process.join()
+        writer.source = None
+        assert wait_for(lambda: commands(backend) == [ADD])
+        # Applied by the writer, in the owner process
+        assert backend.get_operations()['operations'][0]['pid'] != process.pid
+
+    def test_retired_child(self, writer, backend):
+        writer.retire('path')
+        writer.source = 'path'
+        process = Process(target=writer.submit, args=([CHANGE_1],))
+        process.start()
+        process.join()
+        writer.source = None
+        writer.submit([ADD])
+        time.sleep(0.05)
+        assert commands(backend) == [ADD]
+
+    def test_child_transition_latency(self, writer, backend):
+        kernel_writer.transition_latency.reset()
+        writer.source = 'path'
+        process = Process(target=writer.submit, args=([ADD],))
+        process.start()
+        process.join()
+        writer.source = None
+        assert wait_for(lambda: commands(backend) == [ADD])
+        writer.flush()
+        # Recorded by the owner, once the commands are applied
+        assert kernel_writer.transition_latency.snapshot()['count'] == 1
+        writer.submit([CHANGE_1])
+        assert kernel_writer.transition_latency.snapshot()['count'] == 1
+
+    def test_retired_expired(self, writer, monkeypatch):
+        writer.retire('path-1')
+        monkeypatch.setattr(kernel_writer, 'RETIRED_TIMEOUT', 0)
+        writer.retire('path-2')
+        assert list(writer.retired) == ['path-2']
+
+    def test_closed(self, writer, backend):
+        writer.close()
+        writer.submit([ADD])
+        assert commands(backend) == [ADD]
@@ -0,0 +1,109 @@
+"""
+Tests for nethang/logs.py
+
+This module contains tests for the logging pipeline.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import logging
+import multiprocessing
+import pytest
+from nethang.logs import kv, LogFormatter, LogPipeline, RateLimitFilter
+
+
+def record(level=logging.INFO, lineno=1, msg='message'):
+    return logging.LogRecord('test', level, '/nethang/simu_path.py', lineno, msg, None, None)
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    """A pipeline of its own logger, writing to a file"""
+    logger = logging.getLogger('nethang.test_logs')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.FileHandler(tmp_path / 'test.log')
+    handler.setFormatter(LogFormatter('%(levelname)s: %(message)s'))
+    pipeline = LogPipeline(logger, [handler])
+    pipeline.file = tmp_path / 'test.log'
+    yield pipeline
+    pipeline.stop()
+    logger.removeHandler(pipeline.handler)
+    handler.close()
+
+
+class TestStructuredMessage:
+    """Test cases for the structured records"""
+
+    def test_format(self):
+        message = kv('set_rule', path=9528, direction='uplink', config={'delay': 100})
+        assert str(message) == 'set_rule path=9528 direction=uplink config={"delay":100}'
+
+    def test_lazy(self, pipeline):
+        calls = []
+        pipeline.logger.debug(kv('merged_model', model=lambda: calls.append(1)))
+        pipeline.stop()
+        # The level is disabled, the field is never formatted
+        assert calls == []
+        assert pipeline.file.read_text() == ''
+
+
+class TestRateLimitFilter:
+    """Test cases for the rate limit per call site"""
+
+    def test_burst_then_suppressed(self):
+        limit = RateLimitFilter(rate=0.001, burst=3)
+        assert [limit.filter(record()) for _ in range(5)] == [True, True, True, False, False]
+        # Another call site has its own burst
+        assert limit.filter(record(lineno=2))
+
+    def test_suppressed_count_appended(self):
+        limit = RateLimitFilter(rate=1000, burst=1)
+        limit.filter(record())
+        limit.filter(record())
+        limit.sites[('/nethang/simu_path.py', 1)][0] = 1
+        kept = record()
+        assert limit.filter(kept)
+        assert LogFormatter('%(message)s').format(kept) == 'message [suppressed 1]'
+
+    def test_warnings_never_dropped(self):
+        limit = RateLimitFilter(rate=0.001, burst=1)
+        assert all(limit.filter(record(level=logging.WARNING)) for _ in range(10))
+
+    def test_no_limit(self):
+        limit = RateLimitFilter()
+        limit.configure(0, 1)
+        assert all(limit.filter(record()) for _ in range(100))
+
+
+class TestLogPipeline:
+    """Test cases for the queue and its listener"""
+
+    def test_written_by_listener(self, pipeline):
+        pipeline.logger.info(kv('apply_tc', path=9528, netem='delay 100ms'))
+        pipeline.logger.warning('Could not create log file')
+        pipeline.stop()
+        assert pipeline.file.read_text().splitlines() == [
+            'INFO: apply_tc path=9528 netem=delay 100ms',
+            'WARNING: Could not create log file',
+        ]
+
+    def test_rate_limited(self, pipeline):
+        pipeline.rate_limit.configure(0.001, 2)
+        for index in range(10):
+            pipeline.logger.info('sample %d', index)
+        pipeline.stop()
+        assert pipeline.file.read_text().splitlines() == ['INFO: sample 0', 'INFO: sample 1']
+
+    def test_forked_process(self, pipeline):
+        def child():
+            for index in range(5):
+                pipeline.logger.warning('child %d', index)
+
+        # Ended with os._exit(), without atexit
+        process = multiprocessing.get_context('fork').Process(target=child)
+        process.start()
+        process.join()
+        pipeline.stop()
+        assert pipeline.file.read_text().splitlines() == [f'WARNING: child {index}' for index in range(5)]
@@ -0,0 +1,86 @@
+"""
+Tests for nethang/markov.py
+
+This module contains tests for the procedural Markov models.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import pytest
+from itertools import islice
+from nethang.markov import MarkovModel
+
+
+@pytest.fixture
+def spec():
+    return {
+        'states': {
+            'good': {
+                'dwell': {'distribution': 'exponential', 'mean': 10, 'min': 2},
+                'transitions': {'handover': 0.7, 'fade': 0.3},
+            },
+            'handover': {
+                'uplink': {'loss': 10},
+                'dwell': {'distribution': 'uniform', 'min': 0.5, 'max': 2},
+                'transitions': {'good': 1},
+            },
+            'fade': {
+                'downlink': {'rate_limit': 500},
+                'dwell': 3,
+                'transitions': {'good': 0.5, 'fade': 0, 'handover': 0.5},
+            },
+        }
+    }
+
+
+class TestMarkovModel:
+    """Test cases for MarkovModel"""
+
+    def test_reproducible_from_seed(self, spec):
+        first = list(islice(MarkovModel(spec, seed=7).timeslots(), 50))
+        second = list(islice(MarkovModel(spec, seed=7).timeslots(), 50))
+        other = list(islice(MarkovModel(spec, seed=8).timeslots(), 50))
+        assert first == second
+        assert first != other
+
+    def test_seed_of_the_spec(self, spec):
+        assert MarkovModel(dict(spec, seed=3)).seed == 3
+        assert MarkovModel(dict(spec, seed=3), seed=4).seed == 4
+        assert isinstance(MarkovModel(spec).seed, int)
+
+    def test_transitions_and_dwell_times(self, spec):
+        timeslots = list(islice(MarkovModel(spec, seed=1).timeslots(), 500))
+        states = [index for index, _ in timeslots]
+        assert states[0] == 0
+        for previous, current in zip(states, states[1:]):
+            # handover only goes back to good, fade never loops on itself
+            if previous == 1:
+                assert current == 0
+            if previous == 2:
+                assert current != 2
+        for index, timeslot in timeslots:
+            if index == 0:
+                assert timeslot['duration'] >= 2
+            elif index == 1:
+                assert 0.5 <= timeslot['duration'] <= 2
+                assert timeslot['uplink'] == {'loss': 10}
+            else:
+                assert timeslot['duration'] == 3
+                assert timeslot['downlink'] == {'rate_limit': 500}
+
+    def test_absorbing_state(self):
+        spec = {'states': {'start': {'dwell': 1, 'transitions': {'end': 1}}, 'end': {'dwell': 1}}}
+        assert [index for index, _ in islice(MarkovModel(spec, seed=0).timeslots(), 4)] == [0, 1, 1, 1]
+
+    @pytest.mark.parametrize('states', [
+        {},
+        {'a': {'transitions': {'a': 1}}},
+        {'a': {'dwell': {'distribution': 'pareto', 'alpha': 1}}},
+        {'a': {'dwell': {'distribution': 'uniform', 'min': 1}}},
+        {'a': {'dwell': 1, 'transitions': {'b': 1}}},
+        {'a': {'dwell': 1, 'transitions': {'a': -1}}},
+    ])
+    def test_invalid_spec(self, states):
+        with pytest.raises(ValueError):
+            MarkovModel({'states': states})
@@ -0,0 +1,196 @@
+"""
+Tests for nethang/matrix.py
+
+This module contains tests for the scenario matrix runner.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import threading
+import yaml
+import pytest
+from unittest.mock import Mock, patch
+from nethang.matrix import MatrixRunner, summarize_metrics, prune_matrices, MAX_FINISHED_MATRICES
+from nethang.metrics_store import FIELDS
+
+
+class StubPath:
+    def __init__(self):
+        self.status = 'inactive'
+
+    def is_active(self):
+        return self.status == 'active'
+
+
+class StubMetricsStore:
+    def query(self, path_id, start, end):
+        series = {'timestamps': [start, end]}
+        for field in FIELDS:
+            series[field] = {'min': [1.0, 2.0], 'max': [3.0, 4.0], 'avg': [2.0, 3.0]}
+        return {'uplink': {'level': 'raw', 'resolution': 0, 'series': series}}
+
+
+class StubManager:
+    """The part of SimuPathManager used by the runner, paths.yaml included"""
+    mark_range = (9528, 9529)
+
+    def __init__(self, paths_file):
+        self.paths_file = paths_file
+        self.models = {'A': {}, 'B': {}, 'C': {}}
+        self.paths = {}
+        self.metrics_store = StubMetricsStore()
+        self.active_filters = []
+        self.max_active = 0
+        self.lock = threading.RLock()
+
+    def paths_lock(self):
+        return self.lock
+
+    def _save(self):
+        with open(self.paths_file, 'w') as f:
+            yaml.dump([{'id': id} for id in self.paths], f)
+
+    def add_path(self, path):
+        self.paths[path['id']] = StubPath()
+        self.paths[path['id']].filter = path['filter_settings']['lan_ip']
+        self._save()
+
+    def delete_path(self, id):
+        del self.paths[id]
+        self._save()
+
+    def activate_path(self, id, speed=1.0, cycles=None):
+        path = self.paths[id]
+        assert path.filter not in self.active_filters
+        path.status = 'active'
+        self.active_filters.append(path.filter)
+        self.max_active = max(self.max_active, len(self.active_filters))
+
+    def deactivate_path(self, id):
+        self.paths[id].status = 'inactive'
+        self.active_filters.remove(self.paths[id].filter)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    paths_file = str(tmp_path / 'paths.yaml')
+    with patch('nethang.matrix.PATHS_FILE', paths_file), \
+            patch('nethang.matrix.POLL_INTERVAL', 0.005):
+        yield StubManager(paths_file)
+
+
+class TestMatrixRunner:
+    """Test cases for MatrixRunner"""
+
+    def test_combinations(self, manager):
+        matrix = MatrixRunner(manager, {'models': 'all', 'filters': [{'lan_ip': '10.0.0.1'}, {'lan_ip': '10.0.0.2'}],
+                                        'duration': 10})
+        assert [(run['model'], run['filter']['lan_ip']) for run in matrix.runs] == [
+            ('A', '10.0.0.1'), ('A', '10.0.0.2'), ('B', '10.0.0.1'), ('B', '10.0.0.2'), ('C', '10.0.0.1'), ('C', '10.0.0.2')]
+        assert matrix.runs[0]['filter']['wan_port'] == 'Any'
+
+    @pytest.mark.parametrize('spec', [
+        {'duration': 10},
+        {'models': ['A', 'missing'], 'duration': 10},
+        {'models': ['A']},
+        {'models': ['A'], 'duration': -1},
+        {'models': ['A'], 'filters': 'all', 'duration': 10},
+        {'models': ['A'], 'duration': 10, 'speed': 0},
+    ])
+    def test_invalid_matrix(self, manager, spec):
+        with pytest.raises(ValueError):
+            MatrixRunner(manager, spec)
+
+    def test_runs_on_the_free_marks(self, manager):
+        # 6 runs, 3 filters, 2 marks
+        spec = {'models': ['A', 'B'], 'filters': [{'lan_ip': f'10.0.0.{i}'} for i in range(3)], 'duration': 0.02}
+        matrix = MatrixRunner(manager, spec)
+        matrix.start()
+        matrix.thread.join(5)
+
+        report = matrix.report()
+        assert report['state'] == 'done'
+        assert report['counts']['done'] == 6
+        assert manager.max_active == 2
+        assert manager.paths == {}
+        assert report['runs'][0]['metrics']['uplink']['bitRateOut'] == {'min': 1.0, 'max': 4.0, 'avg': 2.5}
+
+    def test_runs_of_a_filter_do_not_overlap(self, manager):
+        matrix = MatrixRunner(manager, {'models': ['A', 'B', 'C'], 'duration': 0.01})
+        matrix.start()
+        matrix.thread.join(5)
+        # The stub checks each activation, one run at a time since a single filter
+        assert manager.max_active == 1
+        assert matrix.report()['counts']['done'] == 3
+
+    def test_cancel(self, manager):
+        matrix = MatrixRunner(manager, {'models': ['A', 'B'], 'duration': 60})
+        matrix.start()
+        matrix.cancel()
+        report = matrix.report()
+        assert report['state'] == 'cancelled'
+        assert report['counts']['cancelled'] == 2
+        assert manager.paths == {} and manager.active_filters == []
+
+    def test_failed_run_does_not_stop_the_matrix(self, manager):
+        matrix = MatrixRunner(manager, {'models': ['A', 'B', 'C'], 'duration': 0.01})
+
+        def is_over(run):
+            if run['model'] == 'B':
+                raise KeyError(run['path_id'])
+            return True
+
+        with patch.object(matrix, '_is_over', side_effect=is_over):
+            matrix.start()
+            matrix.thread.join(5)
+        report = matrix.report()
+        assert report['state'] == 'done'
+        assert [run['status'] for run in report['runs']] == ['done', 'failed', 'done']
+        assert manager.paths == {}
+
+    def test_loop_failure(self, manager):
+        matrix = MatrixRunner(manager, {'models': ['A', 'B'], 'duration': 60})
+        with patch.object(matrix, '_launch', side_effect=RuntimeError('broken')):
+            matrix.start()
+            matrix.thread.join(5)
+        report = matrix.report()
+        assert report['state'] == 'failed'
+        assert report['error'] == 'broken'
+        assert report['counts']['cancelled'] == 2
+
+    def test_finished_matrices_pruned(self, manager):
+        matrices = {}
+        for index in range(MAX_FINISHED_MATRICES + 5):
+            matrix = MatrixRunner(manager, {'models': ['A'], 'duration': 1})
+            matrix.state = 'running' if index == 0 else 'done'
+            matrices[matrix.id] = matrix
+        ids = list(matrices)
+        prune_matrices(matrices)
+        # The running one is kept, the oldest finished ones dropped
+        assert list(matrices) == [ids[0]] + ids[-MAX_FINISHED_MATRICES:]
+
+
+def test_summarize_empty_history():
+    series = {'timestamps': []}
+    for field in FIELDS:
+        series[field] = {'min': [], 'max': [], 'avg': []}
+    assert summarize_metrics({'downlink': {'series': series}}) == {'downlink': {'samples': 0}}
+
+
+def test_main_stops_on_failed(tmp_path, capsys):
+    """The command line stops polling a failed matrix, and fails"""
+    from nethang import matrix
+    spec_file = tmp_path / 'matrix.yaml'
+    spec_file.write_text('models: [A]\nduration: 1\n')
+    report = {'id': 'm1', 'state': 'failed', 'error': 'broken', 'runs': []}
+    session = Mock()
+    session.post.return_value.json.return_value = {'status': 'success', 'id': 'm1'}
+    session.get.return_value.json.return_value = {'report': report}
+    with patch('requests.Session', return_value=session), \
+            patch('sys.argv', ['matrix', str(spec_file)]), \
+            pytest.raises(SystemExit) as exit_:
+        matrix.main()
+    assert exit_.value.code == 1
+    assert session.get.call_count == 1
+    assert 'Error: broken' in capsys.readouterr().out
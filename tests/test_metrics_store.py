@@ -0,0 +1,145 @@
+"""
+Tests for nethang/metrics_store.py
+
+This module contains tests for the on-disk metrics history.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import struct
+import pytest
+from unittest.mock import patch
+from nethang.metrics_store import MetricsStore, RingFile, FIELDS
+from nethang.routes import parse_metrics_query
+
+
+def values(value):
+    return [float(value)] * len(FIELDS)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetricsStore(str(tmp_path))
+    yield store
+    store.close()
+
+
+class TestRingFile:
+    """Test cases for RingFile"""
+
+    def test_wrap_around_keeps_latest(self, tmp_path):
+        ring = RingFile(str(tmp_path / 'test.ring'), struct.Struct('<df'), 4)
+        for t in range(10):
+            ring.append(float(t), float(t * 10))
+        assert len(ring) == 4
+        assert ring.oldest() == 6.0
+        assert ring.read(0, 100) == [(6.0, 60.0), (7.0, 70.0), (8.0, 80.0), (9.0, 90.0)]
+        assert ring.read(7, 9) == [(7.0, 70.0), (8.0, 80.0)]
+        ring.close()
+
+    def test_reopen_persists(self, tmp_path):
+        ring = RingFile(str(tmp_path / 'test.ring'), struct.Struct('<df'), 4)
+        ring.append(1.0, 2.0)
+        ring.close()
+        ring = RingFile(str(tmp_path / 'test.ring'), struct.Struct('<df'), 4)
+        assert ring.read(0, 10) == [(1.0, 2.0)]
+        ring.close()
+
+
+class TestMetricsStore:
+    """Test cases for MetricsStore"""
+
+    def test_raw_query(self, store):
+        for t in range(100, 110):
+            store.append(9528, 'uplink', float(t), values(t))
+        result = store.query(9528, 100, 105)
+        assert list(result.keys()) == ['uplink']
+        assert result['uplink']['level'] == 'raw'
+        assert result['uplink']['series']['timestamps'] == [100.0, 101.0, 102.0, 103.0, 104.0]
+        assert result['uplink']['series']['bitRateIn']['avg'] == [100.0, 101.0, 102.0, 103.0, 104.0]
+
+    def test_fast_samples_averaged(self, store):
+        # 10 samples per second, one raw record per second
+        for i in range(30):
+            store.append(9528, 'uplink', 100 + i / 10, values(i))
+        result = store.query(9528, 100, 103)['uplink']
+        assert result['series']['timestamps'] == [100.0, 101.0, 102.0]
+        assert result['series']['bitRateIn']['avg'] == [4.5, 14.5, 24.5]
+
+    def test_rollups(self, store):
+        for t in range(0, 35):
+            store.append(9528, 'downlink', float(t), values(t))
+        result = store.query(9528, 0, 100, step=10)['downlink']
+        assert result['level'] == '10s'
+        series = result['series']
+        # The last bucket is still being accumulated
+        assert series['timestamps'] == [0.0, 10.0, 20.0]
+        assert series['dropRate']['min'] == [0.0, 10.0, 20.0]
+        assert series['dropRate']['max'] == [9.0, 19.0, 29.0]
+        assert series['dropRate']['avg'] == [4.5, 14.5, 24.5]
+
+    def test_step_aggregation(self, store):
+        for t in range(0, 10):
+            store.append(9528, 'uplink', float(t), values(t))
+        series = store.query(9528, 0, 10, step=5)['uplink']['series']
+        assert series['timestamps'] == [0.0, 5.0]
+        assert series['queuePackets']['avg'] == [2.0, 7.0]
+        assert series['queuePackets']['max'] == [4.0, 9.0]
+
+    def test_range_before_history(self, store):
+        # 30 minutes of history queried over an hour, read from the raw samples
+        for t in range(3600, 5400):
+            store.append(9528, 'uplink', float(t), values(t))
+        result = store.query(9528, 1800, 5400)['uplink']
+        assert result['level'] == 'raw'
+        assert len(result['series']['timestamps']) == 1800
+
+    def test_step_beyond_raw_retention(self, store):
+        with patch('nethang.metrics_store.LEVELS', (('raw', 0, 100), ('10s', 10, 100), ('1m', 60, 100))):
+            store = MetricsStore(store.base_dir + '/short')
+            for t in range(0, 500):
+                store.append(9528, 'uplink', float(t), values(t))
+            # The raw samples of the range are gone, not its 10s rollups
+            result = store.query(9528, 0, 100, step=5)['uplink']
+            store.close()
+        assert result['level'] == '10s'
+        assert result['series']['timestamps'] == [float(t) for t in range(0, 100, 10)]
+
+    def test_points_minmax(self, store):
+        for t in range(0, 1000):
+            store.append(9528, 'uplink', float(t), values(t % 100))
+        result = store.query(9528, 0, 1000, points=10)['uplink']
+        assert result['downsampled'] == 'minmax'
+        series = result['series']
+        assert series['timestamps'] == [float(t) for t in range(0, 1000, 100)]
+        assert series['bitRateIn']['min'] == [0.0] * 10
+        assert series['bitRateIn']['max'] == [99.0] * 10
+
+    def test_points_lttb(self, store):
+        for t in range(0, 1000):
+            store.append(9528, 'uplink', float(t), values(500 if t == 321 else 0))
+        series = store.query(9528, 0, 1000, points=20, method='lttb')['uplink']['series']
+        assert len(series['bitRateIn']['timestamps']) == 20
+        # The spike is kept
+        assert 321.0 in series['bitRateIn']['timestamps']
+        assert max(series['bitRateIn']['avg']) == 500.0
+
+    def test_points_window_beyond_history(self, store):
+        # A run of 30 minutes shown over the default window of an hour
+        for t in range(3600, 5400):
+            store.append(9528, 'uplink', float(t), values(t % 100))
+        query = parse_metrics_query({'to': 5400, 'points': 450})
+        result = store.query(9528, **query)['uplink']
+        # Buckets of 8 s from the raw samples, in the recorded half of the window
+        assert result['level'] == 'raw'
+        assert result['downsampled'] == 'minmax'
+        assert result['series']['timestamps'] == [float(t) for t in range(3600, 5400, 8)]
+        assert result['series']['bitRateIn']['min'][:2] == [0.0, 8.0]
+
+    def test_points_not_needed(self, store):
+        for t in range(0, 10):
+            store.append(9528, 'uplink', float(t), values(t))
+        result = store.query(9528, 0, 10, points=100)['uplink']
+        assert result['downsampled'] is None
+        assert len(result['series']['timestamps']) == 10
@@ -0,0 +1,83 @@
+"""
+Tests for nethang/perf.py
+
+This module contains tests for the latency histograms of the performance
+instrumentation.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import pytest
+from nethang.perf import PerfRegistry, LatencyHistogram, bucket_index, bucket_bounds, BUCKETS
+
+
+class TestBuckets:
+    """Test cases for the log-linear buckets"""
+
+    @pytest.mark.parametrize('value', [0, 1, 15, 16, 17, 100, 1000, 123456, 10 ** 9])
+    def test_value_within_bounds(self, value):
+        lowest, highest = bucket_bounds(bucket_index(value))
+        assert lowest <= value <= highest
+        # Relative error below 12.5%
+        assert highest - lowest <= max(1, value // 8)
+
+    def test_index_capped(self):
+        assert bucket_index(10 ** 15) == BUCKETS - 1
+
+
+class TestLatencyHistogram:
+    """Test cases for LatencyHistogram"""
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram('test')
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+        snapshot = histogram.snapshot()
+        assert snapshot['count'] == 100
+        assert snapshot['max'] == pytest.approx(0.1)
+        assert snapshot['p50'] == pytest.approx(0.050, rel=0.125)
+        assert snapshot['p99'] == pytest.approx(0.099, rel=0.125)
+
+    def test_empty(self):
+        assert LatencyHistogram('test').snapshot()['p50'] == 0.0
+
+
+class TestPerfRegistry:
+    """Test cases for PerfRegistry"""
+
+    def test_timed_and_render(self):
+        registry = PerfRegistry()
+
+        @registry.timed('op')
+        def op():
+            return 42
+
+        assert op() == 42
+        registry.counter('events').inc(3)
+        snapshot = registry.snapshot()
+        assert snapshot['histograms']['op']['count'] == 1
+        assert snapshot['counters']['events'] == 3
+
+        lines = registry.render_prometheus()
+        assert 'nethang_perf_latency_seconds_count{op="op"} 1' in lines
+        assert 'nethang_perf_events_total{event="events"} 3' in lines
+
+        registry.reset()
+        assert registry.snapshot()['histograms']['op']['count'] == 0
+
+    def test_gauge(self):
+        registry = PerfRegistry()
+        gauge = registry.gauge('queue')
+        gauge.set(5)
+        gauge.set(2)
+        assert registry.snapshot()['gauges']['queue'] == {'value': 2, 'peak': 5}
+        assert 'nethang_perf_level{level="queue"} 2' in registry.render_prometheus()
+        registry.reset()
+        assert registry.snapshot()['gauges']['queue'] == {'value': 2, 'peak': 2}
+
+    def test_disabled(self):
+        registry = PerfRegistry()
+        registry.enabled = False
+        registry.timed('op')(lambda: None)()
+        assert registry.snapshot()['histograms']['op']['count'] == 0
@@ -0,0 +1,99 @@
+"""
+Tests for nethang/ramp.py
+
+This module contains tests for the ramps between timeslots.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import pytest
+from unittest.mock import patch
+from nethang.ramp import parse_ramp, interpolate, ramp_fractions
+from nethang.simu_path import SimuPath, SimuPathManager, SimuSettings, FilterSettings
+
+MAX_RATE = SimuPathManager.MAX_RATE
+
+
+class TestRamp:
+    """Test cases for the ramp interpolation"""
+
+    def test_parse_ramp(self):
+        assert parse_ramp(None) is None
+        assert parse_ramp(0) is None
+        assert parse_ramp(500) == {'duration': 0.5, 'shape': 'linear'}
+        assert parse_ramp({'duration': 2000, 'shape': 'exponential'}) == {'duration': 2.0, 'shape': 'exponential'}
+
+    @pytest.mark.parametrize('ramp', [{'shape': 'linear'}, {'duration': -1}, {'duration': 100, 'shape': 'cubic'}, 'fast'])
+    def test_invalid_ramp(self, ramp):
+        with pytest.raises(ValueError):
+            parse_ramp(ramp)
+
+    def test_linear(self):
+        start = {'rate_limit': 1000, 'throttle_type': 'on', 'delay': 10, 'latency_type': 'constant'}
+        end = {'rate_limit': 3000, 'throttle_type': 'on', 'delay': 30, 'latency_type': 'constant', 'qdepth': 50}
+        step = interpolate(start, end, 0.5, 'linear', MAX_RATE)
+        assert step == {'rate_limit': 2000, 'throttle_type': 'on', 'delay': 20, 'latency_type': 'constant', 'qdepth': 50}
+        assert interpolate(start, end, 1.0, 'linear', MAX_RATE) == end
+
+    def test_exponential(self):
+        start = {'rate_limit': 10000, 'throttle_type': 'on'}
+        end = {'rate_limit': 100, 'throttle_type': 'on', 'loss': 4, 'loss_type': 'random'}
+        step = interpolate(start, end, 0.5, 'exponential', MAX_RATE)
+        assert step['rate_limit'] == 1000
+        # No geometric mean with a null end, the loss falls back to linear
+        assert step['loss'] == 2
+
+    def test_turned_off_at_the_end(self):
+        start = {'rate_limit': 1000, 'throttle_type': 'on'}
+        end = {'throttle_type': 'off'}
+        step = interpolate(start, end, 0.5, 'linear', MAX_RATE)
+        assert step == {'rate_limit': int(round((1000 + MAX_RATE) / 2)), 'throttle_type': 'on'}
+        assert interpolate(start, end, 1.0, 'linear', MAX_RATE)['throttle_type'] == 'off'
+
+    def test_fractions(self):
+        assert list(ramp_fractions(0.5, 10)) == [(0.1, 0.2), (0.2, 0.4), (0.3, 0.6), (0.4, 0.8), (0.5, 1.0)]
+        assert list(ramp_fractions(0.01, 10)) == [(0.01, 1.0)]
+
+
+class TestRunRamp:
+    """Test cases for the ramps of the timeline runner"""
+
+    @pytest.fixture
+    def path(self):
+        with patch.object(SimuPathManager, 'run_cmd'):
+            path = SimuPath(
+                filter_settings=FilterSettings(protocol='ip', lan_ip='', lan_port='Any', wan_ip='', wan_port='Any', mark=9528),
+                mode='model',
+                model='',
+                status='inactive',
+                uplink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+                downlink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+            )
+            yield path
+            del path
+
+    def test_steps_batched(self, path):
+        timeslots = [
+            {'duration': 0, 'uplink': {'delay': 0}, 'downlink': {'delay': 0}},
+            {'duration': 0.05, 'ramp': {'duration': 40}, 'uplink': {'delay': 40}, 'downlink': {'delay': 80}},
+        ]
+        global_ = {'uplink': {'latency_type': 'constant'}, 'downlink': {'latency_type': 'constant'}}
+        with patch.object(SimuPathManager, 'ramp_update_rate', 100), \
+                patch.object(SimuPath, '_init_tc'), patch.object(SimuPath, '_cleanup'), \
+                patch.object(SimuPathManager, 'run_batch') as run_batch:
+            path._run_timeline(global_, enumerate(timeslots))
+
+        # Four steps of both directions, two commands each
+        batches = [call.args[0] for call in run_batch.call_args_list]
+        assert len(batches) == 4
+        assert all(len(batch) == 4 for batch in batches)
+        assert 'delay 10ms' in batches[0][1] and 'delay 20ms' in batches[0][3]
+        assert 'delay 40ms' in batches[-1][1] and 'delay 80ms' in batches[-1][3]
+
+    def test_no_ramp_on_first_timeslot(self, path):
+        timeslots = [{'duration': 0, 'ramp': 1000, 'uplink': {'delay': 10}, 'downlink': {}}]
+        with patch.object(SimuPath, '_set_rule') as set_rule, patch.object(SimuPath, '_run_ramp') as run_ramp:
+            path._run_timeline({'uplink': {}, 'downlink': {}}, enumerate(timeslots))
+        run_ramp.assert_not_called()
+        assert set_rule.call_count == 2
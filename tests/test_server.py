@@ -0,0 +1,222 @@
+"""
+Tests for nethang/server.py
+
+This module contains tests for the async mode selection and the per-client
+queues of the Socket.IO events.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import time
+import threading
+import pytest
+from unittest.mock import patch
+from nethang import server
+from nethang.server import Broadcaster
+
+
+class FakeEngineIO:
+    def create_event(self):
+        return threading.Event()
+
+
+class FakeServer:
+    def __init__(self):
+        self.eio = FakeEngineIO()
+        self.disconnected = []
+
+    def disconnect(self, sid, namespace=None):
+        self.disconnected.append(sid)
+
+
+class FakeSocketIO:
+    """The part of SocketIO used by the broadcaster, keeping the acknowledgments"""
+
+    def __init__(self):
+        self.server = FakeServer()
+        self.sent = []
+        self.callbacks = {}
+
+    def start_background_task(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def emit(self, event, *args, to=None, callback=None):
+        self.sent.append((to, event, args[0] if args else None))
+        self.callbacks[to] = callback
+
+    def ack(self, sid):
+        self.callbacks.pop(sid)()
+
+    def received(self, sid):
+        return [(event, data) for to, event, data in self.sent if to == sid]
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def socketio():
+    return FakeSocketIO()
+
+
+@pytest.fixture
+def broadcaster(socketio):
+    broadcaster = Broadcaster(socketio, ack_timeout=0.3, max_pending=3)
+    broadcaster.start()
+    yield broadcaster
+    broadcaster.stop()
+
+
+class TestAsyncMode:
+    """Test cases for the async mode selection"""
+
+    def test_environment(self):
+        with patch.dict(os.environ, {'NETHANG_ASYNC_MODE': 'gevent'}):
+            assert server.select_async_mode() == 'gevent'
+
+    def test_invalid(self):
+        with patch.dict(os.environ, {'NETHANG_ASYNC_MODE': 'asyncio'}):
+            with pytest.raises(ValueError):
+                server.select_async_mode()
+
+    def test_auto(self, tmp_path):
+        with patch.dict(os.environ, {'NETHANG_ASYNC_MODE': ''}), \
+                patch('nethang.server.CONFIG_FILE', str(tmp_path / 'config.yaml')):
+            with patch('importlib.util.find_spec', side_effect=lambda name: name == 'gevent' or None):
+                assert server.select_async_mode() == 'gevent'
+            with patch('importlib.util.find_spec', return_value=None):
+                assert server.select_async_mode() == 'threading'
+
+    def test_config(self, tmp_path):
+        config_file = tmp_path / 'config.yaml'
+        config_file.write_text('async_mode: threading\n')
+        with patch.dict(os.environ, {'NETHANG_ASYNC_MODE': ''}), \
+                patch('nethang.server.CONFIG_FILE', str(config_file)):
+            assert server.select_async_mode() == 'threading'
+
+
+class TestBroadcaster:
+    """Test cases for the per-client queues"""
+
+    def test_one_event_in_flight(self, socketio, broadcaster):
+        broadcaster.connect('a')
+        broadcaster.publish('config_updated')
+        broadcaster.publish('path_changed', {'id': 1})
+        assert wait_for(lambda: socketio.received('a'))
+        time.sleep(0.05)
+        assert socketio.received('a') == [('config_updated', None)]
+        socketio.ack('a')
+        assert wait_for(lambda: len(socketio.received('a')) == 2)
+        assert socketio.received('a')[1] == ('path_changed', {'id': 1})
+
+    def test_chart_updates_coalesced(self, socketio, broadcaster):
+        broadcaster.connect('a')
+        broadcaster.publish('update_chart', {'tick': 0})
+        assert wait_for(lambda: socketio.received('a'))
+        for tick in range(1, 10):
+            broadcaster.publish('update_chart', {'tick': tick})
+        socketio.ack('a')
+        assert wait_for(lambda: len(socketio.received('a')) == 2)
+        # Only the latest snapshot is sent after the first one
+        assert socketio.received('a') == [('update_chart', {'tick': 0}), ('update_chart', {'tick': 9})]
+
+    def test_slow_client_dropped(self, socketio, broadcaster):
+        broadcaster.connect('slow')
+        broadcaster.connect('fast')
+        for tick in range(5):
+            broadcaster.publish('update_chart', {'tick': tick})
+            assert wait_for(lambda: 'fast' in socketio.callbacks)
+            socketio.ack('fast')
+            time.sleep(0.1)
+        # The slow client never acknowledged its first event
+        assert wait_for(lambda: socketio.server.disconnected == ['slow'])
+        assert 'slow' not in broadcaster.clients
+        assert len(socketio.received('fast')) == 5
+
+    def test_overflow_dropped(self, socketio, broadcaster):
+        broadcaster.connect('a')
+        for index in range(5):
+            broadcaster.publish('path_changed', {'id': index})
+        assert wait_for(lambda: socketio.server.disconnected == ['a'])
+
+    def test_publish_does_not_wait(self, socketio, broadcaster):
+        for index in range(100):
+            broadcaster.connect(str(index))
+        start = time.perf_counter()
+        broadcaster.publish('update_chart', {'data': list(range(1000))})
+        assert time.perf_counter() - start < 0.1
+
+    def test_disconnect(self, socketio, broadcaster):
+        broadcaster.connect('a')
+        broadcaster.disconnect('a')
+        broadcaster.publish('config_updated')
+        time.sleep(0.05)
+        assert socketio.sent == []
+
+
+def test_server_sends_initial_chart():
+    """A client of the app gets the chart, then is dropped since the test client never acknowledges"""
+    from nethang import create_app, routes
+    from nethang.extensions import socketio
+    app = create_app()
+    broadcaster = Broadcaster(socketio, ack_timeout=0.2)
+    broadcaster.start()
+    with patch.object(routes, 'broadcaster', broadcaster):
+        client = socketio.test_client(app)
+        assert wait_for(lambda: client.get_received())
+        broadcaster.publish('update_chart', {'labels': [], 'data': {}})
+        assert wait_for(lambda: not broadcaster.clients)
+    broadcaster.stop()
+
+
+def test_metrics_history_query():
+    """The history snapshots of the Socket.IO clients need a login and a valid query"""
+    from nethang import create_app
+    from nethang.extensions import socketio
+    app = create_app()
+    flask_client = app.test_client()
+    client = socketio.test_client(app, flask_test_client=flask_client)
+    assert client.emit('metrics_history', {'id': 9528}, callback=True)['message'] == 'Login required'
+    client.disconnect()
+
+    with flask_client.session_transaction() as session:
+        session['logged_in'] = True
+    client = socketio.test_client(app, flask_test_client=flask_client)
+    ack = client.emit('metrics_history', {'id': 9528, 'window': 1800, 'points': 500, 'method': 'average'}, callback=True)
+    assert ack == {'status': 'error', 'message': 'Invalid query: Invalid downsampling method: average'}
+    client.disconnect()
+
+
+@pytest.mark.parametrize('speed', [0, -2, 'fast'])
+def test_activate_invalid_speed(speed):
+    """An explicit invalid speed is refused, not run at 1x"""
+    from nethang import create_app
+    app = create_app()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    response = client.post('/api/paths/9528/activate', json={'speed': speed})
+    assert response.status_code == 400
+    assert response.get_json() == {'status': 'error', 'message': f'Invalid speed: {speed}'}
+
+
+def test_update_members_invalid_address():
+    """The members reach the kernel commands, an invalid one is refused"""
+    from nethang import create_app
+    app = create_app()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    response = client.put('/api/paths/9528/members', json={'lan_ip': ['10.0.0.1', '10.0.0.2\ncreate x hash:ip']})
+    assert response.status_code == 400
+    assert response.get_json()['message'].startswith('Invalid address')
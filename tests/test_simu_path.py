@@ -0,0 +1,270 @@
+"""
+Tests for nethang/simu_path.py
+
+This module contains tests for the path filters of SimuPath and the events
+of the changes of the paths and of the configuration.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import yaml
+import pytest
+import threading
+import subprocess
+from unittest.mock import Mock, patch
+from nethang.simu_path import SimuPath, SimuPathManager, SimuSettings, FilterSettings, diff_paths, load_yaml, dump_yaml
+
+
+def make_path(**filter_kwargs):
+    filter_settings = {
+        'protocol': 'tcp',
+        'lan_ip': '',
+        'lan_port': 'Any',
+        'wan_ip': '',
+        'wan_port': 'Any',
+        'mark': 9528,
+    }
+    filter_settings.update(filter_kwargs)
+    return SimuPath(
+        filter_settings=FilterSettings(**filter_settings),
+        mode='custom',
+        model='',
+        status='inactive',
+        uplink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+        downlink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+    )
+
+
+@pytest.fixture
+def run_cmd():
+    """Record the commands instead of running them"""
+    with patch.object(SimuPathManager, 'run_cmd') as mock_run_cmd:
+        yield mock_run_cmd
+
+
+class TestFilterSettings:
+    """Test cases for FilterSettings"""
+
+    def test_addresses_from_string_and_list(self):
+        filter_ = FilterSettings(lan_ip='10.0.0.0/24, 10.0.1.5', wan_ip=['1.1.1.1'])
+        assert filter_.get_addresses('lan') == ['10.0.0.0/24', '10.0.1.5']
+        assert filter_.get_addresses('wan') == ['1.1.1.1']
+
+    def test_ports(self):
+        filter_ = FilterSettings(lan_port='80,1000-2000, 3000:3005', wan_port='Any')
+        assert filter_.get_ports('lan') == [(80, 80), (1000, 2000), (3000, 3005)]
+        assert filter_.get_ports('wan') == []
+
+    def test_ipset_selection(self):
+        filter_ = FilterSettings(lan_ip='10.0.0.1', wan_ip='1.1.1.1,8.8.8.8', wan_ipset=None, mark=9530)
+        assert filter_.get_ipset('lan') is None
+        assert filter_.get_ipset('wan') == 'nethang_9530_wan'
+        assert filter_.owns_ipset('wan')
+
+        filter_ = FilterSettings(lan_ip='', lan_ipset='cdn', mark=9530)
+        assert filter_.get_ipset('lan') == 'cdn'
+        assert not filter_.owns_ipset('lan')
+
+
+class TestSimuPathFilter:
+    """Test cases for the iptables rules of SimuPath"""
+
+    def test_single_address_match(self, run_cmd):
+        path = make_path(lan_ip='192.168.1.2', wan_port='443')
+        assert path._iptables_match('uplink') == ' -s 192.168.1.2 -p tcp --dport 443'
+        assert path._iptables_match('downlink') == ' -d 192.168.1.2 -p tcp --sport 443'
+
+    def test_set_and_multiport_match(self, run_cmd):
+        path = make_path(lan_ip='10.0.0.0/24,10.0.1.0/24', lan_port='80,8000-9000')
+        assert path._iptables_match('uplink') == \
+            ' -m set --match-set nethang_9528_lan src -p tcp -m multiport --sports 80,8000:9000'
+        assert path._iptables_match('downlink') == \
+            ' -m set --match-set nethang_9528_lan dst -p tcp -m multiport --dports 80,8000:9000'
+
+    def test_port_set_match(self, run_cmd):
+        path = make_path(wan_port=','.join(str(port) for port in range(1000, 1020)))
+        assert path._iptables_match('uplink') == ' -p tcp -m set --match-set nethang_9528_wan_port dst'
+
+    def test_create_fills_owned_set(self, run_cmd, tmp_path):
+        path = make_path(lan_ip='10.0.0.0/24,10.0.1.0/24')
+        with patch('nethang.simu_path.CONFIG_PATH', str(tmp_path)), \
+                patch('nethang.simu_path.IPT_LOCK_FILE', str(tmp_path / 'ipt.lock')):
+            path.create()
+        commands = [call.args[0] for call in run_cmd.call_args_list]
+        assert commands[0].startswith('ipset restore')
+        assert sum('iptables -t mangle -A FORWARD' in command for command in commands) == 2
+        assert not list(tmp_path.glob('*.ipset'))
+
+    def test_create_fills_port_set(self, run_cmd, tmp_path):
+        path = make_path(wan_port=','.join(str(port) for port in range(1000, 1020)))
+        with patch('nethang.simu_path.CONFIG_PATH', str(tmp_path)), \
+                patch('nethang.simu_path.IPT_LOCK_FILE', str(tmp_path / 'ipt.lock')):
+            path.create()
+        commands = [call.args[0] for call in run_cmd.call_args_list]
+        assert commands[0].startswith('ipset restore')
+        assert sum('--match-set nethang_9528_wan_port' in command for command in commands) == 2
+
+    def test_update_members_swaps_set_only(self, run_cmd, tmp_path):
+        path = make_path(lan_ip='10.0.0.0/24,10.0.1.0/24')
+        path.status = 'active'
+        with patch('nethang.simu_path.CONFIG_PATH', str(tmp_path)):
+            path.update_members(lan_ip=['10.0.2.0/24', '10.0.3.0/24', '10.0.4.0/24'])
+        commands = [call.args[0] for call in run_cmd.call_args_list]
+        assert len(commands) == 1
+        assert commands[0].startswith('ipset restore')
+        assert path.filter.get_addresses('lan') == ['10.0.2.0/24', '10.0.3.0/24', '10.0.4.0/24']
+
+    @pytest.mark.parametrize('members', [['10.0.2.0/24', '10.0.3.1\nflush nethang_9528_lan'],
+                                         '10.0.2.0/24, 10.0.3.1; reboot', ['2001:db8::/32', 'example.com']])
+    def test_update_members_invalid(self, run_cmd, members):
+        path = make_path(lan_ip='10.0.0.0/24,10.0.1.0/24')
+        path.status = 'active'
+        with pytest.raises(ValueError, match='Invalid address'):
+            path.update_members(lan_ip=members)
+        # Nothing run, nothing changed
+        assert run_cmd.call_args_list == []
+        assert path.filter.get_addresses('lan') == ['10.0.0.0/24', '10.0.1.0/24']
+
+
+class TestActivationOptions:
+    """Test cases for the speed and cycles of an activation"""
+
+    @pytest.mark.parametrize('speed, cycles', [(0, None), (-1, None), (1, -2), (2, 3)])
+    def test_invalid_options(self, run_cmd, speed, cycles):
+        # A custom path has no timeline to cycle
+        with pytest.raises(RuntimeError):
+            make_path().activate(speed=speed, cycles=cycles)
+
+    def test_parse_speed(self):
+        assert SimuPath.parse_speed(None) == 1.0
+        assert SimuPath.parse_speed('2.5') == 2.5
+        for speed in [0, -1, float('nan')]:
+            with pytest.raises(ValueError):
+                SimuPath.parse_speed(speed)
+
+    def test_stopped_after_cycles(self):
+        path = make_path()
+        path.status, path.cycles = 'active', 2
+        path.simu_proc = Mock(exitcode=0)
+        manager = Mock(paths={1: path})
+        SimuPathManager._stop_after_cycles(manager, 1, path.simu_proc)
+        manager.deactivate_path.assert_called_once_with(1)
+
+    def test_not_stopped_when_terminated(self):
+        path = make_path()
+        path.status, path.cycles = 'active', 2
+        path.simu_proc = Mock(exitcode=-15)
+        manager = Mock(paths={1: path})
+        SimuPathManager._stop_after_cycles(manager, 1, path.simu_proc)
+        manager.deactivate_path.assert_not_called()
+
+
+@pytest.fixture
+def config_dir(tmp_path):
+    with patch('nethang.simu_path.CONFIG_PATH', str(tmp_path)), \
+            patch('nethang.simu_path.PATHS_FILE', str(tmp_path / 'paths.yaml')), \
+            patch('nethang.simu_path.CONFIG_FILE', str(tmp_path / 'config.yaml')), \
+            patch('nethang.simu_path.ID_LOCK_FILE', str(tmp_path / 'id.lock')):
+        yield tmp_path
+
+
+@pytest.fixture
+def events():
+    events = []
+    with patch.object(SimuPathManager, 'event_sink', lambda event, data=None: events.append((event, data))):
+        yield events
+
+
+class TestChangeEvents:
+    """Test cases for the events of the changes of paths.yaml and config.yaml"""
+
+    def entry(self, id, status='inactive', lan_ip='10.0.0.2'):
+        return {'id': id, 'status': status, 'filter_settings': {'protocol': 'ip', 'lan_ip': lan_ip}}
+
+    def test_diff_paths(self):
+        old = [self.entry(1), self.entry(2), self.entry(3)]
+        new = [self.entry(1, status='active'), self.entry(3, lan_ip='10.0.0.3'), self.entry(4)]
+        assert diff_paths(old, new) == [
+            ('path_removed', {'id': 2}),
+            ('path_status_changed', {'id': 1, 'status': 'active'}),
+            ('path_updated', new[1]),
+            ('path_added', new[2]),
+        ]
+        assert diff_paths(old, old) == []
+
+    def test_save_paths_events(self, config_dir, events):
+        manager = object.__new__(SimuPathManager)
+        manager.save_paths([self.entry(1)])
+        manager.save_paths([self.entry(1, status='active')])
+        manager.save_paths([self.entry(1, status='active')])
+        assert events == [('path_added', self.entry(1)), ('path_status_changed', {'id': 1, 'status': 'active'})]
+        assert manager.load_paths() == [self.entry(1, status='active')]
+
+    def test_save_config_only_when_changed(self, config_dir, events):
+        manager = object.__new__(SimuPathManager)
+        manager.save_config({'lan_interface': 'eth1', 'wan_interface': 'eth0'})
+        manager.save_config({'lan_interface': 'eth1', 'wan_interface': 'eth0'})
+        assert events == [('config_updated', None)]
+
+    def test_yaml_rewritten_by_another_process(self, tmp_path):
+        file = tmp_path / 'paths.yaml'
+        dump_yaml([{'id': 1}], str(file))
+        stat = os.stat(file)
+        # Same size, same modification time
+        file.write_text(file.read_text().replace('1', '2'))
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert load_yaml(str(file)) == [{'id': 2}]
+
+    def test_yaml_replaced_at_once(self, tmp_path):
+        file = tmp_path / 'paths.yaml'
+        dump_yaml([{'id': 1}], str(file))
+        os.chmod(file, 0o640)
+        loaded = []
+        with patch('nethang.simu_path.os.replace', side_effect=lambda src, dst: loaded.append(load_yaml(dst)) or os.rename(src, dst)):
+            dump_yaml([{'id': 1}, {'id': 2}], str(file))
+        # The former content until the new one replaces it
+        assert loaded == [[{'id': 1}]]
+        assert load_yaml(str(file)) == [{'id': 1}, {'id': 2}]
+        assert os.stat(file).st_mode & 0o777 == 0o640
+        assert os.listdir(tmp_path) == ['paths.yaml']
+
+    def test_yaml_parsed_once_per_content(self, tmp_path):
+        file = tmp_path / 'paths.yaml'
+        file.write_text('- id: 1\n')
+        with patch('nethang.simu_path.yaml.safe_load', wraps=yaml.safe_load) as safe_load:
+            assert load_yaml(str(file)) == [{'id': 1}]
+            data = load_yaml(str(file))
+            data.append({'id': 2})
+            assert load_yaml(str(file)) == [{'id': 1}]
+            assert safe_load.call_count == 1
+            file.write_text('- id: 3\n')
+            assert load_yaml(str(file)) == [{'id': 3}]
+            assert safe_load.call_count == 2
+
+
+class TestCliPaths:
+    """Test cases for the paths of paths.yaml applied by the command line"""
+
+    def entry(self, id, pid=None):
+        entry = {'id': id, 'status': 'active', 'filter_settings': {'protocol': 'ip', 'lan_ip': '10.0.0.2'}}
+        if pid is not None:
+            entry['cli'] = {'pid': pid, 'started': 0, 'duration': None}
+        return entry
+
+    def test_reset_keeps_running_cli(self, config_dir, events):
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        manager = object.__new__(SimuPathManager)
+        manager.paths = {}
+        manager.lock = threading.RLock()
+        manager.paths_lock_depth = 0
+        manager.save_paths([self.entry(1), self.entry(2, pid=os.getpid()), self.entry(3, pid=dead.pid)])
+        with patch.object(SimuPath, 'from_dict', side_effect=lambda data: Mock()):
+            manager.refresh_paths()
+            manager.reset_all_paths()
+        # The path of the running command line is neither managed nor reset
+        assert sorted(manager.paths) == [1, 3]
+        assert all(path.deactivate.called for path in manager.paths.values())
+        assert [path['status'] for path in manager.load_paths()] == ['inactive', 'active', 'inactive']
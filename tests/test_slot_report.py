@@ -0,0 +1,78 @@
+"""
+Tests for nethang/slot_report.py
+
+This module contains tests for the per-slot reports of the paths.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import csv
+import io
+import statistics
+import pytest
+from nethang.slot_report import RunningStats, SlotReport
+
+
+def direction_stats(bit_rate, drops=0, queue_packets=0):
+    return {
+        'ingress': {'bitRate': bit_rate, 'packetRate': bit_rate // 8000},
+        'egress': {'bitRate': bit_rate // 2, 'packetRate': bit_rate // 16000},
+        'queue': {'bytes': queue_packets * 1000, 'packets': queue_packets, 'dropPackets': drops, 'dropRate': 0.1},
+    }
+
+
+class TestRunningStats:
+    """Test cases for RunningStats"""
+
+    def test_matches_batch_statistics(self):
+        values = [3.0, 1.5, 8.25, 4.0, 4.0, 10.0]
+        stats = RunningStats()
+        for value in values:
+            stats.add(value)
+        assert stats.count == 6
+        assert stats.mean == pytest.approx(statistics.mean(values))
+        assert stats.stdev == pytest.approx(statistics.stdev(values))
+        assert (stats.min, stats.max) == (1.5, 10.0)
+
+    def test_empty(self):
+        assert RunningStats().to_dict() == {'mean': None, 'stdev': None, 'min': None, 'max': None}
+
+
+class TestSlotReport:
+    """Test cases for SlotReport"""
+
+    def test_attribution(self):
+        report = SlotReport()
+        report.add_sample(0, 0, 1.0, {'uplink': direction_stats(8000, drops=5, queue_packets=3), 'downlink': {}})
+        report.add_sample(0, 0, 2.0, {'uplink': direction_stats(16000, drops=7, queue_packets=9)})
+        report.add_sample(0, 1, 3.0, {'uplink': direction_stats(8000, drops=10, queue_packets=1)})
+        report.add_sample(1, 0, 4.0, {'uplink': direction_stats(8000, drops=2)})
+
+        slots = report.to_dict()['slots']
+        assert [(slot['cycle'], slot['slot']) for slot in slots] == [(0, 0), (0, 1), (1, 0)]
+        first = slots[0]['uplink']
+        assert first['samples'] == 2
+        assert (first['start'], first['end']) == (1.0, 2.0)
+        assert first['drops'] == 7
+        assert first['queueMaxPackets'] == 9
+        assert first['bitRateIn']['mean'] == 12000
+        assert 'downlink' not in slots[0]
+        assert slots[1]['uplink']['drops'] == 3
+        # The counter restarted with the qdisc
+        assert slots[2]['uplink']['drops'] == 2
+
+    def test_bounded_slots(self):
+        report = SlotReport(max_slots=3)
+        for slot in range(5):
+            report.add_sample(0, slot, float(slot), {'uplink': direction_stats(8000)})
+        result = report.to_dict()
+        assert [slot['slot'] for slot in result['slots']] == [2, 3, 4]
+        assert result['slotsDropped'] == 2
+
+    def test_csv(self):
+        report = SlotReport()
+        report.add_sample(0, 0, 1.0, {'uplink': direction_stats(8000), 'downlink': direction_stats(16000)})
+        rows = list(csv.DictReader(io.StringIO(report.to_csv())))
+        assert [(row['slot'], row['direction']) for row in rows] == [('0', 'uplink'), ('0', 'downlink')]
+        assert float(rows[1]['bitRateOut_mean']) == 8000
@@ -0,0 +1,99 @@
+"""
+Tests for the side-effect-free import of the package and the app factory
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import os
+import sys
+import subprocess
+import pytest
+from unittest.mock import patch
+
+# Modules of the web stack, loaded only with the app
+WEB_MODULES = ['flask', 'flask_socketio', 'requests', 'netifaces', 'tomli']
+
+
+def imported_modules(statement: str) -> set:
+    """Modules loaded by a statement in a fresh interpreter"""
+    code = f'{statement}\nimport sys\nprint(" ".join(sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+class TestLazyImports:
+    """Importing the package and its engine does not load the web stack"""
+
+    @pytest.mark.parametrize('module', ['nethang', 'nethang.version', 'nethang.simu_path', 'nethang.cli', 'nethang.control'])
+    def test_no_web_modules(self, module):
+        """The engine modules are imported without Flask, requests, netifaces or tomli"""
+        modules = imported_modules(f'import {module}')
+        assert module in modules
+        assert not modules & set(WEB_MODULES)
+
+    def test_no_files_or_threads(self, tmp_path):
+        """The config directory and the log file are left to the entry points"""
+        code = 'import threading\nimport nethang.simu_path, nethang.cli\nprint(threading.active_count())'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                env={'HOME': str(tmp_path), 'PATH': '/usr/bin:/bin'})
+        assert result.stdout.split() == ['1']
+        assert os.listdir(tmp_path) == []
+
+    def test_app_loads_web_stack(self):
+        """The app is created on its first use"""
+        modules = imported_modules('from nethang import app')
+        assert {'flask', 'flask_socketio', 'nethang.routes'} <= modules
+
+
+class TestAppFactory:
+    """The app factory creates the app without touching the kernel"""
+
+    def test_create_app_once(self):
+        """The app is created once"""
+        from nethang import create_app
+        app = create_app()
+        assert create_app() is app
+        assert app.config['SECRET_KEY']
+        assert 'about' in app.view_functions
+
+    def test_secret_key_kept(self, tmp_path):
+        """The secret key is generated once into a file of its owner, the same for every worker"""
+        import os
+        from nethang import load_secret_key
+        key_file = tmp_path / 'secret_key'
+        with patch('nethang.CONFIG_PATH', str(tmp_path)), patch('nethang.SECRET_KEY_FILE', str(key_file)):
+            key = load_secret_key()
+            assert load_secret_key() == key
+        assert len(key) == 64
+        assert os.stat(key_file).st_mode & 0o777 == 0o600
+        assert os.listdir(tmp_path) == ['secret_key']
+
+    def test_create_app_no_server_init(self):
+        """Creating the app does not initialize the paths"""
+        code = ('from nethang import create_app\n'
+                'create_app()\n'
+                'from nethang.simu_path import SimuPathManager\n'
+                'print(SimuPathManager._instance)')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == 'None'
+
+    def test_init_server(self):
+        """The server initialization prepares the models, the paths and the cleanup"""
+        from nethang import create_app
+        create_app()
+        from nethang import routes
+        with patch.object(routes.SimuPathManager, '__init__', return_value=None) as mock_init, \
+             patch.object(routes.ConfigManager, 'ensure_models') as mock_ensure, \
+             patch('nethang.routes.signal.signal') as mock_signal, \
+             patch.object(routes.SimuPathManager, 'event_sink', None), \
+             patch.object(routes.SimuPathManager, 'start_task', None), \
+             patch.object(routes, 'broadcaster', None):
+            routes.init_server()
+            # The events are queued per client, the monitor runs as a task of the server
+            assert routes.SimuPathManager.event_sink == routes.broadcaster.publish
+            assert routes.SimuPathManager.start_task is not None
+            routes.broadcaster.stop()
+        mock_ensure.assert_called_once()
+        mock_init.assert_called_once()
+        assert mock_signal.call_count == 2
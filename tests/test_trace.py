@@ -0,0 +1,169 @@
+"""
+Tests for nethang/trace.py
+
+This module contains tests for the trace-driven emulation.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import time
+import pytest
+from itertools import islice
+from unittest.mock import patch
+from nethang.trace import TraceFile, TraceSource, merge_directions, coalesce, MIN_RATE
+from nethang.simu_path import SimuPath, SimuPathManager, SimuSettings, FilterSettings
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+class TestTraceFile:
+    """Test cases for TraceFile"""
+
+    def test_mahimahi_bins(self, tmp_path):
+        # 3 opportunities in [0, 100), none in [100, 300), 1 in [300, 400)
+        trace = TraceFile(write(tmp_path, 'up.trace', '0\n10\n10\n350\n'), interval=100)
+        assert trace.format == 'mahimahi'
+        samples = list(trace.samples())
+        assert samples == [
+            (0.1, {'rate_limit': 360, 'throttle_type': 'on'}),
+            (0.2, {'rate_limit': MIN_RATE, 'throttle_type': 'on'}),
+            (0.1, {'rate_limit': 120, 'throttle_type': 'on'}),
+        ]
+        trace.close()
+
+    def test_csv_samples_hold(self, tmp_path):
+        trace = TraceFile(write(tmp_path, 'trace.csv', 'time,rate_limit,delay,loss\n0,1000,20,0\n500,,40,1.5\n'),
+                          interval=100)
+        assert trace.format == 'csv'
+        samples = list(trace.samples())
+        assert samples[0] == (0.5, {'rate_limit': 1000, 'throttle_type': 'on', 'delay': 20, 'jitter': 0,
+                                    'latency_type': 'constant', 'loss': 0.0, 'loss_type': 'off'})
+        assert samples[1] == (0.1, {'delay': 40, 'jitter': 0, 'latency_type': 'constant',
+                                    'loss': 1.5, 'loss_type': 'random'})
+        trace.close()
+
+    def test_csv_without_time(self, tmp_path):
+        trace = TraceFile(write(tmp_path, 'trace.csv', 'rate_limit\n1000\n'))
+        with pytest.raises(ValueError):
+            list(trace.samples())
+        trace.close()
+
+
+class TestTimeslots:
+    """Test cases for the merge and the coalescing of the samples"""
+
+    def test_merge_directions(self):
+        up = iter([(0.3, {'a': 1}), (0.2, {'a': 2})])
+        down = iter([(0.1, {'b': 1}), (0.4, {'b': 2})])
+        assert [(round(d, 6), u, w) for d, u, w in merge_directions(up, down)] == [
+            (0.1, {'a': 1}, {'b': 1}),
+            (0.2, {'a': 1}, {'b': 2}),
+            (0.2, {'a': 2}, {'b': 2}),
+        ]
+
+    def test_coalesce(self):
+        segments = [(0.1, {'a': 1}, {}), (0.1, {'a': 1}, {}), (0.1, {'a': 2}, {})]
+        assert [(round(d, 6), u, w) for d, u, w in coalesce(iter(segments))] == [
+            (0.2, {'a': 1}, {}),
+            (0.1, {'a': 2}, {}),
+        ]
+
+    def test_looping_source(self, tmp_path):
+        path = write(tmp_path, 'up.trace', '0\n150\n')
+        source = TraceSource({'uplink_file': path, 'interval': 100})
+        timeslots = list(islice(source.timeslots(), 4))
+        # The downlink has no trace, the uplink loops over its two bins
+        assert [slot['uplink']['rate_limit'] for slot in timeslots] == [120, 120, 120, 120]
+        assert all(slot['downlink'] == {} for slot in timeslots)
+
+    def test_missing_file(self, tmp_path):
+        with pytest.raises(ValueError):
+            TraceSource({'file': str(tmp_path / 'missing.csv')})
+
+
+class TestRunTimeline:
+    """Test cases for the timeline scheduling of SimuPath"""
+
+    @pytest.fixture
+    def path(self):
+        with patch.object(SimuPathManager, 'run_cmd'):
+            path = SimuPath(
+                filter_settings=FilterSettings(protocol='ip', lan_ip='', lan_port='Any', wan_ip='', wan_port='Any', mark=9528),
+                mode='trace',
+                model='',
+                status='inactive',
+                uplink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+                downlink_settings=SimuSettings(mode='bypass', restrict_settings={}),
+            )
+            yield path
+            del path
+
+    def test_unchanged_direction_not_applied(self, path):
+        timeslots = [
+            {'duration': 0, 'uplink': {'delay': 10}, 'downlink': {'delay': 10}},
+            {'duration': 0, 'uplink': {'delay': 20}, 'downlink': {'delay': 10}},
+        ]
+        with patch.object(SimuPath, '_set_rule') as set_rule:
+            path._run_timeline({'uplink': {}, 'downlink': {}}, enumerate(timeslots))
+        assert [call.args for call in set_rule.call_args_list] == [
+            ('uplink', 'add', {'delay': 10}),
+            ('downlink', 'add', {'delay': 10}),
+            ('uplink', 'change', {'delay': 20}, []),
+        ]
+        assert path.slot_index.value == 1
+
+    def test_late_timeslots_skipped(self, path):
+        timeslots = [{'duration': 0.01, 'uplink': {'delay': index}, 'downlink': {}} for index in range(3)]
+        applied = []
+
+        def slow_set_rule(direction, opt, config, batch=None):
+            if direction == 'uplink':
+                applied.append(config['delay'])
+                if config['delay'] == 0:
+                    # Applying the first timeslot takes longer than the second one lasts
+                    time.sleep(0.025)
+
+        with patch.object(SimuPath, '_set_rule', side_effect=slow_set_rule):
+            path._run_timeline({'uplink': {}, 'downlink': {}}, enumerate(timeslots))
+        assert applied == [0, 2]
+
+    def test_speed(self, path):
+        timeslots = [{'duration': 0.2, 'uplink': {}, 'downlink': {}}, {'duration': 0.01, 'uplink': {}, 'downlink': {}}]
+        path.speed = 4
+        with patch.object(SimuPath, '_set_rule'), patch.object(SimuPathManager, 'min_slot_duration', 0.03):
+            start = time.monotonic()
+            path._run_timeline({'uplink': {}, 'downlink': {}}, enumerate(timeslots))
+            elapsed = time.monotonic() - start
+        # 0.2 / 4, then the lower bound instead of 0.01 / 4
+        assert 0.08 <= elapsed < 0.15
+
+    def test_trace_cycles(self, tmp_path):
+        path = write(tmp_path, 'up.trace', '0\n150\n')
+        timeslots = list(TraceSource({'uplink_file': path, 'interval': 100}, cycles=3).timeslots())
+        assert sum(slot['duration'] for slot in timeslots) == pytest.approx(0.6)
+
+    def test_model_cycles(self, path):
+        model = {'global': {'uplink': {}, 'downlink': {}},
+                 'timeline': [{'duration': 0, 'uplink': {'delay': 1}}, {'duration': 0, 'uplink': {'delay': 2}}]}
+        path.mode, path.cycles = 'model', 3
+        with patch.object(SimuPathManager, '_instance', None), patch.object(SimuPathManager, '__init__', return_value=None), \
+                patch.object(SimuPathManager, 'get_model_settings', return_value=model), \
+                patch.object(SimuPath, '_cleanup'), patch.object(SimuPath, '_run_timeline') as run_timeline:
+            SimuPathManager.models = {'': model}
+            try:
+                path._run_model()
+            finally:
+                del SimuPathManager.models
+        assert [index for index, _ in run_timeline.call_args.args[1]] == [0, 1, 0, 1, 0, 1]
+
+    def test_cycles_counted(self, path):
+        timeslots = [(index, {'duration': 0, 'uplink': {'delay': n}, 'downlink': {}}) for n, index in enumerate([0, 1, 0, 1])]
+        cycles = []
+        with patch.object(SimuPath, '_set_rule', side_effect=lambda *args: cycles.append(path.cycle_index.value)):
+            path._run_timeline({'uplink': {}, 'downlink': {}}, iter(timeslots))
+        assert cycles == [0, 0, 0, 1, 1]
@@ -0,0 +1,91 @@
+"""
+Tests for nethang/traffic_monitor.py
+
+This module contains tests for the statistics parsing and the sampling
+interval of TrafficMonitor.
+
+Author: Hang Yin
+Date: 2025-06-25
+"""
+
+import time
+import pytest
+from nethang.traffic_monitor import TrafficMonitor
+
+IPTABLES_OUTPUT = """Chain FORWARD (policy ACCEPT 0 packets, 0 bytes)
+    pkts      bytes target     prot opt in     out     source               destination
+     {up_pkts}    {up_bytes} MARK       all  --  eth1   eth0    0.0.0.0/0            0.0.0.0/0            MARK set 0x2538
+     {down_pkts}    {down_bytes} MARK       all  --  eth0   eth1    0.0.0.0/0            0.0.0.0/0            MARK set 0x2538
+"""
+
+TC_OUTPUT = """qdisc htb 9527: root refcnt 2 r2q 10 default 0xffff direct_packets_stat 0 direct_qlen 1000
+ Sent 0 bytes 0 pkt (dropped 0, overlimits 0 requeues 0)
+ backlog 0b 0p requeues 0
+qdisc netem 9528: parent 9527:9528 limit 1000
+ Sent {bytes} bytes {pkts} pkt (dropped {drops}, overlimits 0 requeues 0)
+ backlog 3000b 2p requeues 0
+"""
+
+
+@pytest.fixture
+def monitor():
+    return TrafficMonitor(id_range=(9528, 9529), lan_iface='eth1', wan_iface='eth0')
+
+
+def sample(monitor, up_bytes, tc_bytes, wall_time, monotonic_time):
+    iptables_output = IPTABLES_OUTPUT.format(up_pkts=10, up_bytes=up_bytes, down_pkts=0, down_bytes=0)
+    tc_output = TC_OUTPUT.format(bytes=tc_bytes, pkts=10, drops=1)
+    monitor.stats = monitor._process_stats(iptables_output, tc_output, tc_output, wall_time, monotonic_time)
+    return monitor.stats
+
+
+class TestTrafficMonitor:
+    """Test cases for TrafficMonitor"""
+
+    def test_process_stats(self, monitor):
+        stats = sample(monitor, 1000, 500, 1000.0, 10.0)
+        uplink = stats['9528']['trafficStats']['uplink']
+        assert uplink['ingress']['bytes'] == 1000 + 10 * TrafficMonitor.ETHERNET_HEADER_SIZE
+        assert uplink['egress']['bytes'] == 500
+        assert uplink['queue'] == {'bytes': 3000, 'packets': 2, 'dropPackets': 1, 'dropRate': 0.1}
+
+    def test_rates_use_monotonic_time(self, monitor):
+        sample(monitor, 1000, 500, 1000.0, 10.0)
+        # The wall clock jumps back, 100ms elapsed on the monotonic clock
+        stats = sample(monitor, 2000, 1500, 990.0, 10.1)
+        uplink = stats['9528']['trafficStats']['uplink']
+        assert uplink['ingress']['bitRate'] == 80000
+        assert uplink['egress']['bitRate'] == 80000
+
+    def test_interval_backs_off_over_cpu_budget(self, monitor):
+        monitor.interval = 0.1
+        monitor.cpu_budget = 0.1
+        # 20ms per sample within a 10% budget allows one sample every 200ms
+        assert monitor._next_interval(0.02) == pytest.approx(0.2)
+        monitor.cpu_budget = 0
+        assert monitor._next_interval(0.02) == pytest.approx(0.1)
+
+    def test_cost_of_own_queries(self, monitor):
+        class SlowBackend:
+            def query(self, cmd):
+                time.sleep(0.05)
+                return ''
+        monitor.backend = SlowBackend()
+        start = monitor._cpu_time()
+        monitor._get_current_stats()
+        # Three queries waited on, nothing else of the process is charged
+        assert monitor.query_time >= 0.15
+        assert 0.15 <= monitor._cpu_time() - start < 1
+
+    def test_interval_callback_and_floor(self, monitor):
+        monitor.interval_callback = lambda: 0.01
+        assert monitor._next_interval(0) == TrafficMonitor.MIN_INTERVAL
+
+    def test_chart_data_sequence(self, monitor):
+        stats = sample(monitor, 1000, 500, 1000.0, 10.0)
+        monitor._append_chart_data(stats, 1000.0)
+        monitor._append_chart_data(stats, 1001.0)
+        # The clients append the samples since the sequence they last saw
+        assert monitor.data_to_emit['seq'] == 2
+        assert monitor.data_to_emit['data']['9528']['uplink']['queuePackets'][-2:] == [2, 2]
+        assert monitor.data_to_emit['labels'][-3] is None